@@ -5,4 +5,6 @@ Copyright: 2018-2019
 """
 
 from .discovery import Discovery  # noqa:F401
-from .image_disc import image_discovery  # noqa:F401
+from .image_disc import image_discovery, raster_header  # noqa:F401
+from .catalog import load_catalog, read_catalog, write_catalog  # noqa:F401
+from .catalog import merge_catalogs  # noqa:F401
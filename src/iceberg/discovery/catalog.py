@@ -0,0 +1,141 @@
+"""
+Author: Ioannis Paraskevakos
+License: MIT
+Copyright: 2018-2019
+"""
+
+import os
+import csv
+
+from .image_disc import write_columns
+
+# Columns that hold integers, the rest besides Filename and Dtype are floats
+_INT_COLUMNS = ['Size', 'Width', 'Height', 'Bands']
+
+
+def _from_csv(key, value):
+    '''
+    Converts a CSV catalog field to its Python value. Empty fields are None.
+    '''
+
+    if value == '' or key in ['Filename', 'Dtype']:
+        return value or None
+    if key in _INT_COLUMNS:
+        return int(value)
+    if key == 'Geotransform':
+        return tuple(float(num) for num in value.split())
+
+    return float(value)
+
+
+def _from_array(key, array):
+    '''
+    Converts a NumPy catalog column to a list of Python values. -1, NaN and
+    empty strings are the missing values of the npz format.
+    '''
+
+    values = array.tolist()
+    if key in _INT_COLUMNS:
+        return [None if value < 0 else value for value in values]
+    if key == 'Geotransform':
+        return [None if value[0] != value[0] else tuple(value)
+                for value in values]
+    if key == 'Nodata':
+        return [None if value != value else value for value in values]
+
+    return [value or None for value in values]
+
+
+def load_catalog(filename):
+    '''
+    Loads a discovery catalog and returns it as a dictionary of columns. The
+    format is selected by the file extension: csv, npz or parquet.
+
+    :Arguments:
+        :filename: The catalog file, str
+    '''
+
+    ext = os.path.splitext(filename)[1]
+    columns = dict()
+    if ext == '.npz':
+        import numpy as np
+        with np.load(filename) as arrays:
+            for key in arrays.files:
+                columns[key] = _from_array(key, arrays[key])
+    elif ext == '.parquet':
+        import pyarrow.parquet as pq
+        columns = pq.read_table(filename).to_pydict()
+        if 'Geotransform' in columns:
+            columns['Geotransform'] = [tuple(value) if value else None
+                                       for value in columns['Geotransform']]
+    else:
+        with open(filename, 'rt') as images_csv:
+            reader = csv.reader(images_csv)
+            header = next(reader, None) or ['Filename']
+            columns = dict((key, list()) for key in header)
+            for row in reader:
+                for key, value in zip(header, row):
+                    columns[key].append(_from_csv(key, value))
+
+    return columns
+
+
+def read_catalog(filename):
+    '''
+    Reads a discovery catalog and returns a list of (filepath, size) tuples.
+    The size is in MBs, or None when the catalog has no Size column.
+
+    :Arguments:
+        :filename: The catalog file, str
+    '''
+
+    columns = load_catalog(filename)
+    sizes = columns.get('Size', [None] * len(columns['Filename']))
+
+    return list(zip(columns['Filename'], sizes))
+
+
+def write_catalog(filename, columns):
+    '''
+    Writes a dictionary of columns as a discovery catalog. The format is
+    selected by the file extension: csv, npz or parquet.
+    '''
+
+    base, ext = os.path.splitext(filename)
+    write_columns(base, ext[1:] or 'csv', columns)
+
+
+def merge_catalogs(catalogs, filename=None):
+    '''
+    Merges the catalogs of several discovery tasks into one. An image that
+    is listed more than once, for example because two input paths overlap,
+    is kept only the first time it is found. Returns the merged list of
+    (filepath, size) tuples. Columns that only some catalogs have are
+    filled with None.
+
+    :Arguments:
+        :catalogs: A list with the catalog files, list
+        :filename: When set, the merged catalog is also written to this file,
+                   in the format of its extension
+    '''
+
+    seen = set()
+    merged = {'Filename': list(), 'Size': list()}
+    for catalog in catalogs:
+        columns = load_catalog(catalog)
+        count = len(merged['Filename'])
+        for key in columns:
+            merged.setdefault(key, [None] * count)
+        for idx, filepath in enumerate(columns['Filename']):
+            key = os.path.normpath(filepath)
+            if key in seen:
+                continue
+            seen.add(key)
+            for column, values in merged.items():
+                values.append(columns[column][idx] if column in columns
+                              else None)
+
+    if filename:
+        write_catalog(filename, merged)
+
+    return list(zip(merged['Filename'], merged['Size']))
@@ -5,8 +5,20 @@ Copyright: 2018-2019
 """
 
 import os
+from concurrent.futures import ProcessPoolExecutor
 import radical.entk as re
 
+from .image_disc import image_discovery, commit_manifest
+
+
+def _discover(kwargs):
+    '''
+    Runs image_discovery with a dictionary of arguments, so it can be mapped
+    over a process pool.
+    '''
+
+    image_discovery(**kwargs)
+
 
 class Discovery():
     '''
@@ -25,6 +37,7 @@ class Discovery():
         self._modules = None
         self._pre_execs = None
         self._paths = None
+        self._catalogs = list()
 
         if modules:
             if isinstance(modules, list):
@@ -44,18 +57,32 @@ class Discovery():
             else:
                 self._pre_execs = [pre_execs]
 
-    def generate_discover_pipe(self, filetype='csv', img_ftype='tif'):
+    @property
+    def catalogs(self):
         '''
-        This function takes as an input paths on Bridges and returns a pipeline
-        that will provide a file for all the images that exist in that path.
+        The catalog files the discovery tasks of the last generated pipeline
+        write and download.
         '''
-        pipeline = re.Pipeline()
-        pipeline.name = 'Disc'
-        stage = re.Stage()
-        stage.name = 'Disc.S0'
 
-        if self._paths is None:
-            raise RuntimeError('Images paths are not set.')
+        return self._catalogs
+
+    @staticmethod
+    def manifest_path(manifests, path, shard=0, shards=1):
+        '''
+        Returns the manifest file of an images path. Every path and shard gets
+        its own manifest so discovery tasks never write the same file.
+        '''
+
+        name = os.path.normpath(path).strip('/').replace('/', '_') or 'root'
+        if shards > 1:
+            name = '%s.%dof%d' % (name, shard, shards)
+
+        return '%s/%s.csv' % (manifests.rstrip('/'), name)
+
+    def _resolve_pre_execs(self):
+        '''
+        Returns the pre_exec commands of the discovery tasks.
+        '''
 
         # Create the module load list
         modules_load = list()
@@ -70,23 +97,247 @@ class Discovery():
         else:
             tmp_pre_execs = tmp_pre_execs + modules_load
 
-        for i in range(len(self._paths)):
-            task = re.Task()
-            task.name = 'Disc.T%d' % i
-            task.pre_exec = tmp_pre_execs
-            task.executable = 'python'   # Assign executable to the task
-            task.arguments = ['image_disc.py', '%s' % self._paths[i],
-                              '--image_ftype=%s' % img_ftype,
-                              '--filename=images%d' % i,
-                              '--filetype=%s' % filetype, '--filesize']
-            task.download_output_data = ['images%d.csv' % i]
-            task.upload_input_data = [os.path.dirname(os.path.abspath(__file__))
-                                      + '/image_disc.py']
-            task.cpu_reqs = {'cpu_processes': 1, 'cpu_process_type': '',
-                             'cpu_threads': 1,
-                             'cpu_thread_type': 'OpenMP'}
-            stage.add_tasks(task)
+        return tmp_pre_execs
+
+    # pylint: disable=too-many-arguments
+    def _generate_task(self, idx, path, pre_execs, filetype, img_ftype,
+                       walk, recursive, threads, manifests, changed_only,
+                       checksum, shard, shards, metadata):
+        '''
+        Creates the discovery task of a single path shard. The task writes
+        and downloads images<idx>.<filetype>.
+        '''
+
+        task = re.Task()
+        task.name = 'Disc.T%d' % idx
+        task.pre_exec = pre_execs
+        task.executable = 'python'   # Assign executable to the task
+        arguments = ['image_disc.py', '%s' % path,
+                     '--image_ftype=%s' % img_ftype,
+                     '--filename=images%d' % idx,
+                     '--filetype=%s' % filetype, '--filesize']
+        if walk != 'glob':
+            arguments.append('--walk=%s' % walk)
+        if recursive:
+            arguments.append('--recursive')
+        if threads > 1:
+            arguments.append('--threads=%d' % threads)
+        if manifests:
+            arguments.append('--manifest=%s' %
+                             self.manifest_path(manifests, path, shard,
+                                                shards))
+            if changed_only:
+                arguments.append('--changed_only')
+            if checksum:
+                arguments.append('--checksum')
+        if shards > 1:
+            arguments += ['--shard=%d' % shard, '--shards=%d' % shards]
+        if metadata:
+            arguments.append('--metadata')
+        task.arguments = arguments
+        task.download_output_data = ['images%d.%s' % (idx, filetype)]
+        task.upload_input_data = [os.path.dirname(os.path.abspath(__file__))
+                                  + '/image_disc.py']
+        task.cpu_reqs = {'cpu_processes': 1, 'cpu_process_type': '',
+                         'cpu_threads': threads,
+                         'cpu_thread_type': 'OpenMP'}
+
+        return task
+
+    # pylint: disable=too-many-arguments
+    def _generate_tasks(self, filetype='csv', img_ftype='tif', walk='glob',
+                        recursive=False, threads=1, manifests=None,
+                        changed_only=False, checksum=False, shards=1,
+                        metadata=False):
+        '''
+        Creates one discovery task for every path and shard, and records the
+        catalog each of them writes.
+        '''
+
+        if self._paths is None:
+            raise RuntimeError('Images paths are not set.')
+
+        tmp_pre_execs = self._resolve_pre_execs()
+
+        tasks = list()
+        self._catalogs = list()
+        for path in self._paths:
+            for shard in range(shards):
+                idx = len(self._catalogs)
+                task = self._generate_task(idx, path, tmp_pre_execs, filetype,
+                                           img_ftype, walk, recursive, threads,
+                                           manifests, changed_only, checksum,
+                                           shard, shards, metadata)
+                self._catalogs.append('images%d.%s' % (idx, filetype))
+                tasks.append(task)
+
+        return tasks
+
+    def generate_discover_pipe(self, filetype='csv', img_ftype='tif',
+                               walk='glob', recursive=False, threads=1,
+                               manifests=None, changed_only=False,
+                               checksum=False, shards=1, metadata=False):
+        '''
+        This function takes as an input paths on Bridges and returns a pipeline
+        that will provide a file for all the images that exist in that path.
+        Every path is discovered by shards tasks, task i writes
+        images<i>.<filetype>.
+        The list of files is available as the catalogs property and can be
+        merged with iceberg.discovery.merge_catalogs.
+
+        :Arguments:
+            :filetype: Format of the output file, csv, npz or parquet, str
+            :img_ftype: The file extension of the images, str
+            :walk: 'glob' or 'scandir'. The scandir walk reuses the directory
+                   entries and spreads listing and stats over threads.
+            :recursive: Whether subdirectories are discovered too, bool
+            :threads: Number of threads of each discovery task, int
+            :manifests: Directory on the resource where a persistent manifest
+                        is kept for every path. Default: None
+            :changed_only: Whether only images that are new or changed since
+                           the last committed discovery are listed, see
+                           generate_commit_pipe, bool
+            :checksum: Whether the manifests keep a hash of every image, bool
+            :shards: Number of tasks each path is split over. Subdirectories
+                     and files are assigned to tasks by the hash of their
+                     name. Default: 1
+            :metadata: Whether the raster headers (width, height, bands,
+                       dtype, geotransform and nodata) are discovered too,
+                       bool
+        '''
+        pipeline = re.Pipeline()
+        pipeline.name = 'Disc'
+        stage = re.Stage()
+        stage.name = 'Disc.S0'
+
+        tasks = self._generate_tasks(filetype, img_ftype, walk, recursive,
+                                     threads, manifests, changed_only,
+                                     checksum, shards, metadata)
+        stage.add_tasks(tasks)
         # Add Stage to the Pipeline
         pipeline.add_stages(stage)
 
         return pipeline
+
+    def generate_discover_pipes(self, **kwargs):
+        '''
+        Returns one pipeline for every discovery task instead of a single
+        pipeline. Pipeline i runs the task that writes catalogs[i], so its
+        stages can be extended as soon as that part of the images is known.
+        Accepts the same arguments as generate_discover_pipe.
+        '''
+
+        pipelines = list()
+        for idx, task in enumerate(self._generate_tasks(**kwargs)):
+            pipeline = re.Pipeline()
+            pipeline.name = 'Disc%d' % idx
+            stage = re.Stage()
+            stage.name = 'Disc%d.S0' % idx
+            stage.add_tasks(task)
+            pipeline.add_stages(stage)
+            pipelines.append(pipeline)
+
+        return pipelines
+
+    def _manifests(self, manifests, shards=1):
+        '''
+        Returns the (path, manifest) of every path and shard.
+        '''
+
+        if self._paths is None:
+            raise RuntimeError('Images paths are not set.')
+
+        return [(path, self.manifest_path(manifests, path, shard, shards))
+                for path in self._paths for shard in range(shards)]
+
+    def generate_commit_pipe(self, manifests, shards=1):
+        '''
+        Returns a pipeline whose task replaces the manifest of every path and
+        shard with its pending manifest, see image_disc.commit_manifest. It
+        runs once the images a changed_only discovery listed are analyzed.
+
+        :Arguments:
+            :manifests: Directory on the resource with the manifests, str
+            :shards: Number of shards every path was discovered in, int
+        '''
+
+        stage = re.Stage()
+        stage.name = 'Commit.S0'
+        task = re.Task()
+        task.name = 'Commit.S0.T0'
+        task.pre_exec = self._resolve_pre_execs()
+        task.executable = '/bin/sh'
+        task.arguments = ['-c', ' && '.join(
+            'python image_disc.py %s --manifest=%s --commit' %
+            (path, manifest)
+            for path, manifest in self._manifests(manifests, shards))]
+        task.upload_input_data = [os.path.dirname(os.path.abspath(__file__))
+                                  + '/image_disc.py']
+        stage.add_tasks(task)
+        pipeline = re.Pipeline()
+        pipeline.name = 'Commit'
+        pipeline.add_stages(stage)
+
+        return pipeline
+
+    def commit_local(self, manifests, shards=1):
+        '''
+        Replaces the manifest of every path and shard with its pending
+        manifest in the calling process, like generate_commit_pipe.
+        '''
+
+        for _, manifest in self._manifests(manifests, shards):
+            commit_manifest(manifest)
+
+    # pylint: disable=too-many-arguments, too-many-locals
+    def discover_local(self, filetype='csv', img_ftype='tif', walk='glob',
+                       recursive=False, threads=1, manifests=None,
+                       changed_only=False, checksum=False, shards=1,
+                       metadata=False, processes=None):
+        '''
+        Discovers the images in the calling process instead of an EnTK task.
+        The paths have to be visible from this host. Every path and shard is
+        discovered by image_discovery and writes images<i>.<filetype> in the
+        current directory, the same catalogs generate_discover_pipe would
+        download. Returns the list of catalogs.
+
+        :Arguments:
+            :processes: Number of processes the paths and shards are
+                        discovered with. Default: one per path and shard, up
+                        to the number of CPUs.
+            The rest of the arguments are the ones of generate_discover_pipe.
+        '''
+
+        if self._paths is None:
+            raise RuntimeError('Images paths are not set.')
+
+        jobs = list()
+        self._catalogs = list()
+        for path in self._paths:
+            for shard in range(shards):
+                idx = len(self._catalogs)
+                manifest = None
+                if manifests:
+                    manifest = self.manifest_path(manifests, path, shard,
+                                                  shards)
+                jobs.append({'path': path, 'filename': 'images%d' % idx,
+                             'filetype': filetype, 'filesize': True,
+                             'image_ftype': img_ftype, 'walk': walk,
+                             'recursive': recursive, 'threads': threads,
+                             'manifest': manifest,
+                             'changed_only': changed_only,
+                             'checksum': checksum, 'shard': shard,
+                             'shards': shards, 'metadata': metadata})
+                self._catalogs.append('images%d.%s' % (idx, filetype))
+
+        if processes is None:
+            processes = min(len(jobs), os.cpu_count() or 1)
+
+        if processes > 1:
+            with ProcessPoolExecutor(max_workers=processes) as pool:
+                list(pool.map(_discover, jobs))
+        else:
+            for job in jobs:
+                _discover(job)
+
+        return self._catalogs
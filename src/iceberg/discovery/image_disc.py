@@ -2,44 +2,525 @@
 Image Discovery Kernel
 ==========================================================
 This script takes as input a path and returns a dataframe
-with all the images and their size.
+with all the images and their size. The raster header of
+every image can be included as well. The dataframe is
+written as CSV, NumPy npz or Parquet.
 Author: Ioannis Paraskevakos
 License: MIT
 Copyright: 2018-2019
 """
 from glob import glob
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 import argparse
+import hashlib
 import os
 import math
 import csv
+import struct
+import zlib
+
+MANIFEST_HEADER = ('Filename', 'Size', 'Mtime', 'Hash')
+RASTER_COLUMNS = ('Width', 'Height', 'Bands', 'Dtype', 'Geotransform',
+                  'Nodata')
+
+# TIFF field types and their size in bytes
+_TIFF_TYPES = {1: ('B', 1), 2: ('s', 1), 3: ('H', 2), 4: ('I', 4),
+               5: ('II', 8), 6: ('b', 1), 7: ('B', 1), 8: ('h', 2),
+               9: ('i', 4), 10: ('ii', 8), 11: ('f', 4), 12: ('d', 8),
+               16: ('Q', 8), 17: ('q', 8), 18: ('Q', 8)}
+_TIFF_TAGS = {256: 'width', 257: 'height', 258: 'bits', 277: 'bands',
+              339: 'format', 33550: 'scale', 33922: 'tiepoint',
+              34264: 'transformation', 42113: 'nodata'}
+_TIFF_FORMATS = {1: 'uint', 2: 'int', 3: 'float'}
+_PNG_BANDS = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}
+
+
+def in_shard(name, shard=0, shards=1):
+    """
+    Returns whether a file or subdirectory name belongs to a shard. The crc32
+    of the name is used, so every discovery task agrees on the split without
+    talking to the others.
+    """
+
+    if shards <= 1:
+        return True
+
+    return zlib.crc32(name.encode('utf-8')) % shards == shard
+
+
+def _scan_dir(path, image_ftype, recursive, shard=0, shards=1):
+    """
+    This function lists a single directory with os.scandir. It returns the
+    matching image entries and, when recursive, the subdirectories that still
+    need to be scanned. Hidden files are skipped, the same way glob does.
+    Entries that do not belong to the shard are skipped, so a shard never
+    descends into the subdirectories of another shard.
+    """
+
+    suffix = '.%s' % image_ftype
+    entries = list()
+    subdirs = list()
+    with os.scandir(path) as scanner:
+        for entry in scanner:
+            if entry.name.startswith('.') or \
+                    not in_shard(entry.name, shard, shards):
+                continue
+            if entry.is_dir():
+                if recursive:
+                    subdirs.append(entry.path)
+            elif entry.name.endswith(suffix) and entry.is_file():
+                entries.append(entry)
+
+    return entries, subdirs
+
+
+def _stat_entries(entries):
+    """
+    Stats a chunk of DirEntry objects. DirEntry caches the result, so every
+    file is stat'ed exactly once.
+    """
+
+    return [(entry.path, entry.stat()) for entry in entries]
+
+
+def _glob_images(path, image_ftype, recursive, shard=0, shards=1):
+    """
+    Lists the images of a path with a single glob call, sorted by filepath.
+    Images are assigned to shards by the first component of their path
+    relative to the images path, the same way the scandir walk does.
+    """
+
+    if recursive:
+        filepaths = glob(path + '/**/*.%s' % image_ftype, recursive=True)
+    else:
+        filepaths = glob(path + '/*.%s' % image_ftype)
+
+    if shards > 1:
+        filepaths = [filepath for filepath in filepaths
+                     if in_shard(os.path.relpath(filepath, path).
+                                 split(os.sep)[0], shard, shards)]
+
+    return sorted(filepaths)
+
+
+def scan_images(path, image_ftype='tif', recursive=False, threads=1,
+                stat=True, shard=0, shards=1):
+    """
+    This function walks a path with os.scandir and returns a sorted list of
+    (filepath, os.stat_result) tuples. The stat result is None when stat is
+    False.
+    :Arguments:
+        :path: Images path, str
+        :image_ftype: The image file extension, str
+        :recursive: Whether subdirectories are scanned too. Default: False
+        :threads: Number of threads that list directories and stat files
+                  concurrently. Default: 1
+        :stat: Whether the files are stat'ed. Default: True
+        :shard: The shard that is scanned. Default: 0
+        :shards: The number of shards the path is split in. Default: 1
+    """
+
+    threads = max(1, int(threads))
+    entries = list()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        pending = {pool.submit(_scan_dir, path, image_ftype, recursive,
+                               shard, shards)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                found, subdirs = future.result()
+                entries.extend(found)
+                for subdir in subdirs:
+                    pending.add(pool.submit(_scan_dir, subdir, image_ftype,
+                                            recursive))
+
+        if stat:
+            chunk = max(1, int(math.ceil(len(entries) / threads)))
+            chunks = [entries[i:i + chunk]
+                      for i in range(0, len(entries), chunk)]
+            images = [image for stats in pool.map(_stat_entries, chunks)
+                      for image in stats]
+        else:
+            images = [(entry.path, None) for entry in entries]
+
+    images.sort(key=lambda image: image[0])
+
+    return images
+
+
+def file_hash(filepath, blocksize=4194304):
+    """
+    Returns the SHA-256 hex digest of a file, read in blocks of blocksize
+    bytes.
+    """
+
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as image:
+        for block in iter(lambda: image.read(blocksize), b''):
+            digest.update(block)
+
+    return digest.hexdigest()
+
+
+def read_manifest(manifest):
+    """
+    Reads a discovery manifest and returns a dictionary that maps every
+    filepath to a (size, mtime, hash) tuple. Size is in bytes, mtime in
+    nanoseconds and hash is an empty string when it was not computed. A
+    missing manifest is treated as an empty one.
+    """
+
+    entries = dict()
+    if not os.path.isfile(manifest):
+        return entries
+
+    with open(manifest, 'rt') as manifest_csv:
+        reader = csv.reader(manifest_csv)
+        _ = next(reader, None)
+        for filepath, size, mtime, digest in reader:
+            entries[filepath] = (int(size), int(mtime), digest)
+
+    return entries
+
+
+def write_manifest(manifest, entries):
+    """
+    Writes a discovery manifest. The file is written next to its final
+    location and then renamed, so a killed discovery never leaves a truncated
+    manifest behind.
+    """
+
+    manifest_dir = os.path.dirname(os.path.abspath(manifest))
+    if not os.path.isdir(manifest_dir):
+        os.makedirs(manifest_dir)
+    tmp_manifest = '%s.%d.tmp' % (manifest, os.getpid())
+    with open(tmp_manifest, 'wt') as manifest_csv:
+        writer = csv.writer(manifest_csv)
+        writer.writerow(MANIFEST_HEADER)
+        for filepath in sorted(entries):
+            size, mtime, digest = entries[filepath]
+            writer.writerow((filepath, size, mtime, digest))
+    os.replace(tmp_manifest, manifest)
+
+
+def pending_manifest(manifest):
+    """
+    Returns the path of the pending manifest of a manifest.
+    """
+
+    return '%s.pending' % manifest
+
+
+def update_manifest(manifest, images, checksum=False, pending=False):
+    """
+    Compares the discovered images with a manifest, rewrites the manifest and
+    returns the images that are new or changed since the manifest was last
+    written.
+    :Arguments:
+        :manifest: The manifest file path, str
+        :images: A list of (filepath, os.stat_result) tuples
+        :checksum: Whether a content hash is kept. An image whose size or
+                   mtime changed but whose hash did not is reported unchanged.
+        :pending: Whether the pending manifest is written instead, so the
+                  manifest stays as it is until commit_manifest.
+    """
+
+    previous = read_manifest(manifest)
+    entries = dict()
+    changed = list()
+    for filepath, stat in images:
+        entry = previous.get(filepath)
+        digest = entry[2] if entry else ''
+        is_changed = entry is None or \
+            entry[:2] != (stat.st_size, stat.st_mtime_ns)
+        if checksum and (is_changed or not digest):
+            digest = file_hash(filepath)
+            if entry is not None and entry[2]:
+                is_changed = digest != entry[2]
+        entries[filepath] = (stat.st_size, stat.st_mtime_ns, digest)
+        if is_changed:
+            changed.append((filepath, stat))
+
+    write_manifest(pending_manifest(manifest) if pending else manifest,
+                   entries)
+
+    return changed
+
+
+def commit_manifest(manifest):
+    """
+    Replaces a manifest with its pending manifest, once the images the
+    pending manifest reported as changed are analyzed. Returns whether there
+    was a pending manifest.
+    """
+
+    if not os.path.isfile(pending_manifest(manifest)):
+        return False
+    os.replace(pending_manifest(manifest), manifest)
+
+    return True
+
+
+def _tiff_value(image, order, ftype, count, payload, offset_fmt):
+    """
+    Decodes the value of a TIFF IFD entry. Values that do not fit in the
+    entry are read from their offset.
+    """
+
+    fmt, size = _TIFF_TYPES[ftype]
+    if size * count > len(payload):
+        image.seek(struct.unpack(order + offset_fmt, payload)[0])
+        payload = image.read(size * count)
+    else:
+        payload = payload[:size * count]
+
+    if ftype == 2:
+        return payload.split(b'\0')[0].decode('ascii', 'replace')
+
+    values = struct.unpack('%s%d%s' % (order, count * len(fmt), fmt[0]),
+                           payload)
+    if ftype in [5, 10]:
+        values = tuple(num / den if den else 0.0
+                       for num, den in zip(values[::2], values[1::2]))
+
+    return values
+
+
+def _tiff_header(image, order, bigtiff):
+    """
+    Reads the first IFD of a (Big)TIFF file and returns its raster metadata.
+    Only the tags of _TIFF_TAGS are decoded, pixel data are never read.
+    """
+
+    if bigtiff:
+        image.seek(8)
+        image.seek(struct.unpack(order + 'Q', image.read(8))[0])
+        count_fmt, entry_size, offset_fmt = 'Q', 20, 'Q'
+    else:
+        image.seek(4)
+        image.seek(struct.unpack(order + 'I', image.read(4))[0])
+        count_fmt, entry_size, offset_fmt = 'H', 12, 'I'
+
+    count_size = struct.calcsize(count_fmt)
+    offset_size = struct.calcsize(offset_fmt)
+    entries = struct.unpack(order + count_fmt, image.read(count_size))[0]
+    ifd = image.read(entries * entry_size)
+    tags = dict()
+    for idx in range(entries):
+        entry = ifd[idx * entry_size:(idx + 1) * entry_size]
+        tag, ftype = struct.unpack(order + 'HH', entry[:4])
+        if tag not in _TIFF_TAGS or ftype not in _TIFF_TYPES:
+            continue
+        count, = struct.unpack(order + offset_fmt,
+                               entry[4:4 + offset_size])
+        payload = entry[4 + offset_size:]
+        tags[_TIFF_TAGS[tag]] = _tiff_value(image, order, ftype, count,
+                                            payload, offset_fmt)
+
+    header = dict.fromkeys(RASTER_COLUMNS)
+    header['Width'] = tags['width'][0] if 'width' in tags else None
+    header['Height'] = tags['height'][0] if 'height' in tags else None
+    header['Bands'] = tags['bands'][0] if 'bands' in tags else 1
+    bits = tags.get('bits', (1,))[0]
+    sample_format = tags.get('format', (1,))[0]
+    header['Dtype'] = '%s%d' % (_TIFF_FORMATS.get(sample_format, 'uint'), bits)
+    if 'transformation' in tags:
+        matrix = tags['transformation']
+        header['Geotransform'] = (matrix[3], matrix[0], matrix[1],
+                                  matrix[7], matrix[4], matrix[5])
+    elif 'tiepoint' in tags and 'scale' in tags:
+        col, row, _, x_geo, y_geo, _ = tags['tiepoint'][:6]
+        x_scale, y_scale = tags['scale'][:2]
+        header['Geotransform'] = (x_geo - col * x_scale, x_scale, 0.0,
+                                  y_geo + row * y_scale, 0.0, -y_scale)
+    # GDAL writes nodata as an ASCII number, other values are skipped
+    nodata = tags.get('nodata')
+    if isinstance(nodata, str) and nodata.strip():
+        try:
+            header['Nodata'] = float(nodata)
+        except ValueError:
+            pass
+
+    return header
+
+
+def raster_header(filepath):
+    """
+    Returns a dictionary with the raster metadata of an image: Width, Height,
+    Bands, Dtype, Geotransform and Nodata. Only the file header is read. TIFF,
+    BigTIFF and PNG files are supported; the values of other files, of files
+    whose header is corrupt or truncated, and the values a file does not
+    define, are None.
+    """
+
+    header = dict.fromkeys(RASTER_COLUMNS)
+    with open(filepath, 'rb') as image:
+        magic = image.read(16)
+        try:
+            if magic[:4] in [b'II*\0', b'MM\0*']:
+                header = _tiff_header(image,
+                                      '<' if magic[:2] == b'II' else '>',
+                                      False)
+            elif magic[:4] in [b'II+\0', b'MM\0+']:
+                header = _tiff_header(image,
+                                      '<' if magic[:2] == b'II' else '>',
+                                      True)
+            elif magic[:8] == b'\x89PNG\r\n\x1a\n' and \
+                    magic[12:16] == b'IHDR':
+                width, height, depth, color = struct.unpack('>IIBB',
+                                                            image.read(10))
+                header['Width'] = width
+                header['Height'] = height
+                header['Bands'] = _PNG_BANDS.get(color, 1)
+                header['Dtype'] = 'uint16' if depth == 16 else 'uint8'
+        # Offsets past the end, unknown field types and short reads
+        except (struct.error, KeyError, IndexError, ValueError,
+                OverflowError):
+            header = dict.fromkeys(RASTER_COLUMNS)
+
+    return header
+
+
+def _csv_value(value):
+    """
+    Formats a dataframe value for CSV. Geotransforms are written as six space
+    separated numbers.
+    """
+
+    if value is None:
+        return ''
+    if isinstance(value, tuple):
+        return ' '.join(repr(num) for num in value)
+
+    return value
+
+
+def write_columns(filename, filetype, columns):
+    """
+    Writes a column oriented dataframe. filetype selects the format: csv,
+    npz (requires NumPy) or parquet (requires pyarrow). Missing values are
+    written as empty CSV fields, as -1 for integers and NaN for floats.
+    """
+
+    if filetype == 'npz':
+        import numpy as np
+        arrays = dict()
+        for key, values in columns.items():
+            if key == 'Geotransform':
+                arrays[key] = np.array([value or [np.nan] * 6
+                                        for value in values],
+                                       dtype='float64').reshape(-1, 6)
+            elif key == 'Nodata':
+                arrays[key] = np.array([np.nan if value is None else value
+                                        for value in values], dtype='float64')
+            elif key in ['Filename', 'Dtype']:
+                arrays[key] = np.array([value or '' for value in values],
+                                       dtype='str')
+            else:
+                arrays[key] = np.array([-1 if value is None else value
+                                        for value in values], dtype='int64')
+        with open(filename + '.npz', 'wb') as image_npz:
+            np.savez_compressed(image_npz, **arrays)
+    elif filetype == 'parquet':
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        pq.write_table(pa.table(columns), filename + '.parquet')
+    else:
+        with open(filename + '.' + filetype, 'wt') as image_csv:
+            writer = csv.writer(image_csv)
+            writer.writerow(list(columns))
+            for row in zip(*columns.values()):
+                writer.writerow([_csv_value(value) for value in row])
 
 
 def image_discovery(path, filename='list', filetype='csv', filesize=False,
-                    image_ftype='tif'):
+                    image_ftype='tif', walk='glob', recursive=False,
+                    threads=1, manifest=None, changed_only=False,
+                    checksum=False, shard=0, shards=1, metadata=False):
     """
     This function creates a dataframe with image names and size from a path.
     :Arguments:
         :path: Images path, str
         :filename: The filename of the CSV file containing the dataframe.
                    Default Value: list.csv
+        :filetype: The format of the dataframe, csv, npz or parquet.
+                   Default value: csv
         :filesize: Whether or not the image sizes should be inluded to the
                    dataframe. Default value: False
+        :walk: How the path is listed. 'glob' uses a single glob call and
+               one stat per file, 'scandir' uses os.scandir and reuses the
+               directory entries. Default value: glob
+        :recursive: Whether images in subdirectories are discovered too.
+                    Default value: False
+        :threads: Number of threads used by the scandir walk. Default value: 1
+        :manifest: Path of a persistent manifest with the size, mtime and
+                   optionally the hash of every discovered image. It is
+                   created when missing and rewritten on every discovery.
+                   Default value: None
+        :changed_only: Whether only the images that are new or changed since
+                       the manifest was last written are listed. Requires a
+                       manifest. The discovery is then written to the
+                       pending manifest, which replaces the manifest with
+                       commit_manifest once the listed images are analyzed,
+                       so images of a failed run are listed again.
+                       Default value: False
+        :checksum: Whether the manifest keeps a SHA-256 of every image.
+                   Default value: False
+        :shard: Which shard of the path is discovered. Files and
+                subdirectories directly under the path are split in shards
+                by the hash of their name. Default value: 0
+        :shards: The number of shards. Default value: 1
+        :metadata: Whether the raster header of every image is included:
+                   Width, Height, Bands, Dtype, Geotransform and Nodata.
+                   Default value: False
     """
 
-    filepaths = glob(path + '/*.%s' % image_ftype)
-    image_csv = open(filename + '.' + filetype, 'wt')
-    writer = csv.writer(image_csv)
-    if filesize:
-        writer.writerow(('Filename', 'Size'))
-        for filepath in filepaths:
-            filesize = int(math.ceil(os.path.getsize(filepath) / 1024 / 1024))
-            writer.writerow((filepath, filesize))
+    if not 0 <= shard < shards:
+        raise ValueError('Shard %d is not in [0, %d)' % (shard, shards))
+
+    if changed_only and not manifest:
+        raise ValueError('changed_only requires a manifest')
+
+    if manifest:
+        if walk == 'scandir':
+            images = scan_images(path, image_ftype=image_ftype,
+                                 recursive=recursive, threads=threads,
+                                 shard=shard, shards=shards)
+        else:
+            images = [(filepath, os.stat(filepath)) for filepath in
+                      _glob_images(path, image_ftype, recursive, shard,
+                                   shards)]
+        changed = update_manifest(manifest, images, checksum,
+                                  pending=changed_only)
+        if changed_only:
+            images = changed
+        filepaths = [filepath for filepath, _ in images]
+        filesizes = [stat.st_size for _, stat in images]
+    elif walk == 'scandir':
+        images = scan_images(path, image_ftype=image_ftype,
+                             recursive=recursive, threads=threads,
+                             stat=filesize, shard=shard, shards=shards)
+        filepaths = [filepath for filepath, _ in images]
+        filesizes = None
+        if filesize:
+            filesizes = [stat.st_size for _, stat in images]
     else:
-        writer.writerow(['Filename'])
-        for filepath in filepaths:
-            writer.writerow([filepath])
+        filepaths = _glob_images(path, image_ftype, recursive, shard, shards)
+        filesizes = None
+        if filesize:
+            filesizes = [os.path.getsize(filepath) for filepath in filepaths]
 
-    image_csv.close()
+    columns = {'Filename': filepaths}
+    if filesize:
+        columns['Size'] = [int(math.ceil(size / 1024 / 1024))
+                           for size in filesizes]
+    if metadata:
+        with ThreadPoolExecutor(max_workers=max(1, int(threads))) as pool:
+            headers = list(pool.map(raster_header, filepaths))
+        for key in RASTER_COLUMNS:
+            columns[key] = [header[key] for header in headers]
+
+    write_columns(filename, filetype, columns)
 
 
 if __name__ == '__main__':
@@ -51,10 +532,39 @@ if __name__ == '__main__':
     parser.add_argument('--filename', type=str, default='list',
                         help='Name of the output file')
     parser.add_argument('--filetype', type=str, default='csv',
+                        choices=['csv', 'npz', 'parquet'],
                         help='Type of the output file')
     parser.add_argument('--filesize', help='Include the filesize to the \
                         output CSV', action='store_true')
+    parser.add_argument('--walk', type=str, default='glob',
+                        choices=['glob', 'scandir'],
+                        help='How the path is listed')
+    parser.add_argument('--recursive', help='Discover images in \
+                        subdirectories too', action='store_true')
+    parser.add_argument('--threads', type=int, default=1,
+                        help='Number of threads for the scandir walk')
+    parser.add_argument('--manifest', type=str, default=None,
+                        help='Persistent manifest of the discovered images')
+    parser.add_argument('--changed_only', help='List only images that are \
+                        new or changed since the manifest', action='store_true')
+    parser.add_argument('--checksum', help='Keep a SHA-256 of every image \
+                        in the manifest', action='store_true')
+    parser.add_argument('--shard', type=int, default=0,
+                        help='Which shard of the path is discovered')
+    parser.add_argument('--shards', type=int, default=1,
+                        help='Number of shards the path is split in')
+    parser.add_argument('--metadata', help='Include the raster header of \
+                        every image', action='store_true')
+    parser.add_argument('--commit', help='Replace the manifest with its \
+                        pending manifest instead of discovering images',
+                        action='store_true')
     args = parser.parse_args()
 
-    image_discovery(args.path, args.filename, args.filetype, args.filesize,
-                    args.image_ftype)
+    if args.commit:
+        commit_manifest(args.manifest)
+    else:
+        image_discovery(args.path, args.filename, args.filetype,
+                        args.filesize, args.image_ftype, args.walk,
+                        args.recursive, args.threads, args.manifest,
+                        args.changed_only, args.checksum, args.shard,
+                        args.shards, args.metadata)
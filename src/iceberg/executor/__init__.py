@@ -7,3 +7,5 @@ Copyright: 2018-2019
 from .seals import Seals  # noqa:F401
 from .penguins import Penguins  # noqa:F401
 from .rivers import Rivers # noqa:F401
+from .multi import MultiExecutor  # noqa:F401
+from .daemon import Daemon, Spool  # noqa:F401
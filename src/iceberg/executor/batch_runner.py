@@ -0,0 +1,87 @@
+"""
+Batch Runner Kernel
+==========================================================
+This script runs the command line entry point of a Python
+module several times in a single process. Interpreter
+startup, imports, CUDA context creation and anything the
+module caches are paid once per batch instead of once per
+image.
+Author: Ioannis Paraskevakos
+License: MIT
+Copyright: 2018-2019
+"""
+import argparse
+import importlib
+import json
+import os
+import runpy
+import sys
+
+
+def run_job(module, function, arguments):
+    """
+    Runs one job: sys.argv is set to the job arguments and the entry point of
+    the module is called. Returns the exit status of the job.
+    :Arguments:
+        :module: The module name, str
+        :function: The entry point function of the module. When None, the
+                   module is run as __main__, str
+        :arguments: The command line arguments of the job, list
+    """
+
+    saved_argv = sys.argv
+    sys.argv = [module] + [os.path.expandvars(arg) for arg in arguments]
+    try:
+        if function:
+            getattr(importlib.import_module(module), function)()
+        else:
+            runpy.run_module(module, run_name='__main__', alter_sys=True)
+    except SystemExit as exit_status:
+        if exit_status.code not in [None, 0]:
+            return 1
+    finally:
+        sys.argv = saved_argv
+
+    return 0
+
+
+def run_batch(module, jobs, function='main'):
+    """
+    Runs every job of a batch, one after the other. A failing job does not
+    stop the batch. Returns the number of failed jobs.
+    :Arguments:
+        :module: The module name, str
+        :jobs: A list with the command line arguments of every job
+        :function: The entry point function of the module, str
+    """
+
+    failed = 0
+    for job in jobs:
+        print('Running %s %s' % (module, ' '.join(job)))
+        sys.stdout.flush()
+        try:
+            failed += run_job(module, function, job)
+        except Exception as error:  # pylint: disable=broad-except
+            print('Job %s failed: %s' % (' '.join(job), error))
+            failed += 1
+
+    return failed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--module', type=str, required=True,
+                        help='The module whose entry point is run')
+    parser.add_argument('--function', type=str, default='main',
+                        help='The entry point function. Use an empty string \
+                        to run the module as a script')
+    parser.add_argument('--jobs', type=str, required=True,
+                        help='JSON file with a list of the command line \
+                        arguments of every job')
+    args = parser.parse_args()
+
+    with open(args.jobs) as jobs_json:
+        batch_jobs = json.load(jobs_json)
+
+    sys.exit(1 if run_batch(args.module, batch_jobs, args.function or None)
+             else 0)
@@ -0,0 +1,239 @@
+"""
+Author: Ioannis Paraskevakos
+License: MIT
+Copyright: 2018-2019
+"""
+# pylint: disable=protected-access
+
+import json
+import os
+import time
+import traceback
+
+import radical.entk as re
+
+from .multi import MultiExecutor
+
+# The states of a request, and the spool folder of each
+QUEUED = 'incoming'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+STATES = [QUEUED, RUNNING, DONE, FAILED]
+
+
+class Spool():
+    '''
+    :Class Spool:
+    A spool directory with the analysis requests of a daemon. A request is a
+    JSON file that moves from incoming to running, and then to done or
+    failed. Requests are written to a temporary file and renamed, so the
+    daemon never reads a partial request, and they are served in the order
+    they were submitted.
+    :Parameters:
+        :path: The spool directory
+    '''
+
+    def __init__(self, path):
+
+        self._path = path
+        for state in STATES:
+            folder = os.path.join(path, state)
+            if not os.path.isdir(folder):
+                os.makedirs(folder)
+
+    def _file(self, state, request_id):
+        '''
+        Returns the file of a request in a state.
+        '''
+
+        return os.path.join(self._path, state, '%s.json' % request_id)
+
+    def submit(self, request):
+        '''
+        Adds a request and returns its id.
+
+        :Arguments:
+            :request: The parsed arguments of an analysis, dict
+        '''
+
+        request_id = '%.6f.%d' % (time.time(), os.getpid())
+        tmp_file = os.path.join(self._path, '.%s.json' % request_id)
+        with open(tmp_file, 'w') as request_file:
+            json.dump(request, request_file)
+        os.rename(tmp_file, self._file(QUEUED, request_id))
+
+        return request_id
+
+    def stop(self):
+        '''
+        Asks the daemon to stop once the requests before this one are served.
+        '''
+
+        return self.submit({'stop': True})
+
+    def take(self):
+        '''
+        Moves the oldest queued request to running and returns its id and its
+        content, or None when no request is queued.
+        '''
+
+        queued = sorted(os.listdir(os.path.join(self._path, QUEUED)),
+                        key=lambda name: float(name.rsplit('.', 2)[0]))
+        for name in queued:
+            request_id = name[:-len('.json')]
+            try:
+                os.rename(self._file(QUEUED, request_id),
+                          self._file(RUNNING, request_id))
+            except OSError:
+                continue
+            with open(self._file(RUNNING, request_id)) as request_file:
+                return request_id, json.load(request_file)
+
+        return None
+
+    def finish(self, request_id, state, **status):
+        '''
+        Moves a running request to done or failed, with its status.
+        '''
+
+        with open(self._file(RUNNING, request_id)) as request_file:
+            request = json.load(request_file)
+        request['status'] = status
+        with open(self._file(RUNNING, request_id), 'w') as request_file:
+            json.dump(request, request_file)
+        os.rename(self._file(RUNNING, request_id),
+                  self._file(state, request_id))
+
+    def state(self, request_id):
+        '''
+        Returns the state and the content of a request, or (None, None) when
+        the spool does not have it.
+        '''
+
+        for state in STATES:
+            try:
+                with open(self._file(state, request_id)) as request_file:
+                    return state, json.load(request_file)
+            except (IOError, ValueError):
+                continue
+
+        return None, None
+
+
+class Daemon():
+    '''
+    :Class Daemon:
+    Holds one allocation open and runs the analysis requests of a spool on
+    it, one after the other. Later runs skip the queue wait and the pilot
+    startup. Every request runs as a MultiExecutor on the AppManager of the
+    daemon. Data the executors upload to the pilot sandbox is staged with
+    the pilot for the first request, and by a staging task afterwards.
+    :Parameters:
+        :spool: The spool of the requests, Spool
+        :app_manager: The AppManager of the allocation
+        :create_executors: A callable that returns the executors of a
+                           request
+        :logger: The logger of the daemon
+        :poll: Seconds between checks of the spool
+        :idle_timeout: Seconds without a request after which the daemon
+                       stops. Default: it stops only when asked to
+    '''
+
+    # pylint: disable=too-many-arguments
+    def __init__(self, spool, app_manager, create_executors, logger, poll=5,
+                 idle_timeout=None):
+
+        self._spool = spool
+        self._app_manager = app_manager
+        self._create_executors = create_executors
+        self._logger = logger
+        self._poll = poll
+        self._idle_timeout = idle_timeout
+        self._staged = None
+
+    def serve(self):
+        '''
+        Serves requests until the daemon is asked to stop or is idle for
+        idle_timeout, and releases the allocation. Returns the number of
+        requests served.
+        '''
+
+        served = 0
+        idle_since = time.time()
+        try:
+            while True:
+                taken = self._spool.take()
+                if taken is None:
+                    if self._idle_timeout is not None and \
+                            time.time() - idle_since > self._idle_timeout:
+                        self._logger.info('Idle for %d seconds, stopping',
+                                          self._idle_timeout)
+                        break
+                    time.sleep(self._poll)
+                    continue
+                request_id, request = taken
+                if request.get('stop'):
+                    self._spool.finish(request_id, DONE)
+                    self._logger.info('Stopping as requested')
+                    break
+                self._serve(request_id, request)
+                served += 1
+                idle_since = time.time()
+        finally:
+            self._app_manager.resource_terminate()
+
+        return served
+
+    def _serve(self, request_id, request):
+        '''
+        Runs a request and records its outcome.
+        '''
+
+        self._logger.info('Serving request %s', request_id)
+        start = time.time()
+        try:
+            multi = MultiExecutor(self._create_executors(request),
+                                  app_manager=self._app_manager)
+            self._stage_shared_data(multi)
+            multi.run(terminate=False)
+        # pylint: disable=broad-except
+        except Exception as error:
+            self._logger.error('Request %s failed: %s', request_id, error)
+            self._spool.finish(request_id, FAILED, error=str(error),
+                               traceback=traceback.format_exc(),
+                               seconds=time.time() - start)
+            return
+        self._spool.finish(request_id, DONE, seconds=time.time() - start)
+
+    def _stage_shared_data(self, multi):
+        '''
+        Stages the shared data of a request that the pilot does not have.
+        The first request stages it with the pilot. Later ones upload it with
+        a task that moves it to the pilot sandbox.
+        '''
+
+        shared_data = multi.shared_data()
+        if self._staged is None:
+            self._staged = set(shared_data)
+            return
+        missing = [path for path in shared_data if path not in self._staged]
+        if not missing:
+            return
+
+        task = re.Task()
+        task.name = 'Shared.S0.T0'
+        task.executable = '/bin/sh'
+        task.arguments = ['-c', 'mv %s $RP_PILOT_SANDBOX/' %
+                          ' '.join(os.path.basename(path)
+                                   for path in missing)]
+        task.upload_input_data = missing
+        stage = re.Stage()
+        stage.name = 'Shared.S0'
+        stage.add_tasks(task)
+        pipeline = re.Pipeline()
+        pipeline.name = 'Shared'
+        pipeline.add_stages(stage)
+        self._app_manager.workflow = set([pipeline])
+        self._app_manager.run()
+        self._staged.update(missing)
@@ -5,10 +5,29 @@ Copyright: 2018-2019
 """
 
 import os
+import json
+import hashlib
+import itertools
+import math
+import shutil
+import tempfile
 
 import radical.entk as re
 import radical.utils as ru
 
+from ..discovery import (Discovery, merge_catalogs, read_catalog,
+                         load_catalog)
+from .scheduler import (order_images, pack_images, batch_images,
+                        pipeline_name)
+from .factory import PipelineFactory, Field
+from .journal import Journal, DONE, FAILED, SUBMITTED
+from .planner import (ThroughputModel, plan_parts, part_walltime,
+                      size_slots, makespan)
+from .profiler import (task_pipeline, write_tasks, profile_run, write_report,
+                       run_seconds)
+from .model_cache import sha256sum
+from .footprint import tiles_mb
+
 
 class Executor():
     '''
@@ -22,26 +41,200 @@ class Executor():
         :cpus: The number of CPUs required for execution
         :gpus: The number of GPUs required for execution
         :project: The project that will be charged
+        :discovery: A dictionary with the image discovery options, see
+                    Discovery.generate_discover_pipe
+        :streaming: Whether image pipelines are started as soon as the
+                    discovery task of their shard finishes, instead of after
+                    the whole discovery. Discovery shards are the chunks.
+                    Local discovery needs no streaming, as it submits
+                    nothing.
+        :local_discovery: Whether images are discovered by the middleware
+                          process instead of an EnTK task. The input paths
+                          have to be visible from this host. Always used for
+                          local.localhost when the input paths exist.
+        :schedule: The order image pipelines are submitted in: catalog,
+                   largest or smallest first. lpt packs the images in slots
+                   pipelines that analyze their images one after the other,
+                   so the slots finish at about the same time.
+        :slots: Number of concurrent images lpt packs for. Defaults to the
+                number of GPUs, or CPUs when there are no GPUs.
+        :max_pipelines: Maximum number of pipelines in flight. When one of
+                        them completes, the next pipeline is built and runs
+                        in its place, see _roll_pipelines. Default: no limit
+        :batch_size: When set, one prediction task analyzes up to that many
+                     images in one process, once per batch.
+        :batch_mb: When set, batches are also limited to that many MBs.
+        :inference_service: Whether every GPU runs a long lived inference
+                            worker that keeps the model resident. Image
+                            pipelines submit their tiles to the worker
+                            instead of running their own prediction task.
+                            Streaming, lpt, max_pipelines and batching do
+                            not apply.
+        :journal: Path of a SQLite journal with the state of the pipeline of
+                  every image. Use cases keep their own states in it.
+                  Default: no journal
+        :resume: Whether images the journal records as completed are
+                 skipped, and the catalog of a previous run is reused. Needs
+                 journal.
+        :throughput: Path of a JSON file with the throughput model of every
+                     use case, see ThroughputModel. When set, the images are
+                     split in parts that fit in the walltime, and every part
+                     runs in its own pilot. Every part updates the model.
+        :part: Run only this part of the plan. Parts submitted by separate
+               invocations run concurrently; the journal merges their
+               states. Default: all parts, one after the other
+        :profile: Prefix of the profile of the run. The RP tasks of the image
+                  pipelines are saved in <profile>.tasks.json, and when the
+                  sessions are found in the working directory, the report is
+                  saved in <profile>.json and <profile>.txt, see profiler.
+                  Default: no profile
+        :model_cache: Whether models are copied once per node to node local
+                      storage and verified, instead of being read by every
+                      task from the shared filesystem, see model_cache.
+        :prefetch: The number of scenes a lane copies ahead to node local
+                   storage, see prefetch. The task that reads the scene of
+                   an image copies the next scenes of its lane in the
+                   background, and reads its own scene from the local copy.
+                   The tasks of a lane run on the same node. Lanes need the
+                   lpt schedule; otherwise every scene is only copied in by
+                   its own task. Default: 0, scenes are read from the shared
+                   filesystem
+        :prefetch_mb: The MBs of scenes a lane holds in node local storage.
+                      The scenes are added to the lfs_per_process of the
+                      tasks that copy them. Default: no limit
+        :results_index: Path of the CSV index the results of every image are
+                        added to as soon as its pipeline writes them, see
+                        reducer. Tasks append to it, so it has to be on a
+                        filesystem they share. With the inference service,
+                        results that the worker writes in its own sandbox,
+                        like the Seals predictions, are not indexed; the
+                        Rivers mosaics are written by the image pipelines
+                        and are. Default: no index
+        :target: Target completion time in minutes. The cpus, gpus and
+                 walltime of the allocation are sized for the discovered
+                 images with the throughput model, and the requested ones
+                 are the most it asks for. Needs throughput. Default: the
+                 requested resources are used as they are
+        :overlap: Whether the images of an lpt lane overlap: every image of
+                  the lane starts one stage after the previous one, so the
+                  tiling of the next image runs while the current one holds
+                  the GPU. A lane runs at most one task of every stage at a
+                  time, so the slots bound the concurrent tiling and GPU
+                  tasks. Default: the images of a lane run one after the
+                  other
+        :app_manager: The AppManager of an allocation the executor runs on,
+                      e.g. the one of a daemon. Default: a new AppManager for
+                      the requested resources
     '''
 
+    # The file extension of the images the use case analyzes
+    _img_ftype = 'tif'
+    # Seconds an inference worker waits without a job before it stops
+    _worker_idle_timeout = 3600
+    # Seconds a task waits for its job to be served by an inference worker
+    _submit_timeout = 4 * 3600
+    # The folder of the files of tile_stream tasks, in shared memory
+    _stream_folder = '/dev/shm'
+    # The number of files a tile_stream task hands over at once
+    _stream_batch = 256
+    # The number of waiting files that pauses a tile_stream producer
+    _stream_max_pending = 4096
+    # The folder the scenes of a lane are prefetched to
+    _prefetch_folder = '$NODE_LFS_PATH/iceberg_prefetch'
+    # The use case the reducer summarizes results for, see reducer
+    _results_kind = None
+    # The prefix of the names of the pipelines, so the pipelines of several
+    # use cases can share a pilot, see MultiExecutor
+    _prefix = ''
+
     def __init__(self, name, resource, walltime, cpus, gpus=0,
-                 project=None, queue=None):
+                 project=None, queue=None, discovery=None, streaming=False,
+                 local_discovery=False, schedule='catalog', slots=None,
+                 max_pipelines=None, batch_size=None, batch_mb=None,
+                 inference_service=False, journal=None, resume=False,
+                 throughput=None, part=None, profile=None,
+                 model_cache=False, prefetch=0, prefetch_mb=None,
+                 results_index=None, target=None, overlap=False,
+                 app_manager=None):
+
+        self._res_dict = self._resource_desc(resource, walltime, cpus, gpus,
+                                             project, queue)
+        self._name = name
+        self._app_manager = app_manager or \
+            self._create_app_manager(name, self._res_dict)
+
+        self._logger = ru.Logger(name='iceberg-middleware', level='DEBUG')
 
-        self._res_dict = {'resource': resource,
-                          'walltime': walltime,
-                          'cpus': cpus,
-                          'gpus': gpus}
+        self._discovery_args = discovery or dict()
+        self._streaming = streaming
+        self._local_discovery = local_discovery
+        self._schedule = schedule
+        self._slots = slots or gpus or cpus
+        self._max_pipelines = max_pipelines
+        self._batch_size = batch_size
+        self._batch_mb = batch_mb
+        self._inference_service = inference_service
+        self._journal = Journal(journal, type(self).__name__.lower()) \
+            if journal else None
+        self._resume = resume
+        self._throughput = throughput
+        self._part = part
+        self._profile = profile
+        self._profile_images = dict()
+        self._profile_tasks = list()
+        self._sessions = list()
+        self._uids = list()
+        self._batches = None
+        self._failed = False
+        self._model_cache = model_cache
+        self._checksums = dict()
+        self._prefetch = prefetch
+        self._prefetch_mb = prefetch_mb
+        self._results_index = results_index
+        if resume and not journal:
+            raise ValueError('Resuming needs a journal')
+        if target and not throughput:
+            raise ValueError('Sizing for a target needs a throughput model')
+        self._target = target
+        self._overlap = overlap
+        self._rasters = None
+        self._catalog = None
+        self._factories = dict()
+        self._data_input_path = None
+        self._req_modules = None
+        self._pre_execs = None
+
+    # pylint: disable=too-many-arguments
+    @staticmethod
+    def _resource_desc(resource, walltime, cpus, gpus=0, project=None,
+                       queue=None):
+        '''
+        Returns the resource description of an allocation.
+        '''
+
+        res_dict = {'resource': resource,
+                    'walltime': walltime,
+                    'cpus': cpus,
+                    'gpus': gpus}
 
         if project:
-            self._res_dict['project'] = project
+            res_dict['project'] = project
 
         if queue:
-            self._res_dict['queue'] = queue
+            res_dict['queue'] = queue
 
         if 'local.localhost' in resource:
-            self._res_dict['access_schema'] = 'ssh'
+            res_dict['access_schema'] = 'ssh'
         else:
-            self._res_dict['access_schema'] = 'gsissh'
+            res_dict['access_schema'] = 'gsissh'
+
+        return res_dict
+
+    @staticmethod
+    def _create_app_manager(name, res_dict):
+        '''
+        Returns an AppManager that acquires the resources of res_dict.
+        '''
 
         rmq_endpoint = os.environ.get('RMQ_ENDPOINT', None)
         rmq_port = os.environ.get('RMQ_PORT', None)
@@ -50,36 +243,1193 @@ class Executor():
         if ((rmq_endpoint is None) or (rmq_port is None)):
             raise RuntimeError('Rabbit MQ endpoint and/or port is not set')
 
-        self._app_manager = re.AppManager(port=int(rmq_port),
-                                          hostname=rmq_endpoint,
-                                          username=rmq_username,
-                                          password=rmq_passwd,
-                                          name=name,
-                                          autoterminate=False,
-                                          write_workflow=False)
+        app_manager = re.AppManager(port=int(rmq_port),
+                                    hostname=rmq_endpoint,
+                                    username=rmq_username,
+                                    password=rmq_passwd,
+                                    name=name,
+                                    autoterminate=False,
+                                    write_workflow=False)
 
-        self._app_manager.resource_desc = self._res_dict
+        app_manager.resource_desc = res_dict
 
-        self._logger = ru.Logger(name='iceberg-middleware', level='DEBUG')
+        return app_manager
 
     def run(self):
         '''
         This is a blocking execution method. This method should be called to
         execute the usecase.
         '''
+        try:
+            self._logger.debug('Running workflow')
+            self._run_workflow()
+        finally:
+            self._terminate()
+            if self._batches:
+                shutil.rmtree(self._batches, ignore_errors=True)
+            if self._profile:
+                self._write_profile()
+
+    def _execute(self, workflow):
+        '''
+        Executes a set of pipelines. When profiling, the RP tasks of the image
+        pipelines are kept for the profile.
+        '''
+
+        self._app_manager.workflow = workflow
+
+        self._app_manager.run()
+        self._record_outcome(workflow)
+        self._uids = self._uids or list()
+        if self._throughput:
+            # The tasks of a part give its duration to the throughput model
+            self._uids += [task.rts_uid for pipeline in workflow
+                           for stage in pipeline.stages
+                           for task in stage.tasks]
+        self._profile_workflow(workflow)
+
+    def _profile_workflow(self, workflow):
+        '''
+        Keeps the RP tasks of the image pipelines of an executed workflow for
+        the profile.
+        '''
+
+        if not self._profile:
+            return
+
+        sid = self._app_manager.sid
+        if sid not in self._sessions:
+            self._sessions.append(sid)
+        for pipeline in workflow:
+            for stage in pipeline.stages:
+                for task in stage.tasks:
+                    if task_pipeline(task.name)[0] in self._profile_images:
+                        self._profile_tasks.append(
+                            {'session': sid, 'uid': task.rts_uid,
+                             'name': task.name,
+                             'gpus': self._task_gpus(task)})
+
+    def _shared_data(self):
+        '''
+        Returns the files that are uploaded once to the pilot sandbox, where
+        tasks find them as $SHARED.
+        '''
+
+        return list()
+
+    def _pipeline_name(self, images, prefix='P'):
+        '''
+        Returns the name of the pipeline of some images, see pipeline_name.
+        '''
+
+        return pipeline_name(images, self._prefix + prefix)
+
+    def _task_gpus(self, task):
+        '''
+        Returns the GPUs a task holds while it executes.
+        '''
+
+        return (task.gpu_reqs or dict()).get('gpu_processes') or 0
+
+    def _profile_pipeline(self, name, images):
+        '''
+        Keeps the images of a pipeline for the profile.
+
+        :Arguments:
+            :name: The pipeline name, str
+            :images: A list of (image, size) tuples
+        '''
+
+        if self._profile:
+            self._profile_images[name] = images
+
+    def _write_profile(self):
+        '''
+        Saves the RP tasks of the run, and its report when the profiles of
+        its sessions are in the working directory. Otherwise the report can
+        be built offline, once the sessions are fetched.
+        '''
+
+        tasks_file = '%s.tasks.json' % self._profile
+        write_tasks(tasks_file, self._res_dict['gpus'], self._profile_tasks,
+                    self._profile_images)
+        sessions = [sid for sid in self._sessions if os.path.isdir(sid)]
+        if not sessions:
+            self._logger.warning('No session of %s is found, the profile '
+                                 'has to be built offline', tasks_file)
+            return
+
+        write_report(profile_run(tasks_file, sessions), self._profile)
+        self._logger.info('Profile saved in %s.txt', self._profile)
+
+    def _resolve_pre_execs(self):
+        '''
+        This is a utils method. It takes the list of modules and return a list
+        of pre_exec commands
+        '''
+
+        tmp_pre_execs = list()
+        for module in self._req_modules or list():
+            tmp_pre_exec = 'module load %s' % module
+            self._logger.debug("Preexec added: %s", tmp_pre_exec)
+            tmp_pre_execs.append(tmp_pre_exec)
+
+        tmp_pre_execs = tmp_pre_execs + (self._pre_execs or list())
+
+        return tmp_pre_execs
+
+    def _discovery_pre_execs(self):
+        '''
+        Returns the pre_exec commands of the discovery tasks, on top of the
+        modules to load.
+        '''
+
+        return self._pre_execs
+
+    def _discovery(self):
+        '''
+        Returns the Discovery object of the use case.
+        '''
+
+        return Discovery(modules=self._req_modules,
+                         paths=self._data_input_path,
+                         pre_execs=self._discovery_pre_execs())
+
+    def _discovers_locally(self):
+        '''
+        Returns whether images are discovered by the middleware process.
+        '''
+
+        if self._local_discovery:
+            return True
+
+        paths = self._data_input_path
+        if not isinstance(paths, list):
+            paths = [paths]
+
+        return 'local.localhost' in self._res_dict['resource'] and \
+            all(path and os.path.isdir(path) for path in paths)
+
+    def _discover_images(self):
+        '''
+        Discovers the images and returns the merged catalog of all discovery
+        tasks as a list of (image, size) tuples. The merged catalog is also
+        saved as images.<filetype>, with every discovered column. Remote
+        discovery executes the discovery pipeline, local discovery does not
+        submit anything.
+        '''
+
+        catalog = 'images.%s' % self._discovery_args.get('filetype', 'csv')
+        if self._resume and os.path.exists(catalog):
+            self._logger.info('Resuming with the catalog %s', catalog)
+            self._catalog = catalog
+            return read_catalog(catalog)
+
+        discovery = self._discovery()
+        if self._discovers_locally():
+            self._logger.info('Discovering images locally')
+            discovery.discover_local(img_ftype=self._img_ftype,
+                                     **self._discovery_args)
+        else:
+            discovery_pipeline = discovery.generate_discover_pipe(
+                img_ftype=self._img_ftype, **self._discovery_args)
+
+            self._execute(set([discovery_pipeline]))
+
+        self._catalog = catalog
+
+        return merge_catalogs(discovery.catalogs, self._catalog)
+
+    def _record_outcome(self, workflow):
+        '''
+        Records whether a task of an executed workflow failed, when the
+        manifests of a changed_only discovery wait for the run to succeed.
+        '''
+
+        if self._discovery_args.get('changed_only'):
+            self._failed = self._failed or not all(
+                task.state == re.states.DONE for pipeline in workflow
+                for stage in pipeline.stages for task in stage.tasks)
+
+    def _commit_manifests(self):
+        '''
+        Replaces the manifests with the pending manifests of a changed_only
+        discovery once its images are analyzed. When a task failed, the
+        manifests are kept, so the next discovery lists the same images again.
+        '''
+
+        manifests = self._discovery_args.get('manifests')
+        if not (manifests and self._discovery_args.get('changed_only')):
+            return
+        if self._failed:
+            self._logger.warning('Tasks failed, the manifests in %s are not '
+                                 'updated', manifests)
+            return
+
+        discovery = self._discovery()
+        shards = self._discovery_args.get('shards', 1)
+        if self._discovers_locally():
+            discovery.commit_local(manifests, shards)
+        else:
+            self._execute(set([discovery.generate_commit_pipe(manifests,
+                                                              shards)]))
+
+    def _pipeline_template(self, pre_execs):
+        '''
+        Returns the template of an image pipeline, see PipelineFactory. Use
+        cases have to implement it.
+        '''
+
+        raise NotImplementedError('_pipeline_template is not implemented')
+
+    def _pipeline_factory(self, pre_execs):
+        '''
+        Returns the pipeline factory of a list of pre_exec commands. Factories
+        are created once and reused. With prefetch, every task of the
+        pipeline is colocated with its lane, where its scene is prefetched.
+        '''
+
+        key = tuple(pre_execs or list())
+        if key not in self._factories:
+            stages = self._pipeline_template(pre_execs)
+            if self._prefetch:
+                stages[0][0] = self._prefetch_template(stages[0][0])
+                stages = [[dict(template, tags={'colocate': '%(lane)s'})
+                           for template in stage] for stage in stages]
+            stages[-1][-1] = self._reduce_template(stages[-1][-1])
+            self._factories[key] = PipelineFactory(stages)
+
+        return self._factories[key]
+
+    def _generate_pipeline(self, name, pre_execs, image, image_size,
+                           **fields):
+        '''
+        This function creates a pipeline for an image that will be analyzed,
+        from the template of the use case.
+
+        :Arguments:
+            :name: Pipeline name, str
+            :pre_execs: things need to happen before execution
+            :image: image path, str
+            :image_size: image size in MBs, int
+            :fields: further fields of the template
+        '''
+
+        fields.setdefault('tiles_lfs', self._tiles_lfs(image, image_size))
+        if self._prefetch:
+            fields.setdefault('lane', name)
+            fields.setdefault('prefetch', image)
+            fields.setdefault('prefetch_release', '--sweep')
+            fields.setdefault('prefetch_lfs',
+                              self._prefetch_lfs(image, image_size))
+
+        return self._pipeline_factory(pre_execs).pipeline(name, image,
+                                                          image_size,
+                                                          **fields)
+
+    # pylint: disable=unused-argument
+    def _generate_batch_pipeline(self, name, pre_execs, images):
+        '''
+        This function creates a pipeline that analyzes a batch of images with
+        a single prediction task. Use cases that support batching implement
+        it.
+        '''
+
+        raise NotImplementedError('%s does not support batching' %
+                                  type(self).__name__)
+
+    # pylint: enable=unused-argument
+    def _batch_task(self, name, pre_execs, module, jobs):
+        '''
+        Returns a task that runs the entry point of a module once for every
+        job, in a single process, with the batch_runner kernel. The jobs are
+        written to <name>.json in a temporary folder of the run, which is
+        removed when the run ends, and uploaded with the task.
+
+        :Arguments:
+            :name: Task name, str
+            :pre_execs: things need to happen before execution
+            :module: The module whose entry point is run, str
+            :jobs: A list with the command line arguments of every job
+        '''
+
+        if not self._batches:
+            self._batches = tempfile.mkdtemp(prefix='%s.batches.' % self._name)
+        jobs_file = os.path.join(self._batches, '%s.json' % name)
+        with open(jobs_file, 'w') as jobs_json:
+            json.dump(jobs, jobs_json)
+
+        task = re.Task()
+        task.name = name
+        task.pre_exec = pre_execs
+        task.executable = 'python'
+        task.arguments = ['batch_runner.py', '--module=%s' % module,
+                          '--jobs=%s.json' % name]
+        task.upload_input_data = [os.path.dirname(os.path.abspath(__file__))
+                                  + '/batch_runner.py', jobs_file]
+
+        return task
+
+    @staticmethod
+    def _spool(worker):
+        '''
+        Returns the node local spool folder of an inference worker.
+        '''
+
+        return '$NODE_LFS_PATH/%s.spool' % worker
+
+    def _inference_worker_task(self, name, pre_execs, module, items):
+        '''
+        Returns a task that serves items prediction jobs of a module with the
+        inference_worker kernel. The tasks that submit jobs to it are
+        colocated with it.
+
+        :Arguments:
+            :name: Task name, str
+            :pre_execs: things need to happen before execution
+            :module: The module that predicts, str
+            :items: The number of jobs the worker serves, int
+        '''
+
+        task = re.Task()
+        task.name = name
+        task.pre_exec = pre_execs
+        task.executable = 'python'
+        task.arguments = ['inference_worker.py', 'serve',
+                          '--spool=%s' % self._spool(name),
+                          '--module=%s' % module,
+                          '--items=%d' % items,
+                          '--idle_timeout=%d' % self._worker_idle_timeout]
+        task.upload_input_data = [os.path.dirname(os.path.abspath(__file__))
+                                  + '/inference_worker.py']
+        task.tags = {'colocate': name}
+
+        return task
+
+    def _submit_task(self, name, pre_execs, worker, arguments):
+        '''
+        Returns a task that submits a prediction job to an inference worker
+        and waits for it. It fails when the job fails, when the worker is
+        gone before it serves the job, or after _submit_timeout seconds.
+
+        :Arguments:
+            :name: Task name, str
+            :pre_execs: things need to happen before execution
+            :worker: The name of the inference worker task, str
+            :arguments: The command line arguments of the job, list
+        '''
+
+        task = re.Task()
+        task.name = name
+        task.pre_exec = pre_execs
+        task.executable = 'python'
+        task.arguments = ['inference_worker.py', 'submit',
+                          '--spool=%s' % self._spool(worker),
+                          '--name=%s' % name,
+                          '--timeout=%d' % self._submit_timeout,
+                          '--'] + arguments
+        task.upload_input_data = [os.path.dirname(os.path.abspath(__file__))
+                                  + '/inference_worker.py']
+        task.cpu_reqs = {'cpu_processes': 1, 'cpu_threads': 1,
+                         'cpu_process_type': None, 'cpu_thread_type': None}
+        task.tags = {'colocate': worker}
+
+        return task
+
+    def _cache_model(self, template, source, local=None):
+        '''
+        Returns the path a task template reads a model from. With the model
+        cache, the model is copied once per node under
+        $NODE_LFS_PATH/iceberg_models, by a pre_exec command this method adds
+        to the template. Otherwise the model is read from source.
+
+        :Arguments:
+            :template: A task template, dict
+            :source: The model file or folder, as tasks see it, str
+            :local: The model as this host sees it. When it exists, copies
+                    are verified against its checksum, str
+        '''
+
+        if not self._model_cache:
+            return source
+
+        target = '$NODE_LFS_PATH/iceberg_models/%s/%s' % (
+            hashlib.sha1(source.encode()).hexdigest()[:12],
+            os.path.basename(os.path.normpath(source)))
+        command = 'python model_cache.py --source=%s --target=%s' % (
+            source, target)
+        if local and os.path.exists(local):
+            if local not in self._checksums:
+                self._checksums[local] = sha256sum(local)
+            command += ' --sha256=%s' % self._checksums[local]
+        template['pre_exec'] = list(template.get('pre_exec') or list()) + \
+            [command]
+        template['upload_input_data'] = \
+            list(template.get('upload_input_data', list())) + \
+            [os.path.dirname(os.path.abspath(__file__)) + '/model_cache.py']
+
+        return target
+
+    def _prefetch_template(self, template):
+        '''
+        Returns a task template that reads the scene of its image from node
+        local storage. Its pre_exec copies the scene, unless the previous
+        task of the lane prefetched it, links it in the working directory and
+        prefetches the next scenes of the lane, see prefetch. Its post_exec
+        removes the copy, and the last task of the lane sweeps the lane. The
+        template has to be the task that reads the scene first, i.e. the
+        first task of an image pipeline.
+
+        The fields of the template are lane, the colocation tag of the tasks
+        of the lane, prefetch, the scene and the next scenes,
+        prefetch_release, --release or --sweep for the last scene of the
+        lane, and prefetch_lfs, the MBs of the tiles and of the prefetched
+        scenes, see _prefetch_lfs.
+        '''
+
+        template = dict(template)
+        folder = '%s/%%(lane)s' % self._prefetch_folder
+        command = 'python prefetch.py --folder=%s' % folder
+        if self._prefetch_mb:
+            command += ' --budget=%s' % self._prefetch_mb
+        template['pre_exec'] = list(template.get('pre_exec') or list()) + \
+            ['%s %%(prefetch)s' % command]
+        template['post_exec'] = list(template.get('post_exec') or list()) + \
+            ['python prefetch.py --folder=%s %%(prefetch_release)s '
+             '%%(image)s' % folder]
+        template['link_input_data'] = [
+            link for link in template.get('link_input_data', list())
+            if link != '%(image)s']
+        template['upload_input_data'] = \
+            list(template.get('upload_input_data', list())) + \
+            [os.path.dirname(os.path.abspath(__file__)) + '/prefetch.py']
+        lfs = template.get('lfs_per_process')
+        if isinstance(lfs, Field) and lfs.name == 'tiles_lfs':
+            template['lfs_per_process'] = Field('prefetch_lfs')
+
+        return template
+
+    def _prefetch_fields(self, lane, images, idx):
+        '''
+        Returns the prefetch fields of the idx-th image of a lane, see
+        _prefetch_template. The scenes ahead are limited to prefetch and to
+        prefetch_mb.
+
+        :Arguments:
+            :lane: The name of the lane, str
+            :images: The (image, size) tuples of the lane, list
+            :idx: The index of the image, int
+        '''
+
+        if not self._prefetch:
+            return dict()
+
+        image, size = images[idx]
+        ahead = list()
+        ahead_mb = 0
+        last = idx + 1 + self._prefetch
+        for next_image, next_size in images[idx + 1:last]:
+            if self._prefetch_mb and ahead_mb + (next_size or 0) > \
+                    self._prefetch_mb:
+                break
+            ahead.append(next_image)
+            ahead_mb += next_size or 0
+
+        return {'lane': lane,
+                'prefetch': ' '.join([image] + ahead),
+                'prefetch_release': '--sweep' if idx == len(images) - 1
+                                    else '--release',
+                'prefetch_lfs': self._prefetch_lfs(image, size, ahead_mb)}
+
+    def _tile_geometry(self):
+        '''
+        Returns how the use case tiles an image to node local storage, as
+        (tile, step, bands, geotiff): the side of a tile and the distance
+        between tiles in pixels, the bands of a tile, None for all the bands
+        of the image, and whether tiles keep their geotransform. Use cases
+        that do not tile images return None.
+        '''
+
+        return None
+
+    def _load_rasters(self, catalog):
+        '''
+        Adds the raster headers of the images of a catalog that was
+        discovered with metadata.
+        '''
 
-        self._run_workflow()
+        if self._rasters is None:
+            self._rasters = dict()
+        columns = load_catalog(catalog)
+        if 'Width' not in columns:
+            return
+        keys = [key for key in ['Width', 'Height', 'Bands', 'Dtype']
+                if key in columns]
+        for idx, image in enumerate(columns['Filename']):
+            self._rasters[image] = dict((key, columns[key][idx])
+                                        for key in keys)
 
-        self._terminate()
+    def _tiles_mb(self, image):
+        '''
+        Returns the estimated MBs of the tiles of an image, or None when the
+        use case does not tile images or the catalog does not have the
+        raster header of the image.
+        '''
+
+        geometry = self._tile_geometry()
+        if geometry is None:
+            return None
+        if self._rasters is None:
+            self._rasters = dict()
+            if self._catalog and os.path.exists(self._catalog):
+                self._load_rasters(self._catalog)
+        tile, step, bands, geotiff = geometry
+
+        return tiles_mb(self._rasters.get(image), tile, step, bands, geotiff)
+
+    def _tiles_lfs(self, image, image_size):
+        '''
+        Returns the node local storage of the task that tiles an image, in
+        MBs: the size of its tiles, estimated from the raster header of the
+        image and the tiling of the use case, see footprint. Images
+        discovered without metadata ask for their own size.
+        '''
+
+        tiles = self._tiles_mb(image)
+
+        return image_size if tiles is None else tiles
+
+    def _prefetch_lfs(self, image, image_size, ahead_mb=0):
+        '''
+        Returns the node local storage of the first task of an image in a
+        prefetch lane, in MBs: its scene, its tiles, see _tiles_lfs, and the
+        scenes prefetched ahead of it. Without the raster header of the
+        image, its size stands for both the tiles and the scene.
+
+        :Arguments:
+            :image: The image path, str
+            :image_size: The image size in MBs, int
+            :ahead_mb: The MBs of the scenes prefetched ahead, int
+        '''
+
+        return (image_size or 0) + (self._tiles_lfs(image, image_size) or 0) \
+            + ahead_mb
+
+    def _results(self):
+        '''
+        Returns the glob of the results of an image, as the task that writes
+        them sees it, with the image fields, e.g. './%(stem)s/*'. Use cases
+        that index their results implement it.
+        '''
+
+        raise NotImplementedError('%s does not index its results'
+                                  % type(self).__name__)
+
+    def _reducer_command(self):
+        '''
+        Returns the command that adds the results of an image to the results
+        index, with the image fields.
+        '''
+
+        return "python reducer.py --index=%s --kind=%s --image=%%(image)s " \
+            "--task=%%(task)s '--results=%s'" % (self._results_index,
+                                                 self._results_kind,
+                                                 self._results())
+
+    def _reduce_template(self, template):
+        '''
+        Returns a task template whose post_exec adds the results of its image
+        to the results index, see reducer. The template has to be the task
+        that writes the results last. Without an index, the template is
+        returned as is.
+        '''
+
+        if not self._results_index:
+            return template
+
+        template = dict(template)
+        template['post_exec'] = list(template.get('post_exec') or list()) + \
+            [self._reducer_command()]
+        template['upload_input_data'] = \
+            list(template.get('upload_input_data', list())) + \
+            [os.path.dirname(os.path.abspath(__file__)) + '/reducer.py']
+
+        return template
+
+    def _reduce_task(self, task, images):
+        '''
+        Makes a task that writes the results of several images, e.g. a batch
+        task, add each of them to the results index.
+
+        :Arguments:
+            :task: The task, Task
+            :images: The image paths, list
+        '''
+
+        if not self._results_index:
+            return
+
+        task.post_exec = list(task.post_exec) + [
+            PipelineFactory.render(self._reducer_command(),
+                                   PipelineFactory.fields(None, image, None,
+                                                          task=task.name))
+            for image in images]
+        task.upload_input_data = list(task.upload_input_data) + \
+            [os.path.dirname(os.path.abspath(__file__)) + '/reducer.py']
+
+    @staticmethod
+    def _template_staging(task, template):
+        '''
+        Gives a task the pre_exec commands and the input staging of a task
+        template, on top of its own uploads, e.g. a batch task that runs the
+        executable of the template.
+        '''
+
+        task.pre_exec = template['pre_exec']
+        task.link_input_data = template.get('link_input_data', list())
+        task.upload_input_data = list(task.upload_input_data) + \
+            template.get('upload_input_data', list())
+
+    # pylint: disable=too-many-arguments
+    def _tile_stream_template(self, pre_execs, module, input_flag,
+                              output_flag, consumer, producer):
+        '''
+        Returns the attributes of a task that runs a producer command and
+        hands the files it writes to a consumer module in batches, with the
+        tile_stream kernel. The files go through <_stream_folder>/<task>.
+
+        :Arguments:
+            :pre_execs: things need to happen before execution
+            :module: The consumer module, str
+            :input_flag: The consumer argument of a batch folder, str
+            :output_flag: The producer argument of its output folder, str
+            :consumer: The consumer arguments, list
+            :producer: The producer command, list
+        '''
+
+        kernels = os.path.dirname(os.path.abspath(__file__))
+        arguments = ['tile_stream.py',
+                     '--tiles=%s/%%(task)s' % self._stream_folder,
+                     '--module=%s' % module,
+                     '--input_flag=%s' % input_flag,
+                     '--output_flag=%s' % output_flag,
+                     '--batch_size=%d' % self._stream_batch,
+                     '--max_pending=%d' % self._stream_max_pending]
+        arguments += ['--predict=%s' % arg for arg in consumer]
+        arguments += ['--'] + producer
+
+        return {'pre_exec': pre_execs,
+                'executable': 'python',
+                'arguments': arguments,
+                'upload_input_data': [kernels + '/tile_stream.py',
+                                      kernels + '/inference_worker.py']}
+
+    # pylint: disable=unused-argument
+    def _generate_worker_pipeline(self, name, pre_execs, items):
+        '''
+        This function creates the pipeline of an inference worker. Use cases
+        that support the inference service implement it.
+        '''
+
+        raise NotImplementedError('%s does not support the inference service'
+                                  % type(self).__name__)
+
+    def _generate_service_pipeline(self, name, pre_execs, image, image_size,
+                                   worker):
+        '''
+        This function creates a pipeline for an image whose tiles are
+        predicted by an inference worker. Use cases that support the
+        inference service implement it.
+        '''
+
+        raise NotImplementedError('%s does not support the inference service'
+                                  % type(self).__name__)
+
+    # pylint: enable=unused-argument
+    def _pending_images(self, images):
+        '''
+        Returns the images that have to be analyzed. When resuming, the
+        images the journal records as completed are left out.
+        '''
+
+        if not (self._resume and self._journal):
+            return images
+
+        completed = self._journal.completed()
+        pending = [image for image in images if image[0] not in completed]
+        self._logger.info('Resuming: %d of %d images are completed',
+                          len(images) - len(pending), len(images))
+
+        return pending
+
+    def _journal_stages(self, name, stages, images):
+        '''
+        Records that the images of some stages are submitted. The post_exec
+        callback of the last stage records them as completed when every task
+        of that stage is done, and as failed otherwise, so a resumed run
+        submits them again.
+
+        :Arguments:
+            :name: The pipeline name, str
+            :stages: The stages of the images, list
+            :images: The image paths, list
+        '''
+
+        if not self._journal or not stages:
+            return
+
+        self._journal.record(images, name, SUBMITTED)
+        last = stages[-1]
+
+        def completed():
+            if all(task.state == re.states.DONE for task in last.tasks):
+                self._journal.record(images, name, DONE)
+            else:
+                self._journal.record(images, name, FAILED)
+
+        last.post_exec = completed
+
+    def _journal_pipeline(self, pipeline, images):
+        '''
+        Records that the images of a pipeline are submitted, and completed
+        when its last stage is done.
+        '''
+
+        if self._journal:
+            self._journal_stages(pipeline.name, pipeline.stages, images)
+
+    @staticmethod
+    def _merge_stages(name, pipelines, first=0):
+        '''
+        Folds image pipelines into a list of stages. Stage i runs the tasks of
+        stage i of every pipeline, so the tasks keep their order and their
+        colocation tags. Stages are named <name>.S<first + i>.
+        '''
+
+        stages = list()
+        for pipeline in pipelines:
+            for idx, img_stage in enumerate(pipeline.stages):
+                if idx == len(stages):
+                    stage = re.Stage()
+                    stage.name = '%s.S%d' % (name, first + idx)
+                    stages.append(stage)
+                stages[idx].add_tasks(img_stage.tasks)
+
+        return stages
+
+    @staticmethod
+    def _overlap_pipelines(name, pipelines, step=1):
+        '''
+        Returns a pipeline that runs several image pipelines in a staircase:
+        every image starts step stages after the previous one, so stage g
+        runs stage g - j * step of every image j. With step 1 the tiling of
+        the next image runs while the current one is predicted, and a stage
+        runs at most one task of every stage of the use case. The post_exec
+        callbacks of the image stages are called when their stage is done.
+        '''
+
+        def call_all(callbacks):
+            def called():
+                for callback in callbacks:
+                    callback()
+            return called
+
+        groups = list()
+        for idx, pipeline in enumerate(pipelines):
+            for sidx, img_stage in enumerate(pipeline.stages):
+                while len(groups) <= idx * step + sidx:
+                    groups.append(list())
+                groups[idx * step + sidx].append(img_stage)
+
+        chain = re.Pipeline()
+        chain.name = name
+        for idx, group in enumerate(groups):
+            if not group:
+                continue
+            stage = re.Stage()
+            stage.name = '%s.S%d' % (name, idx)
+            for img_stage in group:
+                stage.add_tasks(img_stage.tasks)
+            callbacks = [img_stage.post_exec for img_stage in group
+                         if img_stage.post_exec]
+            if callbacks:
+                stage.post_exec = call_all(callbacks)
+            chain.add_stages(stage)
+
+        return chain
+
+    @staticmethod
+    def _chain_pipelines(name, pipelines):
+        '''
+        Returns a pipeline that runs the stages of several image pipelines one
+        after the other.
+        '''
+
+        chain = re.Pipeline()
+        chain.name = name
+        for pipeline in pipelines:
+            chain.add_stages(pipeline.stages)
+
+        return chain
+
+    def _stream_chunk(self, pipeline, catalog, pre_execs):
+        '''
+        Returns the post_exec callback of a discovery pipeline. The callback
+        reads the catalog the discovery task downloaded and appends the stages
+        of its images to the same pipeline.
+        '''
+
+        def add_chunk():
+            images = read_catalog(catalog)
+            self._load_rasters(catalog)
+            self._logger.info('%s discovered %d images', pipeline.name,
+                              len(images))
+            images = self._pending_images(images)
+            img_pipelines = list()
+            for image, size in images:
+                name = '%s.%s' % (pipeline.name, pipeline_name([image]))
+                img_pipe = self._generate_pipeline(
+                    name=name, pre_execs=pre_execs, image=image,
+                    image_size=size)
+                self._profile_pipeline(name, [(image, size)])
+                img_pipelines.append(img_pipe)
+            stages = self._merge_stages(pipeline.name, img_pipelines, first=1)
+            if stages:
+                self._journal_stages(pipeline.name, stages,
+                                     [image for image, _ in images])
+                pipeline.add_stages(stages)
+
+        return add_chunk
+
+    def _run_streaming_workflow(self):
+        '''
+        Creates and executes the workflow in a single run. Every discovery
+        task gets its own pipeline, and the images it discovers are appended
+        to that pipeline by the post_exec callback of its discovery stage.
+        '''
+
+        discovery = self._discovery()
+        disc_pipelines = discovery.generate_discover_pipes(
+            img_ftype=self._img_ftype, **self._discovery_args)
+        pre_execs = self._resolve_pre_execs()
+        for pipeline, catalog in zip(disc_pipelines, discovery.catalogs):
+            pipeline.stages[0].post_exec = self._stream_chunk(pipeline,
+                                                              catalog,
+                                                              pre_execs)
+
+        self._execute(set(disc_pipelines))
+
+    def _service_pipelines(self, images):
+        '''
+        Returns the pipelines of some images with one inference worker per
+        GPU. Images are assigned to the workers round robin, in
+        schedule order, and all pipelines are submitted at once, so the
+        workers run next to the image pipelines they serve.
+
+        The image pipelines of a worker run in lanes, one image after the
+        other, and the lanes of all the workers leave a core for every
+        worker. Tasks that wait for a worker can then never hold the cores
+        a pending worker needs: every worker starts before its first image
+        is tiled and submitted.
+        '''
+
+        pre_execs = self._resolve_pre_execs()
+        images = order_images(images, self._schedule)
+        workers = max(self._res_dict['gpus'], 1)
+        lanes = max(1, (self._res_dict['cpus'] - workers)
+                    // (self._slot_resources()[0] * workers))
+
+        pipelines = list()
+        for idx in range(workers):
+            assigned = images[idx::workers]
+            if not assigned:
+                continue
+            worker = '%sW%d' % (self._prefix, idx)
+            pipelines.append(self._generate_worker_pipeline(
+                name=worker, pre_execs=pre_execs, items=len(assigned)))
+            worker_lanes = [list() for _ in range(min(lanes, len(assigned)))]
+            for jdx, (image, size) in enumerate(assigned):
+                name = self._pipeline_name([image])
+                img_pipe = self._generate_service_pipeline(
+                    name=name, pre_execs=pre_execs, image=image,
+                    image_size=size, worker='%s.S0.T0' % worker)
+                self._journal_pipeline(img_pipe, [image])
+                self._profile_pipeline(name, [(image, size)])
+                worker_lanes[jdx % len(worker_lanes)].append(img_pipe)
+            for jdx, lane in enumerate(worker_lanes):
+                pipelines.append(lane[0] if len(lane) == 1 else
+                                 self._chain_pipelines('%sL%d' % (worker, jdx),
+                                                       lane))
+
+        return pipelines
+
+    def _run_parts(self, images):
+        '''
+        Splits the images in parts that fit in the walltime with the
+        throughput model of the use case, and runs every part in its own
+        pilot, which asks only for the walltime of its part. The duration of
+        every part updates the model. Durations are taken from the profiles
+        of the tasks of the part, so the wait in the batch queue and the
+        pilot startup are left out. When the session of a part has no
+        profiles, the part does not update the model.
+        '''
+
+        use_case = type(self).__name__.lower()
+        model = ThroughputModel.load(self._throughput, use_case)
+        walltime = self._res_dict['walltime']
+        parts = plan_parts(images, model, self._slots, walltime)
+        walltimes = [part_walltime(part_images, model, self._slots, walltime)
+                     for part_images in parts]
+        self._logger.info('%d images are split in %d parts', len(images),
+                          len(parts))
+
+        # The pilot of a remote discovery is released before the first part,
+        # an AppManager that ran nothing never submitted one
+        if self._uids:
+            self._terminate()
+        for idx, part_images in enumerate(parts):
+            if self._part is not None and idx != self._part:
+                continue
+            res_dict = dict(self._res_dict)
+            res_dict['walltime'] = walltimes[idx]
+            self._logger.info('Part %d: %d images, %d minutes', idx,
+                              len(part_images), res_dict['walltime'])
+            if makespan(part_images, model, self._slots) > walltime * 60:
+                self._logger.warning('Part %d needs more than the walltime '
+                                     'of %d minutes and will not complete',
+                                     idx, walltime)
+            self._app_manager = self._create_app_manager(
+                '%s.part%d' % (self._name, idx), res_dict)
+            self._uids = list()
+            if self._shared_data():
+                self._app_manager.shared_data = self._shared_data()
+
+            try:
+                self._run_images(part_images)
+                uids = list(self._uids)
+                # The last part commits the discovery of all the parts
+                if self._part is None and idx == len(parts) - 1:
+                    self._commit_manifests()
+            finally:
+                # The profiles of the session are fetched when it closes
+                self._terminate()
+            seconds = run_seconds(str(self._app_manager.sid), uids)
+            if seconds is None:
+                self._logger.warning('Part %d has no task profiles, the '
+                                     'throughput model is not updated', idx)
+                continue
+            model.add_run(len(part_images),
+                          sum(size or 0 for _, size in part_images),
+                          seconds, self._slots)
+            model.save(self._throughput, use_case)
+
+    def _slot_resources(self):
+        '''
+        Returns the CPUs and GPUs one image analyzed at a time holds: the
+        most any task of its pipeline asks for.
+        '''
+
+        cpus, gpus = 1, 0
+        for stage in self._pipeline_template(None):
+            for template in stage:
+                cpu_reqs = template.get('cpu_reqs') or dict()
+                gpu_reqs = template.get('gpu_reqs') or dict()
+                processes = cpu_reqs.get('cpu_processes') \
+                    or cpu_reqs.get('processes') or 1
+                threads = cpu_reqs.get('cpu_threads') \
+                    or cpu_reqs.get('threads_per_process') or 1
+                cpus = max(cpus, processes * threads)
+                gpus = max(gpus, gpu_reqs.get('gpu_processes')
+                           or gpu_reqs.get('processes') or 0)
+
+        return cpus, gpus
+
+    def _use_slots(self, slots):
+        '''
+        Analyzes slots images at a time.
+        '''
+
+        self._slots = slots
+
+    def _size_allocation(self, images):
+        '''
+        Sizes the cpus, gpus and walltime of the allocation, so the images
+        complete within the target with the throughput model. The requested
+        resources are the most the allocation asks for, and they have to fit
+        the CPUs and GPUs of at least one image. The sized resource
+        description is logged before it is submitted.
+        '''
+
+        use_case = type(self).__name__.lower()
+        model = ThroughputModel.load(self._throughput, use_case)
+        slot_cpus, slot_gpus = self._slot_resources()
+        max_slots = self._res_dict['cpus'] // slot_cpus
+        if slot_gpus:
+            max_slots = min(max_slots,
+                            int(self._res_dict['gpus'] / slot_gpus))
+        if max_slots < 1:
+            raise ValueError('%d CPUs and %d GPUs do not fit an image of %s, '
+                             'which needs %s CPUs and %s GPUs' %
+                             (self._res_dict['cpus'], self._res_dict['gpus'],
+                              use_case, slot_cpus, slot_gpus))
+        slots, minutes = size_slots(images, model, self._target, max_slots)
+        if minutes is None:
+            self._logger.warning('The throughput model of %s has no runs, '
+                                 'using the requested resources', use_case)
+            return
+        if minutes > self._target:
+            self._logger.warning('%d images need %d minutes on the requested'
+                                 ' resources, more than the target of %d',
+                                 len(images), minutes, self._target)
+
+        self._res_dict = dict(self._res_dict)
+        self._res_dict.update({'cpus': slots * slot_cpus,
+                               'gpus': int(math.ceil(slots * slot_gpus)),
+                               'walltime': min(minutes,
+                                               self._res_dict['walltime'])})
+        self._use_slots(slots)
+        self._logger.info('Sized the allocation of %d images for %d minutes: '
+                          '%s', len(images), self._target,
+                          json.dumps(self._res_dict))
 
     def _run_workflow(self):
         '''
         Private method that creates and executes the workflow of the use case.
         '''
 
+        if self._streaming and not self._inference_service and \
+                not self._discovers_locally():
+            self._run_streaming_workflow()
+            self._commit_manifests()
+            return
+
+        if self._shared_data():
+            self._logger.debug('Uploading shared data %s',
+                               self._shared_data())
+            self._app_manager.shared_data = self._shared_data()
+        images = self._pending_images(self._discover_images())
+        if self._target:
+            self._size_allocation(images)
+        if self._throughput:
+            self._run_parts(images)
+        else:
+            self._run_images(images)
+            self._commit_manifests()
+
+    def _run_images(self, images):
+        '''
+        Creates and executes the workflow of some images.
+        '''
+
+        self._execute(set(self._image_workflow(images)))
+
+    def _image_workflow(self, images):
+        '''
+        Returns the pipelines of the workflow of some images. With
+        max_pipelines, only the pipelines in flight are built, and the others
+        are built as they complete.
+        '''
+
+        if self._inference_service:
+            return self._service_pipelines(images)
+
+        return self._roll_pipelines(self._lane_pipelines(images))
+
+    def _roll_pipelines(self, pipelines):
+        '''
+        Returns the first max_pipelines pipelines of an iterable. When the
+        last stage of one of them is done, its post_exec callback takes the
+        next pipeline of the iterable and appends its stages, so
+        max_pipelines run until the iterable is exhausted, without waiting
+        for the slowest one. Pipelines are built only when they can start.
+        Without max_pipelines, all the pipelines are returned.
+        '''
+
+        if not self._max_pipelines:
+            return list(pipelines)
+
+        pipelines = iter(pipelines)
+
+        def roll(carrier, stages):
+            callback = stages[-1].post_exec
+
+            def run_next():
+                if callback:
+                    callback()
+                pipeline = next(pipelines, None)
+                if pipeline is not None:
+                    roll(carrier, pipeline.stages)
+                    carrier.add_stages(pipeline.stages)
+
+            stages[-1].post_exec = run_next
+
+        carriers = list(itertools.islice(pipelines, self._max_pipelines))
+        for carrier in carriers:
+            roll(carrier, carrier.stages)
+
+        return carriers
+
+    def _lane_pipelines(self, images):
+        '''
+        Yields the pipeline of every lane of some images, in schedule order.
+        A pipeline is built when it is asked for.
+        '''
+
+        pre_execs = self._resolve_pre_execs()
+        images = order_images(images, self._schedule)
+        batching = self._batch_size or self._batch_mb
+        # Every unit is ((pipeline name, images), size)
+        if batching:
+            batches = batch_images(images, self._batch_size, self._batch_mb)
+            units = [((self._pipeline_name([image for image, _ in batch],
+                                           'B'), batch),
+                      sum(size or 0 for _, size in batch))
+                     for batch in batches]
+        else:
+            units = [((self._pipeline_name([image]), [(image, size)]), size)
+                     for image, size in images]
+        if self._schedule == 'lpt':
+            lanes = pack_images(units, self._slots)
+        else:
+            lanes = [[unit] for unit in units]
+
+        def lane_pipeline(lane, lane_units):
+            lane_pipelines = list()
+            lane_images = [unit_images[0] for (_, unit_images), _
+                           in lane_units]
+            for idx, ((name, unit_images), _) in enumerate(lane_units):
+                if batching:
+                    img_pipe = self._generate_batch_pipeline(
+                        name=name, pre_execs=pre_execs, images=unit_images)
+                else:
+                    fields = dict()
+                    if self._schedule == 'lpt':
+                        fields = self._prefetch_fields(
+                            '%sL%d' % (self._prefix, lane), lane_images, idx)
+                    img_pipe = self._generate_pipeline(
+                        name=name, pre_execs=pre_execs,
+                        image=unit_images[0][0], image_size=unit_images[0][1],
+                        **fields)
+                self._journal_pipeline(img_pipe,
+                                       [image for image, _ in unit_images])
+                self._profile_pipeline(name, unit_images)
+                lane_pipelines.append(img_pipe)
+            if self._schedule == 'lpt' and self._overlap:
+                return self._overlap_pipelines('%sL%d' % (self._prefix, lane),
+                                               lane_pipelines)
+            if self._schedule == 'lpt':
+                return self._chain_pipelines('%sL%d' % (self._prefix, lane),
+                                             lane_pipelines)
+            return lane_pipelines[0]
+
+        for lane, lane_units in enumerate(lanes):
+            yield lane_pipeline(lane, lane_units)
+
     def _terminate(self):
         '''
-        Stops the execution
+        Stops the execution. The AppManager of a part is released once.
         '''
 
-        self._app_manager.resource_terminate()
+        if self._uids is not None:
+            self._app_manager.resource_terminate()
+        self._uids = None
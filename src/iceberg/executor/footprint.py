@@ -0,0 +1,84 @@
+"""
+Author: Ioannis Paraskevakos
+License: MIT
+Copyright: 2018-2019
+"""
+
+import math
+import re
+
+# Every tile is a file: its header and the filesystem blocks it takes
+TILE_HEADER = 512
+GEO_HEADER = 1024
+BLOCK_SIZE = 4096
+
+
+def itemsize(dtype):
+    '''
+    Returns the bytes of a sample of a raster data type, e.g. 2 for uint16.
+    Unknown data types are taken as bytes.
+    '''
+
+    bits = re.sub('[^0-9]', '', dtype or '')
+
+    return max(int(bits) // 8, 1) if bits else 1
+
+
+def tile_count(width, height, tile, step):
+    '''
+    Returns the number of tiles of a raster. Tiles are tile pixels wide and
+    start every step pixels, and the last row and column of tiles cover the
+    edges of the raster.
+    '''
+
+    def along(length):
+        if length <= tile:
+            return 1
+        return int(math.ceil((length - tile) / float(step))) + 1
+
+    return along(width) * along(height)
+
+
+# pylint: disable=too-many-arguments
+def tiles_bytes(width, height, bands, dtype, tile, step, geotiff=False):
+    '''
+    Returns the bytes the tiles of a raster take on disk.
+
+    :Arguments:
+        :width: The columns of the raster, int
+        :height: The rows of the raster, int
+        :bands: The bands of every tile, int
+        :dtype: The data type of the raster, e.g. uint16, str
+        :tile: The side of a tile in pixels, int
+        :step: The distance between tiles in pixels, int
+        :geotiff: Whether every tile keeps its geotransform, bool
+    '''
+
+    header = TILE_HEADER + (GEO_HEADER if geotiff else 0)
+    per_tile = tile * tile * bands * itemsize(dtype) + header
+    per_tile = int(math.ceil(per_tile / float(BLOCK_SIZE))) * BLOCK_SIZE
+
+    return tile_count(width, height, tile, max(int(step), 1)) * per_tile
+
+
+def tiles_mb(raster, tile, step, bands=None, geotiff=False):
+    '''
+    Returns the MBs the tiles of an image take, rounded up, or None when its
+    raster header is not known.
+
+    :Arguments:
+        :raster: The catalog columns of the image: Width, Height, Bands and
+                 Dtype, dict
+        :tile: The side of a tile in pixels, int
+        :step: The distance between tiles in pixels, int
+        :bands: The bands of every tile. Default: the bands of the image
+        :geotiff: Whether every tile keeps its geotransform, bool
+    '''
+
+    if not raster or not raster.get('Width') or not raster.get('Height'):
+        return None
+
+    return int(math.ceil(tiles_bytes(raster['Width'], raster['Height'],
+                                     bands or raster.get('Bands') or 1,
+                                     raster.get('Dtype'), tile, step,
+                                     geotiff) / 1024.0 / 1024.0))
@@ -0,0 +1,336 @@
+"""
+Inference Worker Kernel
+==========================================================
+This script keeps a prediction model resident on a GPU and
+serves prediction jobs through a file based spool in node
+local storage. Tasks submit a job by writing it in the
+incoming folder of the spool and wait for its status in the
+done folder, so model loading and CUDA context creation are
+paid once per worker instead of once per image.
+
+A module keeps its model resident when it provides
+load_model() and predict(model, arguments), and close(model)
+is called when the worker stops, if the module provides it.
+Otherwise its main() is called for every job with sys.argv
+set to the job arguments, as the batch_runner kernel does.
+
+The worker keeps its PID and state in worker.json in the
+spool. A task that waits for a job fails as soon as the
+worker failed to load its model, stopped, or is gone,
+instead of waiting for a job nobody serves.
+Author: Ioannis Paraskevakos
+License: MIT
+Copyright: 2018-2019
+"""
+import argparse
+import errno
+import importlib
+import json
+import os
+import sys
+import time
+
+SPOOL_FOLDERS = ('incoming', 'running', 'done')
+# The states of a worker in its worker.json
+LOADING = 'loading'
+SERVING = 'serving'
+STOPPED = 'stopped'
+FAILED = 'failed'
+
+
+def make_spool(spool):
+    """
+    Creates the folders of a spool, if they do not exist.
+    :Arguments:
+        :spool: The spool folder, str
+    """
+
+    for folder in SPOOL_FOLDERS:
+        try:
+            os.makedirs(os.path.join(spool, folder))
+        except OSError:
+            if not os.path.isdir(os.path.join(spool, folder)):
+                raise
+
+
+def _write_json(filename, content):
+    """
+    Writes a JSON file atomically, so readers never see it half written.
+    """
+
+    tmp_filename = '%s.%d.tmp' % (filename, os.getpid())
+    with open(tmp_filename, 'w') as tmp_file:
+        json.dump(content, tmp_file)
+    os.rename(tmp_filename, filename)
+
+
+def push(spool, name, arguments):
+    """
+    Submits a job to the spool.
+    :Arguments:
+        :spool: The spool folder, str
+        :name: The job name. It has to be unique in the spool, str
+        :arguments: The command line arguments of the job, list
+    """
+
+    make_spool(spool)
+    _write_json(os.path.join(spool, 'incoming', '%s.json' % name), arguments)
+
+
+def set_state(spool, state):
+    """
+    Records the PID and the state of the worker of a spool.
+    """
+
+    make_spool(spool)
+    _write_json(os.path.join(spool, 'worker.json'),
+                {'pid': os.getpid(), 'state': state, 'time': time.time()})
+
+
+def worker_alive(spool):
+    """
+    Returns whether the worker of a spool can still serve jobs, or None when
+    it has not started yet. The worker runs on the same node as the tasks
+    that submit to it, so its PID is checked directly.
+    """
+
+    try:
+        with open(os.path.join(spool, 'worker.json')) as worker_json:
+            worker = json.load(worker_json)
+    except (IOError, ValueError):
+        return None
+    if worker['state'] in [STOPPED, FAILED]:
+        return False
+    try:
+        os.kill(worker['pid'], 0)
+    except OSError as error:
+        return error.errno == errno.EPERM
+
+    return True
+
+
+def wait(spool, name, timeout=None, poll=1.0):
+    """
+    Waits for a job to be served and returns its status, 0 on success.
+    Returns 1 when the timeout in seconds expires first, or when the worker
+    is gone before it serves the job.
+    :Arguments:
+        :spool: The spool folder, str
+        :name: The job name, str
+        :timeout: Seconds to wait for, float. Default: no limit
+        :poll: Seconds between checks, float
+    """
+
+    done = os.path.join(spool, 'done', '%s.json' % name)
+    start = time.time()
+    while not os.path.exists(done):
+        if worker_alive(spool) is False:
+            # The worker writes the status of a job before it stops
+            if os.path.exists(done):
+                break
+            print('The worker of %s is gone' % spool)
+            return 1
+        if timeout is not None and time.time() - start > timeout:
+            print('Job %s timed out' % name)
+            return 1
+        time.sleep(poll)
+
+    with open(done) as done_json:
+        return json.load(done_json)['status']
+
+
+class ResidentModel():
+    """
+    Serves jobs with a model that is loaded once.
+    """
+
+    def __init__(self, module):
+        self._module = module
+        self._model = module.load_model()
+
+    def __call__(self, arguments):
+        self._module.predict(self._model, arguments)
+
+    def close(self):
+        if hasattr(self._module, 'close'):
+            self._module.close(self._model)
+
+
+class EntryPointModel():
+    """
+    Serves jobs by calling the entry point of a module with sys.argv set to
+    the job arguments.
+    """
+
+    def __init__(self, module, function='main'):
+        self._name = module.__name__
+        self._entry_point = getattr(module, function)
+
+    def __call__(self, arguments):
+        saved_argv = sys.argv
+        sys.argv = [self._name] + list(arguments)
+        try:
+            self._entry_point()
+        except SystemExit as exit_status:
+            if exit_status.code not in [None, 0]:
+                raise
+        finally:
+            sys.argv = saved_argv
+
+
+def load_model(module):
+    """
+    Returns the model that serves the jobs of a module.
+    :Arguments:
+        :module: The module name, str
+    """
+
+    module = importlib.import_module(module)
+    if hasattr(module, 'load_model') and hasattr(module, 'predict'):
+        return ResidentModel(module)
+
+    return EntryPointModel(module)
+
+
+def _next_jobs(incoming):
+    """
+    Returns the jobs of the incoming folder, oldest first.
+    """
+
+    jobs = list()
+    for job in os.listdir(incoming):
+        if not job.endswith('.json'):
+            continue
+        try:
+            jobs.append((os.path.getmtime(os.path.join(incoming, job)), job))
+        except OSError:
+            continue
+
+    return [job for _, job in sorted(jobs)]
+
+
+def serve(spool, model, items=None, idle_timeout=None, poll=0.5):
+    """
+    Serves the jobs of a spool with a model, and returns the number of
+    jobs served. The worker stops after serving items jobs, or after
+    idle_timeout seconds without a job.
+    :Arguments:
+        :spool: The spool folder, str
+        :model: A callable that takes the arguments of a job
+        :items: The number of jobs to serve, int. Default: no limit
+        :idle_timeout: Seconds without a job before stopping, float.
+                       Default: no limit
+        :poll: Seconds between checks of an empty spool, float
+    """
+
+    make_spool(spool)
+    set_state(spool, SERVING)
+    try:
+        served = _serve_jobs(spool, model, items, idle_timeout, poll)
+    finally:
+        set_state(spool, STOPPED)
+
+    if hasattr(model, 'close'):
+        model.close()
+
+    return served
+
+
+def _serve_jobs(spool, model, items, idle_timeout, poll):
+    """
+    Serves the jobs of a spool, see serve.
+    """
+
+    incoming = os.path.join(spool, 'incoming')
+    served = 0
+    idle_since = time.time()
+    while items is None or served < items:
+        jobs = _next_jobs(incoming)
+        if not jobs:
+            if idle_timeout is not None and \
+                    time.time() - idle_since > idle_timeout:
+                break
+            time.sleep(poll)
+            continue
+
+        for job in jobs:
+            running = os.path.join(spool, 'running', job)
+            try:
+                os.rename(os.path.join(incoming, job), running)
+            except OSError:
+                continue
+            with open(running) as job_json:
+                arguments = json.load(job_json)
+
+            start = time.time()
+            status = 0
+            # pylint: disable=broad-except
+            try:
+                model(arguments)
+            except (Exception, SystemExit) as error:
+                print('Job %s failed: %s' % (job, error))
+                status = 1
+            print('Served %s in %.2f seconds' % (job, time.time() - start))
+            sys.stdout.flush()
+            _write_json(os.path.join(spool, 'done', job),
+                        {'status': status, 'seconds': time.time() - start})
+            os.remove(running)
+            served += 1
+            if served == items:
+                break
+        idle_since = time.time()
+
+    return served
+
+
+def run_worker(spool, module, items=None, idle_timeout=None):
+    """
+    Loads the model of a module and serves the jobs of a spool with it. The
+    worker is failed when the model does not load.
+    """
+
+    set_state(spool, LOADING)
+    try:
+        model = load_model(module)
+    except BaseException:
+        set_state(spool, FAILED)
+        raise
+
+    return serve(spool, model, items, idle_timeout)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    commands = parser.add_subparsers(dest='command')
+
+    serve_parser = commands.add_parser('serve', help='Serve the jobs of a \
+                                       spool')
+    serve_parser.add_argument('--spool', type=str, required=True)
+    serve_parser.add_argument('--module', type=str, required=True,
+                              help='The module that predicts')
+    serve_parser.add_argument('--items', type=int, default=None,
+                              help='Number of jobs to serve')
+    serve_parser.add_argument('--idle_timeout', type=float, default=None,
+                              help='Seconds without a job before stopping')
+
+    submit_parser = commands.add_parser('submit', help='Submit a job and \
+                                        wait for it')
+    submit_parser.add_argument('--spool', type=str, required=True)
+    submit_parser.add_argument('--name', type=str, required=True)
+    submit_parser.add_argument('--timeout', type=float, default=None)
+    submit_parser.add_argument('arguments', nargs=argparse.REMAINDER,
+                               help='The arguments of the job, after --')
+
+    args = parser.parse_args()
+
+    if args.command == 'serve':
+        run_worker(args.spool, args.module, args.items, args.idle_timeout)
+    elif args.command == 'submit':
+        job_args = args.arguments
+        if job_args and job_args[0] == '--':
+            job_args = job_args[1:]
+        push(args.spool, args.name, job_args)
+        sys.exit(wait(args.spool, args.name, args.timeout))
+    else:
+        parser.print_help()
+        sys.exit(2)
@@ -0,0 +1,100 @@
+"""
+Author: Ioannis Paraskevakos
+License: MIT
+Copyright: 2018-2019
+"""
+
+import contextlib
+import sqlite3
+import threading
+import time
+
+# The state of an image whose pipeline finished successfully
+DONE = 'DONE'
+# The state of an image whose pipeline was submitted
+SUBMITTED = 'SUBMITTED'
+# The state of an image whose pipeline had a task that did not finish
+FAILED = 'FAILED'
+
+
+class Journal():
+    '''
+    :Class Journal:
+    A SQLite journal with the state of the pipeline of every image of a use
+    case. It survives the middleware process, so a later run can submit only
+    the images that have not completed. Use cases keep their own states in
+    the same file, so an image Seals completed is still pending for Rivers.
+    Every call opens its own connection, so the journal can be updated from
+    the EnTK callback threads.
+    :Parameters:
+        :path: The journal file
+        :use_case: The use case of the states, e.g. seals
+    '''
+
+    def __init__(self, path, use_case=''):
+
+        self._path = path
+        self._use_case = use_case
+        self._lock = threading.Lock()
+        with self._connect() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS states ('
+                         'use_case TEXT, image TEXT, pipeline TEXT, '
+                         'state TEXT, updated REAL, '
+                         'PRIMARY KEY (use_case, image))')
+
+    @contextlib.contextmanager
+    def _connect(self):
+        '''
+        Yields a connection and commits when the block succeeds.
+        '''
+
+        with self._lock:
+            conn = sqlite3.connect(self._path, timeout=60)
+            try:
+                with conn:
+                    yield conn
+            finally:
+                conn.close()
+
+    def record(self, images, pipeline, state):
+        '''
+        Records the state of the pipeline of some images. A completed image
+        stays completed.
+
+        :Arguments:
+            :images: The image paths, list
+            :pipeline: The pipeline name, str
+            :state: The state, str
+        '''
+
+        now = time.time()
+        with self._connect() as conn:
+            conn.executemany('UPDATE states SET pipeline = ?, state = ?, '
+                             'updated = ? WHERE use_case = ? AND image = ? '
+                             'AND state != ?',
+                             [(pipeline, state, now, self._use_case, image,
+                               DONE) for image in images])
+            conn.executemany('INSERT OR IGNORE INTO states VALUES '
+                             '(?, ?, ?, ?, ?)',
+                             [(self._use_case, image, pipeline, state, now)
+                              for image in images])
+
+    def states(self):
+        '''
+        Returns the state of every image of the use case.
+        '''
+
+        with self._connect() as conn:
+            return dict(conn.execute('SELECT image, state FROM states WHERE '
+                                     'use_case = ?', (self._use_case,)))
+
+    def completed(self):
+        '''
+        Returns the set of images of the use case whose pipeline completed.
+        '''
+
+        with self._connect() as conn:
+            return set(image for image, in
+                       conn.execute('SELECT image FROM states WHERE '
+                                    'use_case = ? AND state = ?',
+                                    (self._use_case, DONE)))
@@ -0,0 +1,152 @@
+"""
+Model Cache Kernel
+==========================================================
+This script copies a model file or folder from the shared
+filesystem to node local storage once per node. The tasks of
+a node then read the local copy instead of all reading the
+same files from the shared filesystem. The first task of a
+node copies the model under a file lock, verifies the copy
+against the checksum of the source and marks it complete.
+The other tasks wait for the lock and reuse the copy.
+
+    python model_cache.py --source=/shared/model.h5 \
+        --target=$NODE_LFS_PATH/iceberg_models/<key>/model.h5
+Author: Ioannis Paraskevakos
+License: MIT
+Copyright: 2018-2019
+"""
+import argparse
+import fcntl
+import hashlib
+import os
+import shutil
+import sys
+
+CHUNK_SIZE = 1 << 20
+
+
+def _file_sha256(path, copy_to=None):
+    """
+    Returns the sha256 of a file, and copies it while reading it when
+    copy_to is set.
+    """
+
+    digest = hashlib.sha256()
+    output = open(copy_to, 'wb') if copy_to else None
+    try:
+        with open(path, 'rb') as source:
+            for chunk in iter(lambda: source.read(CHUNK_SIZE), b''):
+                digest.update(chunk)
+                if output:
+                    output.write(chunk)
+    finally:
+        if output:
+            output.close()
+
+    return digest.hexdigest()
+
+
+def sha256sum(path, copy_to=None):
+    """
+    Returns the sha256 of a file or a folder, and copies it while reading it
+    when copy_to is set. The checksum of a folder covers the relative path
+    and the checksum of every file.
+    :Arguments:
+        :path: The file or folder, str
+        :copy_to: Where the copy is written, str
+    """
+
+    if not os.path.isdir(path):
+        return _file_sha256(path, copy_to)
+
+    digest = hashlib.sha256()
+    files = list()
+    for root, _, filenames in os.walk(path):
+        files += [os.path.relpath(os.path.join(root, filename), path)
+                  for filename in filenames]
+    if copy_to:
+        os.makedirs(copy_to)
+    for relpath in sorted(files):
+        target = os.path.join(copy_to, relpath) if copy_to else None
+        if target and not os.path.isdir(os.path.dirname(target)):
+            os.makedirs(os.path.dirname(target))
+        file_digest = _file_sha256(os.path.join(path, relpath), target)
+        digest.update(('%s\n%s\n' % (relpath, file_digest)).encode())
+
+    return digest.hexdigest()
+
+
+def _remove(path):
+    """
+    Removes a file or a folder, if it exists.
+    """
+
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.exists(path):
+        os.remove(path)
+
+
+def fetch(source, target, sha256=None, verify=False):
+    """
+    Copies a model to target, unless a verified copy is there. Returns
+    whether the model was copied.
+    :Arguments:
+        :source: The model file or folder, str
+        :target: The node local copy, str
+        :sha256: The expected checksum of the model, str. Default: the
+                 checksum of the source, read while copying
+        :verify: Whether an existing copy is checked again, bool
+    """
+
+    folder = os.path.dirname(os.path.abspath(target))
+    if not os.path.isdir(folder):
+        try:
+            os.makedirs(folder)
+        except OSError:
+            if not os.path.isdir(folder):
+                raise
+    marker = '%s.sha256' % target
+    with open('%s.lock' % target, 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        if os.path.exists(marker) and os.path.exists(target):
+            with open(marker) as marker_file:
+                recorded = marker_file.read().strip()
+            if (sha256 is None or recorded == sha256) and \
+                    (not verify or sha256sum(target) == recorded):
+                return False
+        _remove(marker)
+        _remove(target)
+
+        tmp_target = '%s.tmp' % target
+        _remove(tmp_target)
+        source_sum = sha256sum(source, copy_to=tmp_target)
+        if sha256 is not None and source_sum != sha256:
+            _remove(tmp_target)
+            raise RuntimeError('%s does not match its checksum' % source)
+        if sha256sum(tmp_target) != source_sum:
+            _remove(tmp_target)
+            raise RuntimeError('The copy of %s is corrupted' % source)
+        os.rename(tmp_target, target)
+        with open('%s.tmp' % marker, 'w') as marker_file:
+            marker_file.write(source_sum)
+        os.rename('%s.tmp' % marker, marker)
+
+    return True
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--source', type=str, required=True,
+                        help='The model file or folder')
+    parser.add_argument('--target', type=str, required=True,
+                        help='The node local copy')
+    parser.add_argument('--sha256', type=str, default=None,
+                        help='The expected checksum of the model')
+    parser.add_argument('--verify', action='store_true',
+                        help='Check an existing copy again')
+    args = parser.parse_args()
+
+    copied = fetch(args.source, args.target, args.sha256, args.verify)
+    print('%s %s' % ('Copied' if copied else 'Reused', args.target))
+    sys.stdout.flush()
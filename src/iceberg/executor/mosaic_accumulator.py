@@ -0,0 +1,345 @@
+"""
+Mosaic Accumulator Kernel
+==========================================================
+This module stitches predicted tiles in the mosaic of an
+image while they are predicted, instead of after all of them
+are written. It is loaded by the tile_stream kernel as a
+resident model: every batch of predicted tiles is added to
+the mosaic and deleted.
+
+Tiles overlap when the step is smaller than the tile size.
+Every tile is weighted by a ramp over its overlap, so tile
+borders blend into their neighbours. Only a window of rows
+is held in memory: rows that no missing tile covers are
+normalized, written and leave the window. The missing tiles
+are the tiles of the tiling folder that were not added yet.
+
+Tile names carry their position, by default as grid indices
+<name>_<row>_<col>.<ext>. NumPy is required, and GDAL for
+tiles and mosaics that are not .npy files.
+Author: Ioannis Paraskevakos
+License: MIT
+Copyright: 2018-2019
+"""
+import argparse
+import os
+import re
+
+TILE_PATTERN = r'(?P<row>\d+)_(?P<col>\d+)\.[^.]+$'
+
+
+def tile_offset(name, step, pattern=TILE_PATTERN, pixels=False):
+    """
+    Returns the (row, col) pixel offset of a tile from its name, or None when
+    the name does not match the pattern.
+    :Arguments:
+        :name: The tile file name, str
+        :step: The step of the tiles in pixels, int
+        :pattern: A regular expression with row and col groups, str
+        :pixels: Whether the name has pixel offsets instead of grid indices
+    """
+
+    match = re.search(pattern, os.path.basename(name))
+    if not match:
+        return None
+    scale = 1 if pixels else step
+
+    return int(match.group('row')) * scale, int(match.group('col')) * scale
+
+
+def ramp(size, overlap):
+    """
+    Returns the weights of size pixels of a tile: they grow linearly over the
+    overlap on either side, and are 1 in between.
+    """
+
+    import numpy as np
+
+    if overlap <= 0:
+        return np.ones(size, dtype=np.float32)
+    distance = np.minimum(np.arange(1, size + 1), np.arange(size, 0, -1))
+
+    return np.minimum(distance / float(overlap + 1), 1).astype(np.float32)
+
+
+class NpyWriter():
+    """
+    Writes the rows of a mosaic in a .npy file.
+    """
+
+    def __init__(self, path, height, width, bands=1):
+        import numpy as np
+
+        shape = (height, width) if bands == 1 else (height, width, bands)
+        self._mosaic = np.lib.format.open_memmap(path, mode='w+',
+                                                 dtype=np.float32,
+                                                 shape=shape)
+
+    def __call__(self, rows, yoff):
+        self._mosaic[yoff:yoff + rows.shape[0]] = rows
+
+    def close(self):
+        self._mosaic.flush()
+        del self._mosaic
+
+
+class GdalWriter():
+    """
+    Writes the rows of a mosaic in a GeoTIFF with the georeference of the
+    image.
+    """
+
+    def __init__(self, path, height, width, bands=1, reference=None):
+        from osgeo import gdal
+
+        self._mosaic = gdal.GetDriverByName('GTiff').Create(
+            path, width, height, bands, gdal.GDT_Float32,
+            ['COMPRESS=LZW', 'TILED=YES', 'BIGTIFF=IF_SAFER'])
+        if reference:
+            image = gdal.Open(reference)
+            self._mosaic.SetGeoTransform(image.GetGeoTransform())
+            self._mosaic.SetProjection(image.GetProjection())
+
+    def __call__(self, rows, yoff):
+        if rows.ndim == 2:
+            self._mosaic.GetRasterBand(1).WriteArray(rows, 0, yoff)
+            return
+        for band in range(rows.shape[2]):
+            self._mosaic.GetRasterBand(band + 1).WriteArray(rows[:, :, band],
+                                                            0, yoff)
+
+    def close(self):
+        self._mosaic.FlushCache()
+        self._mosaic = None
+
+
+def read_tile(path):
+    """
+    Returns a tile as a (rows, cols) or (rows, cols, bands) array.
+    """
+
+    import numpy as np
+
+    if path.endswith('.npy'):
+        return np.load(path)
+
+    from osgeo import gdal
+
+    tile = gdal.Open(path).ReadAsArray()
+    if tile.ndim == 3:
+        tile = tile.transpose(1, 2, 0)
+
+    return tile
+
+
+class MosaicAccumulator():
+    """
+    Accumulates overlapping tiles in a mosaic, one window of rows at a time.
+    :Arguments:
+        :height: The rows of the mosaic, int
+        :width: The columns of the mosaic, int
+        :tile_size: The size of the tiles in pixels, int
+        :step: The step of the tiles in pixels, int
+        :writer: A callable that writes rows at a row offset, with a close
+                 method
+        :expected: The (row, col) offsets of all the tiles, list
+    """
+
+    # pylint: disable=too-many-arguments
+    def __init__(self, height, width, tile_size, step, writer, expected):
+
+        self.height = height
+        self.width = width
+        self._overlap = tile_size - step
+        self._writer = writer
+        self._missing = dict()
+        for row, col in expected:
+            self._missing.setdefault(row, set()).add(col)
+        self._top = 0
+        self._sums = None
+        self._weights = None
+        self._ramps = dict()
+
+    def _weight(self, rows, cols):
+        """
+        Returns the weights of a tile of some rows and columns.
+        """
+
+        if (rows, cols) not in self._ramps:
+            self._ramps[(rows, cols)] = ramp(rows, self._overlap)[:, None] * \
+                ramp(cols, self._overlap)[None, :]
+
+        return self._ramps[(rows, cols)]
+
+    def _grow(self, bottom, tile):
+        """
+        Extends the window to the row bottom.
+        """
+
+        import numpy as np
+
+        rows = bottom - self._top - (0 if self._sums is None
+                                     else self._sums.shape[0])
+        if rows <= 0:
+            return
+        extra = (rows, self.width) + tile.shape[2:]
+        if self._sums is None:
+            self._sums = np.zeros(extra, dtype=np.float32)
+            self._weights = np.zeros((rows, self.width), dtype=np.float32)
+            return
+        self._sums = np.concatenate([self._sums,
+                                     np.zeros(extra, dtype=np.float32)])
+        self._weights = np.concatenate(
+            [self._weights, np.zeros((rows, self.width), dtype=np.float32)])
+
+    def add(self, row, col, tile):
+        """
+        Adds a tile at a pixel offset, and writes the rows it completes.
+        """
+
+        if row < self._top:
+            raise ValueError('Rows of the tile at %d, %d are written' %
+                             (row, col))
+        tile = tile[:self.height - row, :self.width - col]
+        rows, cols = tile.shape[:2]
+        self._grow(row + rows, tile)
+        weight = self._weight(rows, cols)
+        window = slice(row - self._top, row - self._top + rows)
+        if tile.ndim == 3:
+            self._sums[window, col:col + cols] += tile * weight[:, :, None]
+        else:
+            self._sums[window, col:col + cols] += tile * weight
+        self._weights[window, col:col + cols] += weight
+
+        self._missing.get(row, set()).discard(col)
+        if not self._missing.get(row, True):
+            del self._missing[row]
+        self._flush(min(self._missing) if self._missing else self.height)
+
+    def _flush(self, bottom):
+        """
+        Normalizes and writes the rows of the window above the row bottom.
+        """
+
+        import numpy as np
+
+        if self._sums is None:
+            return
+        rows = min(bottom - self._top, self._sums.shape[0])
+        if rows <= 0:
+            return
+        weights = self._weights[:rows]
+        if self._sums.ndim == 3:
+            weights = weights[:, :, None]
+        means = self._sums[:rows] / np.maximum(weights, 1e-12)
+        self._writer(np.where(weights > 0, means, 0), self._top)
+        self._sums = self._sums[rows:]
+        self._weights = self._weights[rows:]
+        self._top += rows
+
+    def close(self):
+        """
+        Writes the rows left in the window and closes the writer. Returns the
+        number of tiles that were never added.
+        """
+
+        self._flush(self.height)
+        self._writer.close()
+
+        return sum(len(cols) for cols in self._missing.values())
+
+
+def _parse(arguments):
+    """
+    Returns the options of a batch.
+    """
+
+    parser = argparse.ArgumentParser(prog='mosaic_accumulator')
+    parser.add_argument('--tiles', type=str, required=True,
+                        help='The tiling folder, with every tile')
+    parser.add_argument('--image', type=str, required=True,
+                        help='The image of the tiles')
+    parser.add_argument('--output', type=str, required=True,
+                        help='The mosaic, .npy or GeoTIFF')
+    parser.add_argument('--tile_size', type=int, required=True)
+    parser.add_argument('--step', type=int, required=True)
+    parser.add_argument('--height', type=int, default=None,
+                        help='Default: the height of the image')
+    parser.add_argument('--width', type=int, default=None,
+                        help='Default: the width of the image')
+    parser.add_argument('--bands', type=int, default=1)
+    parser.add_argument('--pattern', type=str, default=TILE_PATTERN)
+    parser.add_argument('--pixel_offsets', action='store_true')
+    parser.add_argument('--batch', type=str, required=True,
+                        help='The folder of the predicted tiles to add')
+
+    return parser.parse_args(arguments)
+
+
+def _accumulator(args):
+    """
+    Returns the accumulator of the mosaic of some options.
+    """
+
+    height, width = args.height, args.width
+    if height is None or width is None:
+        from image_disc import raster_header
+
+        header = raster_header(args.image)
+        height, width = header['Height'], header['Width']
+    if args.output.endswith('.npy'):
+        writer = NpyWriter(args.output, height, width, args.bands)
+    else:
+        writer = GdalWriter(args.output, height, width, args.bands,
+                            args.image)
+    expected = list()
+    for _, _, files in os.walk(args.tiles):
+        for filename in files:
+            offset = tile_offset(filename, args.step, args.pattern,
+                                 args.pixel_offsets)
+            if offset is not None:
+                expected.append(offset)
+
+    return MosaicAccumulator(height, width, args.tile_size, args.step,
+                             writer, expected)
+
+
+def load_model():
+    """
+    Returns the state of the mosaic, which is created with its first batch.
+    """
+
+    return dict()
+
+
+def predict(model, arguments):
+    """
+    Adds the tiles of a batch to the mosaic and deletes them.
+    """
+
+    args = _parse(arguments)
+    if 'mosaic' not in model:
+        model['mosaic'] = _accumulator(args)
+        model['args'] = args
+    for root, _, files in os.walk(args.batch):
+        for filename in sorted(files):
+            offset = tile_offset(filename, args.step, args.pattern,
+                                 args.pixel_offsets)
+            if offset is None:
+                continue
+            path = os.path.join(root, filename)
+            model['mosaic'].add(offset[0], offset[1], read_tile(path))
+            os.remove(path)
+
+
+def close(model):
+    """
+    Completes the mosaic. Fails when tiles are missing.
+    """
+
+    if 'mosaic' not in model:
+        return
+    missing = model['mosaic'].close()
+    if missing:
+        raise RuntimeError('%d tiles of %s are missing' %
+                           (missing, model['args'].image))
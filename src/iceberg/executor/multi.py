@@ -0,0 +1,124 @@
+"""
+Author: Ioannis Paraskevakos
+License: MIT
+Copyright: 2018-2019
+"""
+# pylint: disable=protected-access
+
+import shutil
+
+
+class MultiExecutor():
+    '''
+    :Class MultiExecutor:
+    Runs several use cases over the same images in one allocation. The
+    executors share the AppManager of the first one, so the pilot waits in
+    the queue and starts once. The images are discovered once, by the first
+    executor, and the pipelines of every use case are executed together in
+    a single run, so the CPU tasks of one use case run next to the GPU tasks
+    of another. The pipeline names of every use case get its name as a
+    prefix, e.g. SealsP<hash>, so their tasks do not collide.
+
+    Every executor keeps its own options, e.g. schedule, batching,
+    max_pipelines, journal and profile. With max_pipelines, the pipelines of
+    a use case are built as its pipelines in flight complete. Throughput
+    parts and target sizing need an allocation of their own, and streaming a
+    discovery per use case, so they are rejected. The manifests of a
+    changed_only discovery are updated once every use case succeeded.
+    :Parameters:
+        :executors: The executors of the use cases. They analyze the images
+                    of the same input path, with the same file type. The
+                    first one gives the allocation.
+        :app_manager: The AppManager of the allocation. Default: the one of
+                      the first executor
+    '''
+
+    def __init__(self, executors, app_manager=None):
+
+        if not executors:
+            raise ValueError('MultiExecutor needs at least one executor')
+        first = executors[0]
+        for executor in executors[1:]:
+            if (executor._data_input_path, executor._img_ftype) != \
+                    (first._data_input_path, first._img_ftype):
+                raise ValueError('%s and %s do not analyze the same images' %
+                                 (type(first).__name__,
+                                  type(executor).__name__))
+        if any(executor._throughput for executor in executors):
+            raise ValueError('Throughput parts are not supported with '
+                             'several use cases')
+        if any(executor._target for executor in executors):
+            raise ValueError('Target sizing is not supported with several '
+                             'use cases')
+        if any(executor._streaming for executor in executors):
+            raise ValueError('Streaming is not supported with several use '
+                             'cases')
+
+        self._executors = executors
+        self._app_manager = app_manager or first._app_manager
+        self._logger = first._logger
+
+        names = [type(executor).__name__ for executor in executors]
+        for idx, executor in enumerate(executors):
+            executor._app_manager = self._app_manager
+            if len(executors) > 1:
+                executor._prefix = names[idx] if names.count(names[idx]) == 1 \
+                    else '%s%d' % (names[idx], idx)
+
+    def run(self, terminate=True):
+        '''
+        This is a blocking execution method. It executes every use case and
+        releases the allocation at the end, unless terminate is False.
+        '''
+        try:
+            self._logger.debug('Running %d use cases', len(self._executors))
+            self._run_workflow()
+        finally:
+            if terminate:
+                self._app_manager.resource_terminate()
+            for executor in self._executors:
+                if executor._batches:
+                    shutil.rmtree(executor._batches, ignore_errors=True)
+                if executor._profile:
+                    executor._write_profile()
+
+    def shared_data(self):
+        '''
+        Returns the files the use cases upload to the pilot sandbox.
+        '''
+
+        shared_data = list()
+        for executor in self._executors:
+            shared_data += [path for path in executor._shared_data()
+                            if path not in shared_data]
+
+        return shared_data
+
+    def _run_workflow(self):
+        '''
+        Discovers the images once and executes the workflows of all the use
+        cases together.
+        '''
+
+        shared_data = self.shared_data()
+        if shared_data:
+            self._app_manager.shared_data = shared_data
+
+        first = self._executors[0]
+        images = first._discover_images()
+        workflows = list()
+        for executor in self._executors:
+            executor._catalog = first._catalog
+            workflows.append(set(executor._image_workflow(
+                executor._pending_images(images))))
+
+        if any(workflows):
+            self._logger.info('Running %s', ', '.join(
+                '%d %s pipelines' % (len(workflow), type(executor).__name__)
+                for executor, workflow in zip(self._executors, workflows)))
+            self._app_manager.workflow = set().union(*workflows)
+            self._app_manager.run()
+            for executor, workflow in zip(self._executors, workflows):
+                executor._profile_workflow(workflow)
+            first._record_outcome(set().union(*workflows))
+        first._commit_manifests()
@@ -6,11 +6,8 @@ Copyright: 2019-2020
 
 from __future__ import print_function
 import os
-import csv
-import radical.entk as re
 
 from .executor import Executor
-from ..discovery import Discovery
 
 
 class Penguins(Executor):
@@ -23,20 +20,33 @@ class Penguins(Executor):
         :model: The model name
         :model_path: Path of a custom model
         :epoch: number of epochs (300)
+        :gpu_concurrency: The number of concurrent detections on every GPU.
+                          Use more than one for small images. Without
+                          slots, it sets the slots to gpus * gpu_concurrency.
+                          Default: 1
+        :kwargs: further execution options, passed to Executor
     '''
+    # The Penguins use case analyzes PNG images
+    _img_ftype = 'png'
+    # The reducer indexes the masks of the images
+    _results_kind = 'penguins'
+
     # pylint: disable=too-many-arguments
     def __init__(self, name, resources, project=None, input_path=None,
-                 output_path=None, gpu_ids=None, model=None,
-                 model_path=None, epoch=None):
-        print(resources)
+                 output_path=None, model=None, model_path=None, epoch=None,
+                 gpu_concurrency=1, **kwargs):
         super(Penguins, self).__init__(name=name,
                                        resource=resources['resource'],
                                        queue=resources['queue'],
                                        walltime=resources['walltime'],
                                        cpus=resources['cpus'],
                                        gpus=resources['gpus'],
-                                       project=project)
-        self._gpu_ids = gpu_ids
+                                       project=project,
+                                       **kwargs)
+        self._gpu_concurrency = gpu_concurrency
+        if not kwargs.get('slots') and resources['gpus']:
+            # Every GPU analyzes gpu_concurrency images at a time
+            self._use_slots(resources['gpus'] * gpu_concurrency)
         self._data_input_path = input_path
         self._output_path = output_path
         self._model_name = model
@@ -56,116 +66,52 @@ class Penguins(Executor):
 
         self._logger.info('Penguins initialized')
 
-    def run(self):
-        '''
-        This is a blocking execution method. This method should be called to
-        execute the usecase.
+    def _results(self):
         '''
-        try:
-            self._logger.debug('Running workflow')
-            self._run_workflow()
-        finally:
-            self._terminate()
-
-    def _resolve_pre_execs(self):
+        The masks of an image are written in output_path, under the name of
+        the image.
         '''
-        This is a utils method. It takes the list of modules and return a list
-        of pre_exec commands
-        '''
-
-        tmp_pre_execs = list()
-        for module in self._req_modules:
-            tmp_pre_exec = 'module load %s' % module
-            self._logger.debug("Preexec added: %s", tmp_pre_exec)
-            tmp_pre_execs.append(tmp_pre_exec)
 
-        tmp_pre_execs = tmp_pre_execs + self._pre_execs
-
-        return tmp_pre_execs
-
-    def _generate_pipeline(self, name, pre_execs, image, gpu_id):
+        return '%s/%%(stem)s*' % self._output_path
 
+    def _pipeline_template(self, pre_execs):
         '''
-        This function creates a pipeline for an image that will be analyzed.
-
-        :Arguments:
-            :name: Pipeline name, str
-            :image: image path, str
-            :model_path: Path to the model file, str
-            :model_arch: Prediction Model Architecture, str
-            :model_name: Prediction Model Name, str
-            :hyperparam_set: Which hyperparameter set to use, str
+        An image is analyzed by a single detection task. It asks for its
+        share of a GPU, so gpu_concurrency detections can share one. RP binds
+        the detection to the GPU with CUDA_VISIBLE_DEVICES, so the detection
+        uses device 0.
         '''
-        # Create a Pipeline object
-        entk_pipeline = re.Pipeline()
-        entk_pipeline.name = name
-        # Create a Stage object
-        stage0 = re.Stage()
-        stage0.name = '%s-S0' % (name)
-        # Create Task 1, training
-        task1 = re.Task()
-        task1.name = '%s-T0' % stage0.name
-        task1.pre_exec = pre_execs
-        task1.executable = 'iceberg_penguins.detect'  # Assign task executable
-        # Assign arguments for the task executable
-        task1.arguments = ['--gpu_ids', gpu_id,
-                           '--name', self._model_name,
-                           '--epoch', self._epoch,
-                           '--checkpoints_dir', self._model_path,
-                           '--output', self._output_path,
-                           '--testset', 'GE',
-                           '--input_im', image.split('/')[-1]]
-        task1.link_input_data = ['%s' % image]
-        task1.cpu_reqs = {'cpu_processes': 1, 'cpu_threads': 1,
-                          'cpu_process_type': None, 'cpu_thread_type': 'OpenMP'}
-        task1.gpu_reqs = {'gpu_processes': 1, 'gpu_threads': 1,
-                          'gpu_process_type': None, 'gpu_thread_type': 'OpenMP'}
-        # Download resuting images
-        # task1.download_output_data = ['%s/ > %s' % (image.split('/')[-1].
-        #                                            split('.')[0],
-        #                                            image.split('/')[-1])]
-        # task1.tag = task0.name
-
-        stage0.add_tasks(task1)
-        # Add Stage to the Pipeline
-        entk_pipeline.add_stages(stage0)
-
-        return entk_pipeline
-
-    def _run_workflow(self):
-        '''
-        Private method that creates and executes the workflow of the use case.
-        '''
-
-        discovery = Discovery(modules=self._req_modules,
-                              paths=self._data_input_path,
-                              pre_execs=self._pre_execs)
-        discovery_pipeline = discovery.generate_discover_pipe(img_ftype='png')
-
-        self._app_manager.workflow = set([discovery_pipeline])
-
-        self._app_manager.run()
-        images_csv = open('images0.csv')
-        images = csv.reader(images_csv)
-        _ = next(images)
-        pre_execs = self._resolve_pre_execs()
-        img_pipelines = list()
-        idx = 0
-        for [image, _] in images:
-            img_pipe = self._generate_pipeline(name='P%s' % idx,
-                                               pre_execs=pre_execs,
-                                               image=image,
-                                               gpu_id=0)
-            img_pipelines.append(img_pipe)
-            idx += 1
-        images_csv.close()
-        self._app_manager.workflow = set(img_pipelines)
-
-        self._app_manager.run()
 
-    def _terminate(self):
+        template = {'name': 'T0',
+                    'pre_exec': pre_execs,
+                    'executable': 'iceberg_penguins.detect',
+                    'link_input_data': ['%(image)s'],
+                    'cpu_reqs': {'cpu_processes': 1, 'cpu_threads': 1,
+                                 'cpu_process_type': None,
+                                 'cpu_thread_type': 'OpenMP'},
+                    'gpu_reqs': {'gpu_processes': 1.0 / self._gpu_concurrency,
+                                 'gpu_threads': 1,
+                                 'gpu_process_type': None,
+                                 'gpu_thread_type': 'OpenMP'}}
+        checkpoints_dir = self._model_path
+        if self._model_cache:
+            # The checkpoints of the model are in a folder named after it
+            model = os.path.join(self._model_path or '.', self._model_name)
+            checkpoints_dir = os.path.dirname(self._cache_model(template,
+                                                                model, model))
+        template['arguments'] = ['--gpu_ids', '0',
+                                 '--name', self._model_name,
+                                 '--epoch', self._epoch,
+                                 '--checkpoints_dir', checkpoints_dir,
+                                 '--output', self._output_path,
+                                 '--testset', 'GE',
+                                 '--input_im', '%(basename)s']
+
+        return [[template]]
+
+    def _slot_resources(self):
         '''
-        Stops the execution
+        A detection holds a CPU and its share of a GPU.
         '''
 
-        self._app_manager.resource_terminate()
+        return 1, 1.0 / self._gpu_concurrency
@@ -0,0 +1,222 @@
+"""
+Author: Ioannis Paraskevakos
+License: MIT
+Copyright: 2018-2019
+"""
+
+import json
+import math
+import os
+
+from .scheduler import pack_images
+
+
+class ThroughputModel():
+    '''
+    :Class ThroughputModel:
+    The time a use case needs for an image: seconds_per_image plus
+    seconds_per_mb for every MB of the image, on one slot. It is fitted on
+    the runs it has seen, so past runs or a short calibration run build it.
+    :Parameters:
+        :runs: A list of [images, MBs, seconds, slots] of past runs
+    '''
+
+    def __init__(self, runs=None):
+
+        self.runs = runs or list()
+        self.seconds_per_image = 0.0
+        self.seconds_per_mb = 0.0
+        self._fit()
+
+    def _fit(self):
+        '''
+        Fits the model on the slot seconds of the runs, with least squares.
+        '''
+
+        samples = [(images, megabytes, seconds * slots)
+                   for images, megabytes, seconds, slots in self.runs
+                   if images]
+        if not samples:
+            return
+
+        snn = sum(images * images for images, _, _ in samples)
+        snm = sum(images * megabytes for images, megabytes, _ in samples)
+        smm = sum(megabytes * megabytes for _, megabytes, _ in samples)
+        snw = sum(images * work for images, _, work in samples)
+        smw = sum(megabytes * work for _, megabytes, work in samples)
+        det = snn * smm - snm * snm
+        if det > 1e-9 * snn * smm:
+            per_image = (snw * smm - smw * snm) / det
+            per_mb = (smw * snn - snw * snm) / det
+            if per_image >= 0 and per_mb >= 0:
+                self.seconds_per_image = per_image
+                self.seconds_per_mb = per_mb
+                return
+
+        # Too few or degenerate runs: one of the two terms explains the work
+        if smm:
+            self.seconds_per_image = 0.0
+            self.seconds_per_mb = smw / smm
+        else:
+            self.seconds_per_image = snw / snn
+            self.seconds_per_mb = 0.0
+
+    def fitted(self):
+        '''
+        Returns whether the model has seen any run.
+        '''
+
+        return bool(self.seconds_per_image or self.seconds_per_mb)
+
+    def add_run(self, images, megabytes, seconds, slots):
+        '''
+        Adds a run to the model and fits it again.
+
+        :Arguments:
+            :images: The number of images of the run, int
+            :megabytes: The total size of the images, int
+            :seconds: The duration of the run, float
+            :slots: The number of images analyzed concurrently, int
+        '''
+
+        self.runs.append([images, megabytes, seconds, slots])
+        self._fit()
+
+    def estimate(self, image_size):
+        '''
+        Returns the seconds an image of some MBs takes on one slot.
+        '''
+
+        return self.seconds_per_image + self.seconds_per_mb * (image_size or 0)
+
+    @classmethod
+    def load(cls, path, use_case):
+        '''
+        Returns the model of a use case from a JSON file with the runs of
+        every use case. A missing file or use case gives an empty model.
+        '''
+
+        if not os.path.exists(path):
+            return cls()
+        with open(path) as model_json:
+            return cls(json.load(model_json).get(use_case, dict()).get('runs'))
+
+    def save(self, path, use_case):
+        '''
+        Saves the model of a use case in a JSON file, keeping the other use
+        cases.
+        '''
+
+        models = dict()
+        if os.path.exists(path):
+            with open(path) as model_json:
+                models = json.load(model_json)
+        models[use_case] = {'runs': self.runs,
+                            'seconds_per_image': self.seconds_per_image,
+                            'seconds_per_mb': self.seconds_per_mb}
+        tmp_path = '%s.tmp' % path
+        with open(tmp_path, 'w') as model_json:
+            json.dump(models, model_json, indent=2)
+        os.rename(tmp_path, path)
+
+
+def makespan(images, model, slots):
+    '''
+    Returns the estimated seconds slots need for some images, when they are
+    packed with lpt.
+    '''
+
+    estimates = [(image, model.estimate(size)) for image, size in images]
+
+    return max([sum(seconds for _, seconds in slot)
+                for slot in pack_images(estimates, slots)] or [0])
+
+
+def plan_parts(images, model, slots, walltime, margin=0.2):
+    '''
+    Splits the images in parts whose estimated makespan fits in a walltime,
+    so every part can run in its own pilot. An image that does not fit on its
+    own gets a part of its own. Returns a list of parts, each a list of
+    (image, size) tuples, in the order of the images.
+
+    :Arguments:
+        :images: A list of (image, size) tuples
+        :model: The ThroughputModel of the use case
+        :slots: The number of images analyzed concurrently, int
+        :walltime: The walltime of a pilot in minutes, int
+        :margin: The fraction of the walltime kept for pilot startup and
+                 estimation errors, float
+    '''
+
+    if not model.fitted():
+        return [images] if images else []
+
+    budget = walltime * 60 * (1 - margin) * slots
+    parts = list()
+    part = list()
+    work = 0
+    for image in images:
+        seconds = model.estimate(image[1])
+        if part and work + seconds > budget:
+            parts.append(part)
+            part = list()
+            work = 0
+        part.append(image)
+        work += seconds
+
+    if part:
+        parts.append(part)
+
+    return parts
+
+
+def part_walltime(images, model, slots, walltime, margin=0.2):
+    '''
+    Returns the walltime in minutes a part asks for: its estimated makespan
+    plus the margin, at most walltime. A part whose makespan is longer than
+    the walltime does not fit; the caller has to warn about it.
+    '''
+
+    if not model.fitted():
+        return walltime
+
+    minutes = makespan(images, model, slots) / 60 / (1 - margin)
+
+    return min(walltime, max(1, int(math.ceil(minutes))))
+
+
+def size_slots(images, model, target, max_slots, margin=0.2):
+    '''
+    Returns the fewest slots whose estimated makespan fits in a target
+    completion time, at most max_slots, and the walltime in minutes they ask
+    for: the makespan plus the margin. When max_slots do not fit, the
+    walltime is longer than the target. Without a fitted model the walltime
+    is None.
+
+    :Arguments:
+        :images: A list of (image, size) tuples
+        :model: The ThroughputModel of the use case
+        :target: The target completion time in minutes, int
+        :max_slots: The most images the allocation can analyze concurrently
+        :margin: The fraction of the walltime kept for pilot startup and
+                 estimation errors, float
+    '''
+
+    max_slots = max(1, min(max_slots, len(images)))
+    if not model.fitted() or not images:
+        return max_slots, None
+
+    def minutes(slots):
+        return makespan(images, model, slots) / 60 / (1 - margin)
+
+    # The makespan falls with the slots, so the fewest slots that fit are
+    # found by bisection
+    low, high = 1, max_slots
+    while low < high:
+        middle = (low + high) // 2
+        if minutes(middle) <= target:
+            high = middle
+        else:
+            low = middle + 1
+
+    return low, max(1, int(math.ceil(minutes(low))))
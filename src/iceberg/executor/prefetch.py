@@ -0,0 +1,241 @@
+"""
+Prefetch Kernel
+==========================================================
+This script stages the scenes of a lane in node local
+storage. It copies the scene of the running task, unless it
+is already there, and links it in the working directory
+under its basename. Then it starts a background process that
+copies the next scenes of the lane, so data movement
+overlaps with the analysis of the current scene. The scenes
+a lane holds are bounded by --budget MBs. A copy is taken
+under a file lock, so a task whose scene is still being
+copied waits for it instead of copying it again. Lock files
+are kept until the end of the lane, so every process locks
+the same file. A released scene is marked, so a prefetcher
+that runs late does not copy it again. The last task of the
+lane sweeps it: it stops the prefetchers of the lane that
+still run and removes the folder of the lane.
+
+    python prefetch.py --folder=$NODE_LFS_PATH/iceberg_prefetch/L0 \
+        --budget=4096 /data/a.tif /data/b.tif /data/c.tif
+    python prefetch.py --folder=$NODE_LFS_PATH/iceberg_prefetch/L0 \
+        --release /data/a.tif
+    python prefetch.py --folder=$NODE_LFS_PATH/iceberg_prefetch/L0 \
+        --sweep /data/c.tif
+Author: Ioannis Paraskevakos
+License: MIT
+Copyright: 2018-2019
+"""
+import argparse
+import fcntl
+import hashlib
+import glob
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import time
+
+
+def local_path(folder, image):
+    """
+    Returns the path of the copy of a scene. Scenes with the same basename in
+    different folders get different copies.
+    """
+
+    return os.path.join(folder, '%s_%s' % (
+        hashlib.sha1(image.encode()).hexdigest()[:8],
+        os.path.basename(image)))
+
+
+def _make_folder(folder):
+    """
+    Creates a folder, unless another process did.
+    """
+
+    if not os.path.isdir(folder):
+        try:
+            os.makedirs(folder)
+        except OSError:
+            if not os.path.isdir(folder):
+                raise
+
+
+def copy_in(image, folder, ahead=False):
+    """
+    Copies a scene in a folder, unless it is already there, and returns the
+    path of the copy. A scene copied ahead is not copied when it was
+    released, and None is returned.
+    """
+
+    _make_folder(folder)
+    local = local_path(folder, image)
+    with open('%s.lock' % local, 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        if os.path.exists('%s.released' % local):
+            if ahead:
+                return None
+            os.remove('%s.released' % local)
+        if not os.path.exists(local):
+            tmp_local = '%s.tmp' % local
+            shutil.copyfile(image, tmp_local)
+            os.rename(tmp_local, local)
+
+    return local
+
+
+def usage(folder):
+    """
+    Returns the MBs of the scenes in a folder.
+    """
+
+    if not os.path.isdir(folder):
+        return 0
+
+    return sum(os.path.getsize(os.path.join(folder, filename))
+               for filename in os.listdir(folder)
+               if not filename.endswith(('.lock', '.released', '.pid'))) / \
+        1024.0 / 1024.0
+
+
+def prefetch(images, folder, budget=None):
+    """
+    Copies scenes in a folder, in order, until one does not fit in the
+    budget. Returns the copies.
+    :Arguments:
+        :images: The scenes, list
+        :folder: The node local folder of the lane, str
+        :budget: The MBs the folder may hold, float. Default: no limit
+    """
+
+    copies = list()
+    for image in images:
+        if not os.path.exists(local_path(folder, image)) and budget and \
+                usage(folder) + os.path.getsize(image) / 1024.0 / 1024.0 > \
+                budget:
+            break
+        local = copy_in(image, folder, ahead=True)
+        if local:
+            copies.append(local)
+
+    return copies
+
+
+def release(image, folder):
+    """
+    Removes the copy of a scene and marks it released, under its lock. The
+    lock file is kept, so processes that wait on it keep excluding each
+    other.
+    """
+
+    _make_folder(folder)
+    local = local_path(folder, image)
+    with open('%s.lock' % local, 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        open('%s.released' % local, 'w').close()
+        if os.path.exists(local):
+            os.remove(local)
+
+
+def _alive(pid):
+    """
+    Returns whether a process runs.
+    """
+
+    try:
+        os.kill(pid, 0)
+    except OSError:
+        return False
+
+    return True
+
+
+def sweep(folder, timeout=10):
+    """
+    Stops the prefetchers of a lane that still run and removes the folder of
+    the lane.
+    """
+
+    running = list()
+    for pid_file in glob.glob(os.path.join(folder, 'prefetcher.*.pid')):
+        try:
+            pid = int(pid_file.split('.')[-2])
+            os.kill(pid, signal.SIGTERM)
+            running.append(pid)
+        except (OSError, ValueError):
+            continue
+    # The folder is removed once they are gone, so none recreates it
+    deadline = time.time() + timeout
+    while running and time.time() < deadline:
+        time.sleep(0.1)
+        running = [pid for pid in running if _alive(pid)]
+    shutil.rmtree(folder, ignore_errors=True)
+
+
+def background(images, folder, budget=None):
+    """
+    Prefetches scenes, with a PID file in the folder while it runs, so the
+    sweep of the lane can stop it.
+    """
+
+    _make_folder(folder)
+    pid_file = os.path.join(folder, 'prefetcher.%d.pid' % os.getpid())
+    open(pid_file, 'w').close()
+    try:
+        prefetch(images, folder, budget)
+    finally:
+        if os.path.exists(pid_file):
+            os.remove(pid_file)
+
+
+def stage(images, folder, budget=None):
+    """
+    Copies the first scene, links it in the working directory, and prefetches
+    the others in the background.
+    """
+
+    local = copy_in(images[0], folder)
+    link = os.path.basename(images[0])
+    if os.path.lexists(link):
+        os.remove(link)
+    os.symlink(local, link)
+
+    if images[1:]:
+        command = [sys.executable, os.path.abspath(__file__),
+                   '--folder=%s' % folder, '--background']
+        if budget:
+            command.append('--budget=%s' % budget)
+        with open(os.devnull, 'w') as devnull:
+            # A new session, so the prefetch survives the end of the task.
+            # The last task of the lane stops it, see sweep.
+            subprocess.Popen(command + images[1:], stdout=devnull,
+                             stderr=devnull, start_new_session=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--folder', type=str, required=True,
+                        help='The node local folder of the lane')
+    parser.add_argument('--budget', type=float, default=None,
+                        help='The MBs the folder may hold')
+    parser.add_argument('--release', action='store_true',
+                        help='Remove the copies of the scenes')
+    parser.add_argument('--sweep', action='store_true',
+                        help='Stop the prefetchers and remove the folder of \
+                        the lane')
+    parser.add_argument('--background', action='store_true',
+                        help=argparse.SUPPRESS)
+    parser.add_argument('images', nargs='+',
+                        help='The scene of the task and the next scenes')
+    args = parser.parse_args()
+
+    if args.sweep:
+        sweep(args.folder)
+    elif args.release:
+        for scene in args.images:
+            release(scene, args.folder)
+    elif args.background:
+        background(args.images, args.folder, args.budget)
+    else:
+        stage(args.images, args.folder, args.budget)
@@ -0,0 +1,305 @@
+"""
+Run Profiler
+==========================================================
+Builds the timeline of every image and the throughput report of a run from
+the RADICAL-Pilot profiles of its sessions. RP writes a <component>.prof CSV
+file for every component, with the events of every task: time, event, comp,
+thread, uid, state and msg. The middleware saves which RP task of which
+session analyzed which images in a tasks file, so a report can be built
+offline, from sessions fetched after the run:
+
+    python -m iceberg.executor.profiler --tasks profile.tasks.json \
+        --sessions re.session.* --output profile
+
+Author: Ioannis Paraskevakos
+License: MIT
+Copyright: 2018-2019
+"""
+import argparse
+import csv
+import json
+import os
+import re
+import sys
+
+# The start and stop events of every phase of a task. RP renamed its events
+# over versions, so the first event found is used.
+PHASES = [('staging', ('staging_in_start',), ('staging_in_stop',)),
+          ('pre_exec', ('task_pre_start', 'cu_pre_start'),
+           ('task_pre_stop', 'cu_pre_stop')),
+          ('exec', ('rank_start', 'app_start', 'cu_exec_start', 'exec_start'),
+           ('rank_stop', 'app_stop', 'cu_exec_stop', 'exec_stop'))]
+# The event of a task getting the resources of the pilot
+SCHEDULED = ('schedule_ok',)
+# Task names are <pipeline>.S<stage>.<task>
+_TASK_NAME = re.compile(r'^(?P<pipeline>.+)\.(?P<stage>S\d+)\.[^.]+$')
+
+
+def task_pipeline(name):
+    '''
+    Returns the image pipeline and the stage of a task name, or (None, None)
+    when the name does not follow <pipeline>.S<stage>.<task>.
+    '''
+
+    match = _TASK_NAME.match(name or '')
+    if not match:
+        return None, None
+
+    return match.group('pipeline'), match.group('stage')
+
+
+def write_tasks(path, gpus, tasks, pipelines):
+    '''
+    Saves the RP tasks of a run and the images of their pipelines.
+
+    :Arguments:
+        :path: The tasks file, str
+        :gpus: The number of GPUs of the run, int
+        :tasks: A list of dicts with the session, uid, name and gpus of every
+                task
+        :pipelines: A dict with the (image, size) tuples of every pipeline
+    '''
+
+    tmp_path = '%s.tmp' % path
+    with open(tmp_path, 'w') as tasks_json:
+        json.dump({'gpus': gpus, 'tasks': tasks, 'pipelines': pipelines},
+                  tasks_json)
+    os.rename(tmp_path, path)
+
+
+def read_events(session, uids):
+    '''
+    Returns the event times of some tasks, as a dict of dicts of lists, from
+    every profile in a session folder.
+
+    :Arguments:
+        :session: The session folder, str
+        :uids: The RP uids of the tasks, set
+    '''
+
+    events = dict()
+    for root, _, files in os.walk(session):
+        for filename in files:
+            if not filename.endswith('.prof'):
+                continue
+            with open(os.path.join(root, filename)) as prof:
+                for row in csv.reader(prof):
+                    if len(row) < 5 or row[0].startswith('#') or \
+                            row[4] not in uids:
+                        continue
+                    try:
+                        time = float(row[0])
+                    except ValueError:
+                        continue
+                    events.setdefault(row[4], dict()).setdefault(
+                        row[1], list()).append(time)
+
+    return events
+
+
+def task_phases(events):
+    '''
+    Returns the start, the stop and the seconds of every phase of a task.
+    Start is when the task was scheduled, when the event is there.
+
+    :Arguments:
+        :events: The event times of the task, dict
+    '''
+
+    phases = dict()
+    starts = list()
+    stops = list()
+    for phase, start_events, stop_events in PHASES:
+        start = next((min(events[event]) for event in start_events
+                      if event in events), None)
+        stop = next((max(events[event]) for event in stop_events
+                     if event in events), None)
+        if start is None or stop is None:
+            phases[phase] = 0.0
+            continue
+        phases[phase] = max(stop - start, 0.0)
+        starts.append(start)
+        stops.append(stop)
+
+    scheduled = [min(events[event]) for event in SCHEDULED if event in events]
+    start = min(scheduled + starts) if scheduled + starts else None
+    stop = max(stops) if stops else None
+
+    return start, stop, phases
+
+
+def run_seconds(session, uids):
+    '''
+    Returns the seconds from the first start to the last stop of some tasks,
+    from the profiles of their session folder, or None when the folder does
+    not have their profiles. The wait in the batch queue and the pilot
+    startup are left out.
+
+    :Arguments:
+        :session: The session folder, str
+        :uids: The RP uids of the tasks, list
+    '''
+
+    starts = list()
+    stops = list()
+    for events in read_events(session, set(uids)).values():
+        start, stop, _ = task_phases(events)
+        if start is not None and stop is not None:
+            starts.append(start)
+            stops.append(stop)
+
+    return max(stops) - min(starts) if starts else None
+
+
+def profile_run(tasks_file, sessions):
+    '''
+    Returns the report of a run: a summary, the seconds of every phase of
+    every stage, and the timeline of every image pipeline, in seconds from
+    the start of the run.
+
+    :Arguments:
+        :tasks_file: The tasks file of the run, see write_tasks
+        :sessions: The session folders of the run, list
+    '''
+
+    with open(tasks_file) as tasks_json:
+        run = json.load(tasks_json)
+
+    events = dict()
+    for session in sessions:
+        sid = os.path.basename(os.path.normpath(session))
+        uids = set(task['uid'] for task in run['tasks']
+                   if task['session'] == sid)
+        for uid, task_events in read_events(session, uids).items():
+            events[(sid, uid)] = task_events
+
+    timelines = dict()
+    stages = dict()
+    gpu_seconds = 0.0
+    missing = 0
+    for task in run['tasks']:
+        task_events = events.get((task['session'], task['uid']))
+        start, stop, phases = task_phases(task_events or dict())
+        if start is None:
+            missing += 1
+            continue
+        pipeline, stage = task_pipeline(task['name'])
+        breakdown = stages.setdefault(stage, {'tasks': 0, 'staging': 0.0,
+                                              'pre_exec': 0.0, 'exec': 0.0})
+        breakdown['tasks'] += 1
+        timeline = timelines.setdefault(pipeline, {'pipeline': pipeline,
+                                                   'start': start,
+                                                   'stop': stop,
+                                                   'stages': dict()})
+        timeline['start'] = min(timeline['start'], start)
+        timeline['stop'] = max(timeline['stop'], stop)
+        image_stage = timeline['stages'].setdefault(
+            stage, {'staging': 0.0, 'pre_exec': 0.0, 'exec': 0.0})
+        for phase, seconds in phases.items():
+            breakdown[phase] += seconds
+            image_stage[phase] += seconds
+        gpu_seconds += phases['exec'] * task['gpus']
+
+    run_start = min([timeline['start'] for timeline in timelines.values()]
+                    or [0])
+    run_stop = max([timeline['stop'] for timeline in timelines.values()]
+                   or [0])
+    seconds = run_stop - run_start
+    images = 0
+    megabytes = 0
+    for timeline in timelines.values():
+        pipeline_images = run['pipelines'].get(timeline['pipeline'], list())
+        timeline['images'] = [image for image, _ in pipeline_images]
+        timeline['megabytes'] = sum(size or 0 for _, size in pipeline_images)
+        timeline['start'] -= run_start
+        timeline['stop'] -= run_start
+        images += len(pipeline_images)
+        megabytes += timeline['megabytes']
+
+    task_seconds = sum(breakdown[phase] for breakdown in stages.values()
+                       for phase in ['staging', 'pre_exec', 'exec'])
+    pre_exec_seconds = sum(breakdown['pre_exec']
+                           for breakdown in stages.values())
+    summary = {'seconds': seconds,
+               'images': images,
+               'megabytes': megabytes,
+               'tasks': len(run['tasks']),
+               'tasks_without_profile': missing,
+               'images_per_hour': images * 3600 / seconds if seconds else 0,
+               'mb_per_second': megabytes / seconds if seconds else 0,
+               'pre_exec_fraction': (pre_exec_seconds / task_seconds
+                                     if task_seconds else 0),
+               'gpus': run['gpus'],
+               'gpu_idle_fraction': None}
+    if run['gpus'] and seconds:
+        summary['gpu_idle_fraction'] = max(
+            0.0, 1 - gpu_seconds / (run['gpus'] * seconds))
+
+    return {'summary': summary,
+            'stages': stages,
+            'images': sorted(timelines.values(),
+                             key=lambda timeline: timeline['start'])}
+
+
+def format_report(report):
+    '''
+    Returns the text report of a run.
+    '''
+
+    summary = report['summary']
+    lines = ['Images:             %d (%d MB)' % (summary['images'],
+                                                 summary['megabytes']),
+             'Duration:           %.1f seconds' % summary['seconds'],
+             'Throughput:         %.1f images/hour, %.2f MB/s' %
+             (summary['images_per_hour'], summary['mb_per_second']),
+             'Pre exec overhead:  %.1f%% of task time' %
+             (100 * summary['pre_exec_fraction'])]
+    if summary['gpu_idle_fraction'] is not None:
+        lines.append('GPU slots idle:     %.1f%% of %d GPUs' %
+                     (100 * summary['gpu_idle_fraction'], summary['gpus']))
+    if summary['tasks_without_profile']:
+        lines.append('Tasks without profile: %d of %d' %
+                     (summary['tasks_without_profile'], summary['tasks']))
+
+    lines += ['', '%-6s %6s %12s %12s %12s' % ('Stage', 'Tasks', 'Staging',
+                                               'Pre exec', 'Exec')]
+    for stage in sorted(report['stages']):
+        breakdown = report['stages'][stage]
+        lines.append('%-6s %6d %11.1fs %11.1fs %11.1fs' %
+                     (stage, breakdown['tasks'], breakdown['staging'],
+                      breakdown['pre_exec'], breakdown['exec']))
+
+    lines += ['', '%-24s %10s %10s  %s' % ('Pipeline', 'Start', 'Stop',
+                                           'Images')]
+    for timeline in report['images']:
+        lines.append('%-24s %9.1fs %9.1fs  %s' %
+                     (timeline['pipeline'], timeline['start'],
+                      timeline['stop'], ' '.join(timeline['images'])))
+
+    return '\n'.join(lines) + '\n'
+
+
+def write_report(report, prefix):
+    '''
+    Writes a report as <prefix>.json and <prefix>.txt.
+    '''
+
+    with open('%s.json' % prefix, 'w') as report_json:
+        json.dump(report, report_json, indent=2)
+    with open('%s.txt' % prefix, 'w') as report_txt:
+        report_txt.write(format_report(report))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--tasks', type=str, required=True,
+                        help='The tasks file the middleware saved')
+    parser.add_argument('--sessions', type=str, nargs='+', required=True,
+                        help='The session folders of the run')
+    parser.add_argument('--output', type=str, default='profile',
+                        help='Prefix of the JSON and text reports')
+    args = parser.parse_args()
+
+    run_report = profile_run(args.tasks, args.sessions)
+    write_report(run_report, args.output)
+    sys.stdout.write(format_report(run_report))
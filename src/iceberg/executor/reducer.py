@@ -0,0 +1,141 @@
+"""
+Result Reducer Kernel
+==========================================================
+This script adds the results of an image to a consolidated
+index of the results of a run, as soon as the pipeline of
+the image writes them. It runs as the post_exec of the last
+task of the pipeline, so the index grows while the run goes
+on instead of being assembled after it.
+
+The index is a CSV file with a row per image: the image, the
+task that wrote the results, the results, their size in MBs
+and a count. Seals count the seals the prediction detected,
+the data rows of its CSV results. Penguins count the masks,
+and Rivers the mosaics, of an image. Results are the files
+that match a glob, except links, e.g. the linked image.
+Rows are appended under a file lock, so concurrent tasks do
+not interleave. When an image is analyzed again, its last
+row is the valid one.
+
+    python reducer.py --index=/shared/results.csv --kind=seals \
+        --image=/data/a.tif --task=P0.S1.T0 --results='./a/*'
+Author: Ioannis Paraskevakos
+License: MIT
+Copyright: 2018-2019
+"""
+import argparse
+import csv
+import fcntl
+import glob
+import os
+
+COLUMNS = ['image', 'task', 'results', 'megabytes', 'count']
+
+
+def _csv_rows(path):
+    """
+    Returns the data rows of a CSV file, without its header.
+    """
+
+    with open(path) as csv_file:
+        return max(sum(1 for row in csv.reader(csv_file) if row) - 1, 0)
+
+
+def summarize(kind, pattern):
+    """
+    Returns the results that match a glob, their size in MBs and their count.
+    :Arguments:
+        :kind: The use case, seals, penguins or rivers, str
+        :pattern: The glob of the results, str
+    """
+
+    results = sorted(os.path.abspath(path) for path in glob.glob(pattern)
+                     if os.path.isfile(path) and not os.path.islink(path))
+    megabytes = sum(os.path.getsize(path) for path in results) / 1024.0 / \
+        1024.0
+    if kind == 'seals':
+        count = sum(_csv_rows(path) for path in results
+                    if path.endswith('.csv'))
+    else:
+        count = len(results)
+
+    return results, megabytes, count
+
+
+def append(index, row):
+    """
+    Appends a row to an index, with its header when the index is new.
+    :Arguments:
+        :index: The CSV index, str
+        :row: A dict with the values of COLUMNS
+    """
+
+    folder = os.path.dirname(os.path.abspath(index))
+    if not os.path.isdir(folder):
+        try:
+            os.makedirs(folder)
+        except OSError:
+            if not os.path.isdir(folder):
+                raise
+    with open('%s.lock' % index, 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        new = not os.path.exists(index) or not os.path.getsize(index)
+        with open(index, 'a') as index_file:
+            writer = csv.DictWriter(index_file, fieldnames=COLUMNS)
+            if new:
+                writer.writeheader()
+            writer.writerow(row)
+
+
+def reduce_image(index, kind, image, task, pattern):
+    """
+    Adds the results of an image to an index and returns its row.
+    """
+
+    results, megabytes, count = summarize(kind, pattern)
+    row = {'image': image,
+           'task': task,
+           'results': ';'.join(results),
+           'megabytes': '%.3f' % megabytes,
+           'count': count}
+    append(index, row)
+
+    return row
+
+
+def read_index(index):
+    """
+    Returns the rows of an index by image. The last row of an image wins.
+    """
+
+    rows = dict()
+    with open(index) as index_file:
+        for row in csv.DictReader(index_file):
+            row['results'] = row['results'].split(';') if row['results'] \
+                else list()
+            row['megabytes'] = float(row['megabytes'])
+            row['count'] = int(row['count'])
+            rows[row['image']] = row
+
+    return rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--index', type=str, required=True,
+                        help='The CSV index of the results of the run')
+    parser.add_argument('--kind', type=str, required=True,
+                        choices=['seals', 'penguins', 'rivers'])
+    parser.add_argument('--image', type=str, required=True,
+                        help='The image of the results')
+    parser.add_argument('--task', type=str, default='',
+                        help='The task that wrote the results')
+    parser.add_argument('--results', type=str, required=True,
+                        help='The glob of the results of the image')
+    args = parser.parse_args()
+
+    added = reduce_image(args.index, args.kind, args.image, args.task,
+                         args.results)
+    results = len(added['results'].split(';')) if added['results'] else 0
+    print('Added %s: %s results, count %s' % (args.image, results,
+                                              added['count']))
@@ -5,11 +5,10 @@ Copyright: 2018-2019
 """
 
 import os
-import csv
 import radical.entk as re
 
 from .executor import Executor
-from ..discovery import Discovery
+from .factory import PipelineFactory, Field
 
 
 class Rivers(Executor):
@@ -25,10 +24,17 @@ class Rivers(Executor):
         :hyperparam_set: combination of hyperparameters used, must be a member of hyperparameters dictionary
         :model_name: name of input model file from training, this name will also be used in subsequent steps of the pipeline
         :models_folder: folder where the model tar file is saved
+        :fused: Whether predicted tiles are stitched in the mosaic while they
+                are predicted, by the prediction task, instead of by a mosaic
+                stage. Predictions go through shared memory.
+        :kwargs: further execution options, passed to Executor
     '''
+    # The reducer indexes the mosaics of the images
+    _results_kind = 'rivers'
+
     # pylint: disable=too-many-arguments
     def __init__(self, name, resources, project, input_path, output_path, tile_size,
-                 step, weights_path):
+                 step, weights_path, fused=False, **kwargs):
 
         super(Rivers, self).__init__(name=name,
                                      resource=resources['resource'],
@@ -36,12 +42,14 @@ class Rivers(Executor):
                                      walltime=resources['walltime'],
                                      cpus=resources['cpus'],
                                      gpus=resources['gpus'],
-                                     project=project)
+                                     project=project,
+                                     **kwargs)
         self._data_input_path = input_path
         self._output_path = output_path
         self._tile_size = tile_size
         self._step = step
         self._weights_path = weights_path
+        self._fused = fused
 
         self._req_modules = None
         self._pre_execs = None
@@ -59,155 +67,277 @@ class Rivers(Executor):
         self._logger.info('Rivers initialized')
     # pylint: disable=too-many-arguments
 
-    def run(self):
+    def _tiling_template(self, pre_execs):
+        '''
+        Returns the template of the task that tiles an image to
+        $NODE_LFS_PATH/<task name>/.
+        '''
+
+        return {'name': 'T0',
+                'pre_exec': pre_execs,
+                'executable': 'iceberg_rivers.tiling',
+                'arguments': ['--input=%(basename)s',
+                              '--output=$NODE_LFS_PATH/%(task)s/',
+                              '--tile_size=%s' % self._tile_size,
+                              '--step=%s' % self._step],
+                'link_input_data': ['%(image)s'],
+                'cpu_reqs': {'cpu_processes': 1, 'cpu_threads': 4,
+                             'cpu_process_type': None,
+                             'cpu_thread_type': None},
+                'lfs_per_process': Field('tiles_lfs')}
+
+    def _predicting_template(self, pre_execs):
+        '''
+        Returns the template of the task that predicts the tiles of the
+        tiling task T0 to $NODE_LFS_PATH/<task name>/.
+        '''
+
+        template = {'name': 'T1',
+                    'pre_exec': pre_execs,
+                    'executable': 'iceberg_rivers.predicting',
+                    'cpu_reqs': {'processes': 1, 'threads_per_process': 1,
+                                 'process_type': None, 'thread_type': None},
+                    'gpu_reqs': {'processes': 1, 'threads_per_process': 1,
+                                 'process_type': None, 'thread_type': None},
+                    'tags': {'colocate': '%(T0)s'}}
+        weights = self._cache_model(template, self._weights_path,
+                                    self._weights_path)
+        template['arguments'] = ['--input=$NODE_LFS_PATH/%(T0)s/',
+                                 '--weights_path=%s' % weights,
+                                 '--output_folder=$NODE_LFS_PATH/%(task)s/']
+
+        return template
+
+    def _mosaic_template(self, pre_execs):
+        '''
+        Returns the template of the task that stitches the predictions of T1
+        in a mosaic of the image.
+        '''
+
+        return {'name': 'T2',
+                'pre_exec': pre_execs,
+                'executable': 'iceberg_rivers.mosaic',
+                'arguments': ['--input=$NODE_LFS_PATH/%(T1)s/',
+                              '--input_WV=%(basename)s',
+                              '--tile_size=%s' % self._tile_size,
+                              '--step=%s' % self._step,
+                              '--output_folder=./'],
+                'cpu_reqs': {'processes': 1, 'threads_per_process': 1,
+                             'process_type': None, 'thread_type': None},
+                'link_input_data': ['%(image)s'],
+                'tags': {'colocate': '%(T0)s'}}
+
+    def _fused_template(self, pre_execs):
+        '''
+        Returns the template of the task that predicts the tiles of the
+        tiling task T0 and stitches the predictions in the mosaic of the
+        image while they are predicted, with the mosaic_accumulator kernel.
+        '''
+
+        predicting = self._predicting_template(pre_execs)
+        kernels = os.path.dirname(os.path.abspath(__file__))
+        template = self._tile_stream_template(
+            pre_execs, 'mosaic_accumulator', '--batch', '--output_folder',
+            ['--tiles=$NODE_LFS_PATH/%(T0)s/',
+             '--image=%(basename)s',
+             '--output=./%(stem)s_mosaic.tif',
+             '--tile_size=%s' % self._tile_size,
+             '--step=%s' % self._step],
+            [predicting['executable']]
+            + [arg for arg in predicting['arguments']
+               if not arg.startswith('--output_folder=')])
+        template['upload_input_data'] += [
+            kernels + '/mosaic_accumulator.py',
+            os.path.dirname(kernels) + '/discovery/image_disc.py'] + \
+            predicting.get('upload_input_data', list())
+        template.update({'name': 'T1',
+                         'pre_exec': predicting['pre_exec'],
+                         'link_input_data': ['%(image)s'],
+                         'cpu_reqs': predicting['cpu_reqs'],
+                         'gpu_reqs': predicting['gpu_reqs'],
+                         'tags': predicting['tags']})
+
+        return template
+
+    def _results(self):
         '''
-        This is a blocking execution method. This method should be called to
-        execute the usecase.
+        The mosaic of an image is written in the sandbox of the task that
+        stitches it, under the name of the image.
         '''
-        try:
-            self._logger.debug('Running workflow')
-            self._run_workflow()
-        finally:
-            self._terminate()
 
-    def _resolve_pre_execs(self):
+        return './%(stem)s*'
+
+    def _pipeline_template(self, pre_execs):
         '''
-        This is a utils method. It takes the list of modules and return a list
-        of pre_exec commands
+        An image is tiled in node local storage, and the tiles are predicted
+        and stitched in a mosaic on the same node. Fused, the prediction task
+        also stitches the mosaic.
         '''
 
-        tmp_pre_execs = list()
-        for module in self._req_modules:
-            tmp_pre_exec = 'module load %s' % module
-            self._logger.debug("Preexec added: %s", tmp_pre_exec)
-            tmp_pre_execs.append(tmp_pre_exec)
+        if self._fused:
+            return [[self._tiling_template(pre_execs)],
+                    [self._fused_template(pre_execs)]]
+
+        return [[self._tiling_template(pre_execs)],
+                [self._predicting_template(pre_execs)],
+                [self._mosaic_template(pre_execs)]]
+
+    def _tile_geometry(self):
+        '''
+        Tiles are tile_size pixels wide, every step pixels, with all the
+        bands of the image.
+        '''
 
-        tmp_pre_execs = tmp_pre_execs + self._pre_execs
+        return int(self._tile_size), int(self._step), None, False
 
-        return tmp_pre_execs
+    def _tiling_task(self, name, pre_execs, image, image_size):
+        '''
+        Returns the task that tiles an image to $NODE_LFS_PATH/<name>/.
+        '''
 
-    # pylint: disable=unused-argument
-    def _generate_pipeline(self, name, pre_execs, image, image_size):
+        return PipelineFactory.task(
+            PipelineFactory.compile(self._tiling_template(pre_execs)), name,
+            PipelineFactory.fields(name, image, image_size,
+                                   tiles_lfs=self._tiles_lfs(image,
+                                                             image_size)))
 
+    def _predicting_arguments(self, tiling_task, output):
+        '''
+        Returns the arguments that predict the tiles of a tiling task to
+        $NODE_LFS_PATH/<output>/.
         '''
-        This function creates a pipeline for an image that will be analyzed.
+
+        return PipelineFactory.render(
+            self._predicting_template(None)['arguments'],
+            {'T0': tiling_task, 'task': output})
+
+    def _mosaic_task(self, name, pre_execs, predictions, image, colocate):
+        '''
+        Returns the task that stitches the predicted tiles of
+        $NODE_LFS_PATH/<predictions>/ in a mosaic of the image.
+        '''
+
+        return PipelineFactory.task(
+            PipelineFactory.compile(self._reduce_template(
+                self._mosaic_template(pre_execs))), name,
+            PipelineFactory.fields(name, image, None, T0=colocate,
+                                   T1=predictions))
+
+    def _generate_batch_pipeline(self, name, pre_execs, images):
+        '''
+        This function creates a pipeline for a batch of images. Every image is
+        tiled and mosaicked by its own task, and all tiles are predicted by a
+        single task on the same node, which loads the weights once.
 
         :Arguments:
             :name: Pipeline name, str
             :pre_execs: things need to happen before execution
-            :image: image path, str
-            :image_size: image size in MBs, int
+            :images: list of (image path, image size in MBs) tuples
         '''
-        # Create a Pipeline object
         entk_pipeline = re.Pipeline()
         entk_pipeline.name = name
-        # Create a Stage object
         stage0 = re.Stage()
         stage0.name = '%s.S0' % (name)
-        # Create Task 1, training
-        task0 = re.Task()
-        task0.name = '%s.T0' % stage0.name
-        task0.pre_exec = pre_execs
-        task0.executable = 'iceberg_rivers.tiling'  # Assign tak executable
-        task0.arguments = ['--input=%s' % image.split('/')[-1],
-                           '--output=$NODE_LFS_PATH/%s/' % task0.name,
-                           '--tile_size=%s' % self._tile_size,
-                           '--step=%s' % self._step]
-        task0.link_input_data = [image]
-        task0.cpu_reqs = {'cpu_processes': 1, 'cpu_threads': 4,
-                          'cpu_process_type': None, 'cpu_thread_type': None}
-        task0.lfs_per_process = image_size
-        stage0.add_tasks(task0)
-        # Add Stage to the Pipeline
+        tiling_tasks = list()
+        for idx, (image, image_size) in enumerate(images):
+            task0 = self._tiling_task('%s.T%d' % (stage0.name, idx), pre_execs,
+                                      image, image_size)
+            if tiling_tasks:
+                task0.tags = {'colocate': tiling_tasks[0].name}
+            tiling_tasks.append(task0)
+        stage0.add_tasks(tiling_tasks)
         entk_pipeline.add_stages(stage0)
+        colocate = tiling_tasks[0].name
 
-        # Create a Stage object
         stage1 = re.Stage()
         stage1.name = '%s.S1' % (name)
-        # Create Task 1, training
-        task1 = re.Task()
-        task1.name = '%s.T1' % stage1.name
-        task1.pre_exec = pre_execs
-        task1.executable = 'iceberg_rivers.predicting'  # Assign task executable
-#        # Assign arguments for the task executable
-        task1.arguments = ['--input=$NODE_LFS_PATH/%s/' % task0.name,
-                           '--weights_path=%s' % self._weights_path,
-                           '--output_folder=$NODE_LFS_PATH/%s/' % task1.name]
-#        # task1.link_input_data = ['$SHARED/%s' % self._model_name]
+        predictions = ['%s.T0/%d' % (stage1.name, idx)
+                       for idx in range(len(images))]
+        jobs = [self._predicting_arguments(task0.name, output)
+                for task0, output in zip(tiling_tasks, predictions)]
+        task1 = self._batch_task('%s.T0' % stage1.name, pre_execs,
+                                 'iceberg_rivers.predicting', jobs)
+        self._template_staging(task1, self._predicting_template(pre_execs))
         task1.cpu_reqs = {'processes': 1, 'threads_per_process': 1,
                           'process_type': None, 'thread_type': None}
         task1.gpu_reqs = {'processes': 1, 'threads_per_process': 1,
                           'process_type': None, 'thread_type': None}
-        task0.lfs_per_process = image_size
-        # Download resulting images
-        # task1.download_output_data = ['%s/ > %s' % (image.split('/')[-1].
-        #                                            split('.')[0],
-        #                                            image.split('/')[-1])]
-        task1.tags = {'colocate': task0.name}
-
+        task1.tags = {'colocate': colocate}
         stage1.add_tasks(task1)
-        # Add Stage to the Pipeline
         entk_pipeline.add_stages(stage1)
 
-        # Create a Stage object
         stage2 = re.Stage()
         stage2.name = '%s.S2' % (name)
-        # Create Task 1, training
-        task2 = re.Task()
-        task2.name = '%s.T2' % stage2.name
-        task2.pre_exec = pre_execs
-        task2.executable = 'iceberg_rivers.mosaic'  # Assign task executable
-#        # Assign arguments for the task executable
-        task2.arguments = ['--input=$NODE_LFS_PATH/%s/' % task1.name,
-                           '--input_WV=%s' % image.split('/')[-1],
-                           '--tile_size=%s' % self._tile_size,
-                           '--step=%s' % self._step,
-                            '--output_folder=./']
-        task2.cpu_reqs = {'processes': 1, 'threads_per_process': 1,
-                          'process_type': None, 'thread_type': None}
-        task2.link_input_data = [image]
-        task2.tags = {'colocate': task0.name}
-        stage2.add_tasks(task2)
-        # Add Stage to the Pipeline
+        for idx, (image, _) in enumerate(images):
+            stage2.add_tasks(self._mosaic_task('%s.T%d' % (stage2.name, idx),
+                                               pre_execs, predictions[idx],
+                                               image, colocate))
         entk_pipeline.add_stages(stage2)
 
         return entk_pipeline
 
-    # pylint: enable=unused-argument
-    def _run_workflow(self):
-        '''
-        Private method that creates and executes the workflow of the use case.
+    def _generate_worker_pipeline(self, name, pre_execs, items):
         '''
+        This function creates the pipeline of an inference worker that keeps
+        the Rivers weights resident on a GPU.
 
-        discovery = Discovery(modules=self._req_modules,
-                              paths=self._data_input_path,
-                              pre_execs=self._pre_execs)
-        discovery_pipeline = discovery.generate_discover_pipe()
+        :Arguments:
+            :name: Pipeline name, str
+            :pre_execs: things need to happen before execution
+            :items: The number of images the worker predicts, int
+        '''
+        entk_pipeline = re.Pipeline()
+        entk_pipeline.name = name
+        stage0 = re.Stage()
+        stage0.name = '%s.S0' % (name)
+        task0 = self._inference_worker_task('%s.T0' % stage0.name, pre_execs,
+                                            'iceberg_rivers.predicting', items)
+        self._template_staging(task0, self._predicting_template(pre_execs))
+        task0.cpu_reqs = {'processes': 1, 'threads_per_process': 1,
+                          'process_type': None, 'thread_type': None}
+        task0.gpu_reqs = {'processes': 1, 'threads_per_process': 1,
+                          'process_type': None, 'thread_type': None}
+        stage0.add_tasks(task0)
+        entk_pipeline.add_stages(stage0)
 
-        self._app_manager.workflow = set([discovery_pipeline])
+        return entk_pipeline
 
-        self._app_manager.run()
-        images_csv = open('images0.csv')
-        images = csv.reader(images_csv)
-        _ = next(images)
-        pre_execs = self._resolve_pre_execs()
-        img_pipelines = list()
-        idx = 0
-        for [image, size] in images:
-            img_pipe = self._generate_pipeline(name='P%s' % idx,
-                                               pre_execs=pre_execs,
-                                               image=image,
-                                               image_size=int(size))
-            img_pipelines.append(img_pipe)
-            idx += 1
+    def _generate_service_pipeline(self, name, pre_execs, image, image_size,
+                                   worker):
+        '''
+        This function creates a pipeline for an image whose tiles are
+        predicted by an inference worker on the same node.
 
-        self._app_manager.workflow = set(img_pipelines)
+        :Arguments:
+            :name: Pipeline name, str
+            :pre_execs: things need to happen before execution
+            :image: image path, str
+            :image_size: image size in MBs, int
+            :worker: The name of the inference worker task, str
+        '''
+        entk_pipeline = re.Pipeline()
+        entk_pipeline.name = name
+        stage0 = re.Stage()
+        stage0.name = '%s.S0' % (name)
+        task0 = self._tiling_task('%s.T0' % stage0.name, pre_execs, image,
+                                  image_size)
+        task0.tags = {'colocate': worker}
+        stage0.add_tasks(task0)
+        entk_pipeline.add_stages(stage0)
 
-        self._app_manager.run()
+        stage1 = re.Stage()
+        stage1.name = '%s.S1' % (name)
+        predictions = '%s.T1' % stage1.name
+        task1 = self._submit_task(predictions, pre_execs, worker,
+                                  self._predicting_arguments(task0.name,
+                                                             predictions))
+        stage1.add_tasks(task1)
+        entk_pipeline.add_stages(stage1)
 
-    def _terminate(self):
-        '''
-        Stops the execution
-        '''
+        stage2 = re.Stage()
+        stage2.name = '%s.S2' % (name)
+        stage2.add_tasks(self._mosaic_task('%s.T2' % stage2.name, pre_execs,
+                                           predictions, image, worker))
+        entk_pipeline.add_stages(stage2)
 
-        self._app_manager.resource_terminate()
+        return entk_pipeline
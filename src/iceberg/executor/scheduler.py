@@ -0,0 +1,112 @@
+"""
+Author: Ioannis Paraskevakos
+License: MIT
+Copyright: 2018-2019
+"""
+
+import hashlib
+import heapq
+import os
+
+# The scheduling policies of the image pipelines
+POLICIES = ['catalog', 'largest', 'smallest', 'lpt']
+
+
+def _size(image):
+    '''
+    Returns the size of an (image, size) tuple, unknown sizes count as 0.
+    '''
+
+    return image[1] or 0
+
+
+def pipeline_name(images, prefix='P'):
+    '''
+    Returns a pipeline name that is the same in every run: the prefix and a
+    hash of the image paths, so a resumed run can match its pipelines to a
+    previous one.
+
+    :Arguments:
+        :images: The image paths of the pipeline, list
+        :prefix: The name prefix, str
+    '''
+
+    paths = '\n'.join(os.path.normpath(image) for image in images)
+    digest = hashlib.sha1(paths.encode('utf-8')).hexdigest()
+
+    return '%s%s' % (prefix, digest[:12])
+
+
+def order_images(images, policy='catalog'):
+    '''
+    Returns the images in the order their pipelines should be submitted.
+
+    :Arguments:
+        :images: A list of (image, size) tuples
+        :policy: catalog keeps the discovery order, largest and smallest sort
+                 by size. lpt orders like largest, the packing itself is done
+                 by pack_images.
+    '''
+
+    if policy not in POLICIES:
+        raise ValueError('Unknown scheduling policy %s' % policy)
+
+    if policy == 'catalog':
+        return list(images)
+
+    return sorted(images, key=_size, reverse=policy != 'smallest')
+
+
+def pack_images(images, slots):
+    '''
+    Packs images in slots with the Longest Processing Time first rule: every
+    image, largest first, goes to the slot with the least total size. Returns
+    a list of slots, each a list of (image, size) tuples in the order they
+    run. Empty slots are dropped.
+
+    :Arguments:
+        :images: A list of (image, size) tuples
+        :slots: The number of images that can be analyzed concurrently, int
+    '''
+
+    slots = max(1, int(slots))
+    bins = [list() for _ in range(slots)]
+    loads = [(0, idx) for idx in range(slots)]
+    for image in sorted(images, key=_size, reverse=True):
+        load, idx = heapq.heappop(loads)
+        bins[idx].append(image)
+        heapq.heappush(loads, (load + _size(image), idx))
+
+    return [slot for slot in bins if slot]
+
+
+def batch_images(images, batch_size=None, batch_mb=None):
+    '''
+    Groups consecutive images in batches. A batch is closed when it has
+    batch_size images or when the next image would take it over batch_mb
+    MBs. An image larger than batch_mb gets a batch of its own. Returns a
+    list of batches, each a list of (image, size) tuples.
+
+    :Arguments:
+        :images: A list of (image, size) tuples
+        :batch_size: Maximum number of images in a batch, int
+        :batch_mb: Maximum total size of a batch in MBs, int
+    '''
+
+    batches = list()
+    batch = list()
+    batch_total = 0
+    for image in images:
+        full = batch_size and len(batch) >= batch_size
+        over = batch_mb and batch_total + _size(image) > batch_mb
+        if batch and (full or over):
+            batches.append(batch)
+            batch = list()
+            batch_total = 0
+        batch.append(image)
+        batch_total += _size(image)
+
+    if batch:
+        batches.append(batch)
+
+    return batches
@@ -5,11 +5,10 @@ Copyright: 2018-2019
 """
 
 import os
-import csv
 import radical.entk as re
 
 from .executor import Executor
-from ..discovery import Discovery
+from .factory import PipelineFactory, Field
 
 
 class Seals(Executor):
@@ -25,11 +24,19 @@ class Seals(Executor):
         :hyperparam_set: combination of hyperparameters used, must be a member of hyperparameters dictionary
         :model_name: name of input model file from training, this name will also be used in subsequent steps of the pipeline
         :models_folder: folder where the model tar file is saved
+        :fused: Whether an image is tiled and predicted by a single task, as
+                a producer/consumer pair, with the tile_stream kernel. Tiles
+                go through shared memory in batches instead of the node
+                local disk, and prediction starts with the first batch.
+        :kwargs: further execution options, passed to Executor
     '''
+    # The reducer counts the seals of the CSV predictions
+    _results_kind = 'seals'
+
     # pylint: disable=too-many-arguments
     def __init__(self, name, resources, project, input_path, output_path, bands,
                  stride, patch_size, geotiff, model_arch, hyperparam_set,
-                 model_name, models_folder):
+                 model_name, models_folder, fused=False, **kwargs):
 
         super(Seals, self).__init__(name=name,
                                     resource=resources['resource'],
@@ -37,7 +44,8 @@ class Seals(Executor):
                                     walltime=resources['walltime'],
                                     cpus=resources['cpus'],
                                     gpus=resources['gpus'],
-                                    project=project)
+                                    project=project,
+                                    **kwargs)
         self._data_input_path = input_path
         self._output_path = output_path
         self._bands = bands
@@ -48,6 +56,7 @@ class Seals(Executor):
         self._model_path = models_folder
         self._model_arch = model_arch
         self._hyperparam = hyperparam_set
+        self._fused = fused
         self._req_modules = None
         self._pre_execs = None
         self._env_var = os.environ.get('VE_SEALS')
@@ -62,148 +71,257 @@ class Seals(Executor):
         self._logger.info('Seals initialized')
     # pylint: disable=too-many-arguments
 
-    def run(self):
+    def _tiling_template(self, pre_execs):
+        '''
+        Returns the template of the task that tiles an image to
+        $NODE_LFS_PATH/<task name>.
+        '''
+
+        return {'name': 'T0',
+                'pre_exec': pre_execs,
+                'executable': 'iceberg_seals.tiling',
+                'arguments': ['--input_image=%(basename)s',
+                              '--output_folder=$NODE_LFS_PATH/%(task)s',
+                              '--bands=%s' % self._bands,
+                              '--stride=%s' % self._stride,
+                              '--patch_size=%s' % self._patch_size,
+                              '--geotiff=%s' % self._geotiff],
+                'link_input_data': ['%(image)s'],
+                'cpu_reqs': {'cpu_processes': 1, 'cpu_threads': 4,
+                             'cpu_process_type': None,
+                             'cpu_thread_type': 'OpenMP'},
+                'lfs_per_process': Field('tiles_lfs')}
+
+    def _predicting_template(self, pre_execs):
+        '''
+        Returns the template of the task that predicts on the tiles of the
+        tiling task T0. The model is the shared data of the pilot.
+        '''
+
+        template = {'name': 'T1',
+                    'pre_exec': pre_execs,
+                    'executable': 'iceberg_seals.predicting',
+                    'cpu_reqs': {'cpu_processes': 1, 'cpu_threads': 1,
+                                 'cpu_process_type': None,
+                                 'cpu_thread_type': 'OpenMP'},
+                    'gpu_reqs': {'gpu_processes': 1, 'gpu_threads': 1,
+                                 'gpu_process_type': None,
+                                 'gpu_thread_type': 'OpenMP'},
+                    'tags': {'colocate': '%(T0)s'}}
+        if self._model_cache:
+            models_folder = os.path.dirname(self._cache_model(
+                template, '$RP_PILOT_SANDBOX/%s' % self._model_name,
+                os.path.abspath(self._model_path + self._model_name)))
+        else:
+            template['link_input_data'] = ['$SHARED/%s' % self._model_name]
+            models_folder = '.'
+        template['arguments'] = ['--input_dir=$NODE_LFS_PATH/%(T0)s',
+                                 '--model_architecture=%s' % self._model_arch,
+                                 '--hyperparameter_set=%s' % self._hyperparam,
+                                 '--model_name=%s' % self._model_name,
+                                 '--models_folder=%s/' % models_folder,
+                                 '--output_dir=./%(stem)s']
+
+        return template
+
+    def _fused_template(self, pre_execs):
+        '''
+        Returns the template of the task that tiles an image in shared memory
+        and predicts on the tiles while they are produced.
+        '''
+
+        tiling = self._tiling_template(pre_execs)
+        predicting = self._predicting_template(pre_execs)
+        template = self._tile_stream_template(
+            pre_execs, 'iceberg_seals.predicting', '--input_dir',
+            '--output_folder',
+            [arg for arg in predicting['arguments']
+             if not arg.startswith('--input_dir=')],
+            [tiling['executable']]
+            + [arg for arg in tiling['arguments']
+               if not arg.startswith('--output_folder=')])
+        template.update({'name': 'T0',
+                         'pre_exec': predicting['pre_exec'],
+                         'link_input_data': (
+                             tiling['link_input_data']
+                             + predicting.get('link_input_data', list())),
+                         'upload_input_data': (
+                             template['upload_input_data']
+                             + predicting.get('upload_input_data', list())),
+                         'cpu_reqs': tiling['cpu_reqs'],
+                         'gpu_reqs': predicting['gpu_reqs']})
+
+        return template
+
+    def _tile_geometry(self):
+        '''
+        Tiles are patch_size pixels wide, every stride patches, with the
+        selected bands. Fused, tiles go through shared memory instead.
+        '''
+
+        if self._fused:
+            return None
+
+        return (int(self._patch_size),
+                int(float(self._patch_size) * float(self._stride)),
+                len(str(self._bands).split(',')), bool(int(self._geotiff)))
+
+    def _results(self):
         '''
-        This is a blocking execution method. This method should be called to
-        execute the usecase.
+        The predictions of an image are the files of ./<stem>/ in the sandbox
+        of the prediction task.
         '''
-        try:
-            self._logger.debug('Running workflow')
-            self._run_workflow()
-        finally:
-            self._terminate()
 
-    def _resolve_pre_execs(self):
+        return './%(stem)s/*'
+
+    def _pipeline_template(self, pre_execs):
         '''
-        This is a utils method. It takes the list of modules and return a list
-        of pre_exec commands
+        An image is tiled in node local storage and the tiles are predicted
+        on the same node. Fused, a single task does both.
         '''
 
-        tmp_pre_execs = list()
-        for module in self._req_modules:
-            tmp_pre_exec = 'module load %s' % module
-            self._logger.debug("Preexec added: %s", tmp_pre_exec)
-            tmp_pre_execs.append(tmp_pre_exec)
+        if self._fused:
+            return [[self._fused_template(pre_execs)]]
 
-        tmp_pre_execs = tmp_pre_execs + self._pre_execs
+        return [[self._tiling_template(pre_execs)],
+                [self._predicting_template(pre_execs)]]
 
-        return tmp_pre_execs
+    def _tiling_task(self, name, pre_execs, image, image_size):
+        '''
+        Returns the task that tiles an image to $NODE_LFS_PATH/<name>.
+        '''
 
-    # pylint: disable=unused-argument
-    def _generate_pipeline(self, name, pre_execs, image, image_size):
+        return PipelineFactory.task(
+            PipelineFactory.compile(self._tiling_template(pre_execs)), name,
+            PipelineFactory.fields(name, image, image_size,
+                                   tiles_lfs=self._tiles_lfs(image,
+                                                             image_size)))
 
+    def _predicting_arguments(self, tiling_task, image):
+        '''
+        Returns the arguments that predict on the tiles of a tiling task.
         '''
-        This function creates a pipeline for an image that will be analyzed.
+
+        return PipelineFactory.render(
+            self._predicting_template(None)['arguments'],
+            PipelineFactory.fields(None, image, None, T0=tiling_task))
+
+    def _generate_batch_pipeline(self, name, pre_execs, images):
+        '''
+        This function creates a pipeline for a batch of images. Every image is
+        tiled by its own task, and all tiles are predicted by a single task
+        on the same node, which loads the model once.
 
         :Arguments:
             :name: Pipeline name, str
-            :image: image path, str
-            :image_size: image size in MBs, int
-            :tile_size: The size of each tile, int
-            :model_path: Path to the model file, str
-            :model_arch: Prediction Model Architecture, str
-            :model_name: Prediction Model Name, str
-            :hyperparam_set: Which hyperparameter set to use, str
+            :pre_execs: things need to happen before execution
+            :images: list of (image path, image size in MBs) tuples
         '''
-        # Create a Pipeline object
         entk_pipeline = re.Pipeline()
         entk_pipeline.name = name
-        # Create a Stage object
         stage0 = re.Stage()
         stage0.name = '%s.S0' % (name)
-        # Create Task 1, training
-        task0 = re.Task()
-        task0.name = '%s.T0' % stage0.name
-        task0.pre_exec = pre_execs
-        task0.executable = 'iceberg_seals.tiling'  # Assign tak executable
-        # Assign arguments for the task executable
-        task0.arguments = ['--input_image=%s' % image.split('/')[-1],
-                           '--output_folder=$NODE_LFS_PATH/%s' % task0.name,
-                           '--bands=%s' % self._bands,
-                           '--stride=%s' % self._stride,
-                           '--patch_size=%s' % self._patch_size,
-                           '--geotiff=%s' % self._geotiff]
-        task0.link_input_data = [image]
-        task0.cpu_reqs = {'cpu_processes': 1, 'cpu_threads': 4,
-                          'cpu_process_type': None, 'cpu_thread_type': 'OpenMP'}
-        task0.lfs_per_process = image_size
-
-        stage0.add_tasks(task0)
-        # Add Stage to the Pipeline
+        tiling_tasks = list()
+        for idx, (image, image_size) in enumerate(images):
+            task0 = self._tiling_task('%s.T%d' % (stage0.name, idx), pre_execs,
+                                      image, image_size)
+            if tiling_tasks:
+                task0.tags = {'colocate': tiling_tasks[0].name}
+            tiling_tasks.append(task0)
+        stage0.add_tasks(tiling_tasks)
         entk_pipeline.add_stages(stage0)
 
-        # Create a Stage object
         stage1 = re.Stage()
         stage1.name = '%s.S1' % (name)
-        # Create Task 1, training
-        task1 = re.Task()
-        task1.name = '%s.T1' % stage1.name
-        task1.pre_exec = pre_execs
-        task1.executable = 'iceberg_seals.predicting'  # Assign task executable
-        # Assign arguments for the task executable
-        task1.arguments = ['--input_dir=$NODE_LFS_PATH/%s' % task0.name,
-                           '--model_architecture=%s' % self._model_arch,
-                           '--hyperparameter_set=%s' % self._hyperparam,
-                           '--model_name=%s' % self._model_name,
-                           '--models_folder=./',
-                           '--output_dir=./%s' % image.split('/')[-1].split('.')[0],]
-        task1.link_input_data = ['$SHARED/%s' % self._model_name]
+        jobs = [self._predicting_arguments(task0.name, image)
+                for task0, (image, _) in zip(tiling_tasks, images)]
+        task1 = self._batch_task('%s.T0' % stage1.name, pre_execs,
+                                 'iceberg_seals.predicting', jobs)
+        self._template_staging(task1, self._predicting_template(pre_execs))
         task1.cpu_reqs = {'cpu_processes': 1, 'cpu_threads': 1,
                           'cpu_process_type': None, 'cpu_thread_type': 'OpenMP'}
         task1.gpu_reqs = {'gpu_processes': 1, 'gpu_threads': 1,
                           'gpu_process_type': None, 'gpu_thread_type': 'OpenMP'}
-        # Download resulting images
-        # task1.download_output_data = ['%s/ > %s' % (image.split('/')[-1].
-        #                                            split('.')[0],
-        #                                            image.split('/')[-1])]
-        task1.tags = {'colocate': task0.name}
-
+        task1.tags = {'colocate': tiling_tasks[0].name}
+        self._reduce_task(task1, [image for image, _ in images])
         stage1.add_tasks(task1)
-        # Add Stage to the Pipeline
         entk_pipeline.add_stages(stage1)
 
         return entk_pipeline
 
-    # pylint: enable=unused-argument
-    def _run_workflow(self):
+    def _generate_worker_pipeline(self, name, pre_execs, items):
         '''
-        Private method that creates and executes the workflow of the use case.
+        This function creates the pipeline of an inference worker that keeps
+        the Seals model resident on a GPU.
+
+        :Arguments:
+            :name: Pipeline name, str
+            :pre_execs: things need to happen before execution
+            :items: The number of images the worker predicts, int
         '''
-        self._logger.debug('Uploading shared data %s' % os.path.abspath(self._model_path
-                                                          + self._model_name))
-        self._app_manager.shared_data = [os.path.abspath(self._model_path
-                                                         + self._model_name)]
-        discovery = Discovery(modules=self._req_modules,
-                              paths=self._data_input_path,
-                              pre_execs=self._pre_execs + ['module list',
-                                                           'echo $PYTHONPATH',
-                                                           'which python'])
-        discovery_pipeline = discovery.generate_discover_pipe()
+        entk_pipeline = re.Pipeline()
+        entk_pipeline.name = name
+        stage0 = re.Stage()
+        stage0.name = '%s.S0' % (name)
+        task0 = self._inference_worker_task('%s.T0' % stage0.name, pre_execs,
+                                            'iceberg_seals.predicting', items)
+        self._template_staging(task0, self._predicting_template(pre_execs))
+        task0.cpu_reqs = {'cpu_processes': 1, 'cpu_threads': 1,
+                          'cpu_process_type': None, 'cpu_thread_type': 'OpenMP'}
+        task0.gpu_reqs = {'gpu_processes': 1, 'gpu_threads': 1,
+                          'gpu_process_type': None, 'gpu_thread_type': 'OpenMP'}
+        stage0.add_tasks(task0)
+        entk_pipeline.add_stages(stage0)
 
-        self._app_manager.workflow = set([discovery_pipeline])
+        return entk_pipeline
 
-        self._app_manager.run()
-        images_csv = open('images0.csv')
-        images = csv.reader(images_csv)
-        _ = next(images)
-        pre_execs = self._resolve_pre_execs()
-        img_pipelines = list()
-        idx = 0
-        for [image, size] in images:
-            img_pipe = self._generate_pipeline(name='P%s' % idx,
-                                               pre_execs=pre_execs,
-                                               image=image,
-                                               image_size=int(size))
-            img_pipelines.append(img_pipe)
-            idx += 1
+    def _generate_service_pipeline(self, name, pre_execs, image, image_size,
+                                   worker):
+        '''
+        This function creates a pipeline for an image whose tiles are
+        predicted by an inference worker on the same node.
 
-        self._app_manager.workflow = set(img_pipelines)
+        :Arguments:
+            :name: Pipeline name, str
+            :pre_execs: things need to happen before execution
+            :image: image path, str
+            :image_size: image size in MBs, int
+            :worker: The name of the inference worker task, str
+        '''
+        entk_pipeline = re.Pipeline()
+        entk_pipeline.name = name
+        stage0 = re.Stage()
+        stage0.name = '%s.S0' % (name)
+        task0 = self._tiling_task('%s.T0' % stage0.name, pre_execs, image,
+                                  image_size)
+        task0.tags = {'colocate': worker}
+        stage0.add_tasks(task0)
+        entk_pipeline.add_stages(stage0)
+
+        # The worker writes the predictions in its own sandbox, so they are
+        # not added to the results index
+        stage1 = re.Stage()
+        stage1.name = '%s.S1' % (name)
+        task1 = self._submit_task('%s.T1' % stage1.name, pre_execs, worker,
+                                  self._predicting_arguments(task0.name,
+                                                             image))
+        stage1.add_tasks(task1)
+        entk_pipeline.add_stages(stage1)
+
+        return entk_pipeline
+
+    def _discovery_pre_execs(self):
+        '''
+        The discovery tasks of Seals also log their environment.
+        '''
 
-        self._app_manager.run()
+        return (self._pre_execs or list()) + ['module list',
+                                              'echo $PYTHONPATH',
+                                              'which python']
 
-    def _terminate(self):
+    def _shared_data(self):
         '''
-        Stops the execution
+        The model of Seals is uploaded once to the pilot sandbox.
         '''
 
-        self._app_manager.resource_terminate()
+        return [os.path.abspath(self._model_path + self._model_name)]
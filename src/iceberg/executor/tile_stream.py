@@ -0,0 +1,172 @@
+"""
+Tile Stream Kernel
+==========================================================
+This script runs the tiling of an image and the prediction
+on its tiles as a producer/consumer pair on the same node.
+The tiler runs as a subprocess that writes its tiles in a
+folder in shared memory, e.g. /dev/shm. Tiles that have not
+changed for --settle seconds are moved in batches of
+--batch_size to a folder of their own, predicted by this
+process and deleted. Prediction starts with the first batch
+instead of after the whole image is tiled, and tiles never
+reach the disk. When more than --max_pending settled tiles
+wait, the tiler is paused until half of them are predicted,
+so shared memory stays bounded.
+
+The prediction module is loaded as the inference_worker
+kernel does: it keeps its model resident when it provides
+load_model() and predict(model, arguments), otherwise its
+main() is called for every batch. Either way it has to
+accept being called once per batch with the same output.
+The model is closed once the last batch is predicted.
+
+    python tile_stream.py --tiles=/dev/shm/<task> \
+        --module=iceberg_seals.predicting --input_flag=--input_dir \
+        --output_flag=--output_folder --predict=--output_dir=./out \
+        -- iceberg_seals.tiling --input_image=image.tif
+Author: Ioannis Paraskevakos
+License: MIT
+Copyright: 2018-2019
+"""
+import argparse
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import time
+
+
+def list_tiles(incoming):
+    """
+    Returns the tiles of a folder as (path relative to the folder, mtime)
+    tuples, oldest first.
+    """
+
+    tiles = list()
+    for root, _, files in os.walk(incoming):
+        for filename in files:
+            path = os.path.join(root, filename)
+            try:
+                tiles.append((os.path.getmtime(path),
+                              os.path.relpath(path, incoming)))
+            except OSError:
+                continue
+
+    return [(tile, mtime) for mtime, tile in sorted(tiles)]
+
+
+def move_tiles(incoming, batch, tiles):
+    """
+    Moves tiles from the incoming folder to a batch folder, keeping their
+    relative paths.
+    """
+
+    for tile in tiles:
+        target = os.path.join(batch, tile)
+        if not os.path.isdir(os.path.dirname(target)):
+            os.makedirs(os.path.dirname(target))
+        os.rename(os.path.join(incoming, tile), target)
+
+
+# pylint: disable=too-many-arguments, too-many-locals
+def stream(tiles, tiler, model, predict_args, input_flag='--input_dir',
+           output_flag='--output_folder', batch_size=256, max_pending=4096,
+           settle=1.0, poll=0.2):
+    """
+    Tiles an image and predicts on its tiles as they are produced. Returns
+    the number of batches predicted. The tiles folder is removed at the end.
+    :Arguments:
+        :tiles: The folder of the tiles, preferably in shared memory, str
+        :tiler: The tiling command, without its output folder, list
+        :model: A callable that takes the arguments of a prediction
+        :predict_args: The prediction arguments, without the input folder,
+                       list
+        :input_flag: The prediction argument of the input folder, str
+        :output_flag: The tiling argument of the output folder, str
+        :batch_size: The number of tiles of a batch, int
+        :max_pending: The number of waiting tiles that pauses the tiler, int
+        :settle: Seconds a tile does not change before it is predicted, float
+        :poll: Seconds between checks, float
+    """
+
+    incoming = os.path.join(tiles, 'incoming')
+    os.makedirs(incoming)
+    max_pending = max(max_pending, batch_size)
+    process = subprocess.Popen(list(tiler) + ['%s=%s' % (output_flag,
+                                                         incoming)])
+    paused_at = None
+    batches = 0
+    try:
+        while True:
+            done = process.poll() is not None
+            if done and process.returncode != 0:
+                raise RuntimeError('Tiling failed with status %d' %
+                                   process.returncode)
+
+            # A tile the tiler was writing when it was paused looks settled,
+            # so tiles settle against the time of the pause
+            pending = list_tiles(incoming)
+            cutoff = (paused_at or time.time()) - settle
+            ready = [tile for tile, mtime in pending
+                     if done or mtime < cutoff]
+            if paused_at and (len(pending) <= max_pending // 2
+                              or len(ready) < batch_size):
+                process.send_signal(signal.SIGCONT)
+                paused_at = None
+            elif not paused_at and not done and len(ready) > max_pending:
+                process.send_signal(signal.SIGSTOP)
+                paused_at = time.time()
+            if not ready and done:
+                break
+            if len(ready) < batch_size and not done:
+                time.sleep(poll)
+                continue
+
+            batch = os.path.join(tiles, 'batch%06d' % batches)
+            move_tiles(incoming, batch, ready[:batch_size])
+            model(list(predict_args) + ['%s=%s' % (input_flag, batch)])
+            shutil.rmtree(batch)
+            batches += 1
+            print('Predicted batch %d of %d tiles' %
+                  (batches, len(ready[:batch_size])))
+            sys.stdout.flush()
+
+        if hasattr(model, 'close'):
+            model.close()
+    finally:
+        if process.poll() is None:
+            process.send_signal(signal.SIGCONT)
+            process.kill()
+            process.wait()
+        shutil.rmtree(tiles, ignore_errors=True)
+
+    return batches
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--tiles', type=str, required=True,
+                        help='The folder of the tiles')
+    parser.add_argument('--module', type=str, required=True,
+                        help='The module that predicts')
+    parser.add_argument('--input_flag', type=str, default='--input_dir')
+    parser.add_argument('--output_flag', type=str, default='--output_folder')
+    parser.add_argument('--predict', type=str, action='append', default=[],
+                        help='An argument of the prediction, e.g. \
+                        --predict=--output_dir=./out')
+    parser.add_argument('--batch_size', type=int, default=256)
+    parser.add_argument('--max_pending', type=int, default=4096)
+    parser.add_argument('--settle', type=float, default=1.0)
+    parser.add_argument('tiler', nargs=argparse.REMAINDER,
+                        help='The tiling command, after --')
+    args = parser.parse_args()
+
+    from inference_worker import load_model
+
+    tiler_cmd = args.tiler
+    if tiler_cmd and tiler_cmd[0] == '--':
+        tiler_cmd = tiler_cmd[1:]
+    stream(args.tiles, tiler_cmd, load_model(args.module), args.predict,
+           args.input_flag, args.output_flag, args.batch_size,
+           args.max_pending, args.settle)
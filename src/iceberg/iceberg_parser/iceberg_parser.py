@@ -25,9 +25,11 @@ class IcebergParser():
     """
     # --------------------------------------------------------------------------
     #
-    def __init__(self):
+    def __init__(self, allocation=True):
         """
-        The constructor
+        The constructor. The resource arguments are optional when allocation
+        is False, e.g. for analyses submitted to a daemon, which run on its
+        allocation.
         """
 
         self._args = dict()
@@ -49,16 +51,16 @@ class IcebergParser():
             required_args.title = 'Required Arguments'
             required_args.add_argument('--resource', '-r',
                                        help='Where the execution will happen',
-                                       type=str, required=True)
+                                       type=str, required=allocation)
             required_args.add_argument('--queue', '-q',
                                        help='The queue of the resource',
                                        type=str, default=None)
             required_args.add_argument('--cpus', '-c',
                                        help='How many CPUs will be required',
-                                       type=int, required=True)
+                                       type=int, required=allocation)
             required_args.add_argument('--gpus', '-g',
                                        help='How many GPUs will be required',
-                                       type=int, required=True)
+                                       type=int, required=allocation)
             required_args.add_argument('--input_path', '-ip',
                                        help='Where the input images are',
                                        type=str, required=True)
@@ -67,7 +69,7 @@ class IcebergParser():
                                        type=str, required=True)
             required_args.add_argument('--walltime', '-w',
                                        help='The estimated execution time',
-                                       type=int, required=True)
+                                       type=int, required=allocation)
             required_args.add_argument('--project', '-pr',
                                        help='The project ID to charge',
                                        type=str, default=None)
@@ -94,6 +96,134 @@ class IcebergParser():
                                            db_name',
                                        type=str, default=None)
 
+            discovery_args = parser.add_argument_group()
+            discovery_args.title = 'Discovery Arguments'
+            discovery_args.add_argument('--walk',
+                                        help='How input paths are listed, \
+                                        glob or scandir',
+                                        type=str, default='glob',
+                                        choices=['glob', 'scandir'])
+            discovery_args.add_argument('--recursive',
+                                        help='Discover images in \
+                                        subdirectories of the input path',
+                                        action='store_true')
+            discovery_args.add_argument('--discovery_threads',
+                                        help='Threads of a discovery task',
+                                        type=int, default=1)
+            discovery_args.add_argument('--shards',
+                                        help='Number of discovery tasks per \
+                                        input path',
+                                        type=int, default=1)
+            discovery_args.add_argument('--manifests',
+                                        help='Directory on the resource with \
+                                        the discovery manifests',
+                                        type=str, default=None)
+            discovery_args.add_argument('--changed_only',
+                                        help='Analyze only images that are \
+                                        new or changed since the manifest',
+                                        action='store_true')
+            discovery_args.add_argument('--checksum',
+                                        help='Keep image hashes in the \
+                                        manifests',
+                                        action='store_true')
+
+            discovery_args.add_argument('--catalog_format',
+                                        help='Format of the discovery \
+                                        catalogs',
+                                        type=str, default='csv',
+                                        choices=['csv', 'npz', 'parquet'])
+            discovery_args.add_argument('--metadata',
+                                        help='Discover the raster header of \
+                                        every image',
+                                        action='store_true')
+
+            discovery_args.add_argument('--local_discovery',
+                                        help='Discover images on this host \
+                                        instead of the resource',
+                                        action='store_true')
+
+            execution_args = parser.add_argument_group()
+            execution_args.title = 'Execution Arguments'
+            execution_args.add_argument('--streaming',
+                                        help='Start analyzing images as soon \
+                                        as their discovery shard finishes',
+                                        action='store_true')
+            execution_args.add_argument('--schedule',
+                                        help='Order in which images are \
+                                        analyzed',
+                                        type=str, default='catalog',
+                                        choices=['catalog', 'largest',
+                                                 'smallest', 'lpt'])
+            execution_args.add_argument('--slots',
+                                        help='Number of images analyzed \
+                                        concurrently by the lpt schedule',
+                                        type=int, default=None)
+            execution_args.add_argument('--overlap',
+                                        help='Tile the next image of an lpt \
+                                        lane while the current one is \
+                                        predicted',
+                                        action='store_true')
+            execution_args.add_argument('--max_pipelines',
+                                        help='Maximum number of image \
+                                        pipelines in flight',
+                                        type=int, default=None)
+            execution_args.add_argument('--batch_size',
+                                        help='Maximum number of images \
+                                        predicted by a single task',
+                                        type=int, default=None)
+            execution_args.add_argument('--batch_mb',
+                                        help='Maximum size in MBs of the \
+                                        images predicted by a single task',
+                                        type=int, default=None)
+            execution_args.add_argument('--inference_service',
+                                        help='Run one inference worker per \
+                                        GPU that keeps the model resident',
+                                        action='store_true')
+            execution_args.add_argument('--journal',
+                                        help='SQLite journal with the state \
+                                        of every image. Default: no journal',
+                                        type=str, default=None)
+            execution_args.add_argument('--resume',
+                                        help='Skip the images the journal \
+                                        records as completed',
+                                        action='store_true')
+            execution_args.add_argument('--throughput',
+                                        help='JSON throughput model. Splits \
+                                        the images in parts that fit in the \
+                                        walltime, each in its own pilot',
+                                        type=str, default=None)
+            execution_args.add_argument('--part',
+                                        help='Run only this part of the \
+                                        plan', type=int, default=None)
+            execution_args.add_argument('--profile',
+                                        help='Prefix of the per image and \
+                                        per stage profile of the run',
+                                        type=str, default=None)
+            execution_args.add_argument('--model_cache',
+                                        help='Copy models once per node to \
+                                        node local storage',
+                                        action='store_true')
+            execution_args.add_argument('--prefetch',
+                                        help='Number of scenes a lane copies \
+                                        ahead to node local storage',
+                                        type=int, default=0)
+            execution_args.add_argument('--prefetch_mb',
+                                        help='Maximum size in MBs of the \
+                                        scenes a lane holds in node local \
+                                        storage',
+                                        type=int, default=None)
+            execution_args.add_argument('--target',
+                                        help='Target completion time in \
+                                        minutes. CPUs, GPUs and walltime are \
+                                        sized from the catalog and the \
+                                        throughput model, up to the \
+                                        requested ones',
+                                        type=int, default=None)
+            execution_args.add_argument('--results_index',
+                                        help='Path of the CSV index the \
+                                        results of every image are added to',
+                                        type=str, default=None)
+
             command_parser = parser.add_subparsers(help='commands')
 
             for key, parser_impl in PARSERS.items():
@@ -117,7 +247,35 @@ class IcebergParser():
                     'rmq_password',
                     'rmq_endpoint',
                     'rmq_port',
-                    'radical_pilot_dburl']
+                    'radical_pilot_dburl',
+                    'walk',
+                    'recursive',
+                    'discovery_threads',
+                    'shards',
+                    'manifests',
+                    'changed_only',
+                    'checksum',
+                    'catalog_format',
+                    'metadata',
+                    'local_discovery',
+                    'streaming',
+                    'schedule',
+                    'slots',
+                    'overlap',
+                    'max_pipelines',
+                    'batch_size',
+                    'batch_mb',
+                    'inference_service',
+                    'journal',
+                    'resume',
+                    'throughput',
+                    'part',
+                    'profile',
+                    'model_cache',
+                    'prefetch',
+                    'prefetch_mb',
+                    'results_index',
+                    'target']
             for key in keys:
                 self._args['general'][key] = tmp_args.pop(key)
 
@@ -20,4 +20,7 @@ class PenguinsSubparser():
                                      help='The model name')
         penguins_parser.add_argument('--model_path', '-mp',
                                      help='Path of a custom model')
+        penguins_parser.add_argument('--gpu_concurrency', type=int,
+                                     help='Number of concurrent detections \
+                                     on every GPU', default=1)
         penguins_parser.add_argument('--ve_penguins')
@@ -19,3 +19,6 @@ class RiversSubparser():
                             help='Step size')
         rivers_parser.add_argument('-w', '--weights_path', type=str,
                             help='Path to the weights')
+        rivers_parser.add_argument('--fused', action='store_true',
+                                   help='Stitch the mosaic while the tiles \
+                                   are predicted')
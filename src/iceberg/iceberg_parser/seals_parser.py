@@ -34,6 +34,9 @@ class SealsSubparser():
                              'used in subsequent steps of the pipeline')
         seals_parser.add_argument('--models_folder', type=str, default='saved_models',
                                   help='folder where the model tar file is saved')
+        seals_parser.add_argument('--fused', action='store_true',
+                                  help='Tile and predict every image in a \
+                                  single task, through shared memory')
         seals_parser.add_argument('--ve_seals',
                                   help='Path of a python virtualenv with \
                                   the seals package installed ')
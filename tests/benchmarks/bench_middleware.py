@@ -0,0 +1,341 @@
+"""
+Middleware Benchmarks
+==========================================================
+Measures the hot paths of the middleware offline: image
+discovery over synthetic trees, catalog loading and image
+pipeline construction of every use case. radical.entk is
+replaced by a minimal in-process mock, so the numbers are
+the cost of the middleware itself, not of EnTK. Use
+--real_entk to measure with the installed EnTK instead.
+
+Every case reports its best time out of --repeat runs and
+its peak Python memory, measured with tracemalloc in a
+separate run. --save writes the results as baselines and
+--check compares against them and exits with 1 when a case
+got slower or bigger than --tolerance times its baseline.
+Baselines are machine specific, so save them on the machine
+that checks them.
+
+    python tests/benchmarks/bench_middleware.py --check
+    python tests/benchmarks/bench_middleware.py \
+        --discovery 1000 10000 100000 1000000 --save
+
+Author: Ioannis Paraskevakos
+License: MIT
+Copyright: 2018-2019
+"""
+import argparse
+import gc
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+import types
+
+BASELINES = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                         'baselines.json')
+FILES_PER_DIR = 1000
+
+
+class _Entity():
+    """
+    A mock EnTK object: attributes are plain Python attributes.
+    """
+
+    _defaults = dict()
+
+    def __init__(self, from_dict=None):
+        for key, value in self._defaults.items():
+            setattr(self, key, value() if callable(value) else value)
+        self.name = ''
+        if from_dict:
+            self.__dict__.update(from_dict)
+
+
+class _Task(_Entity):
+    _defaults = {'pre_exec': list, 'arguments': list, 'link_input_data': list,
+                 'upload_input_data': list, 'cpu_reqs': dict,
+                 'gpu_reqs': dict, 'tags': None, 'lfs_per_process': 0,
+                 'executable': ''}
+
+
+class _Stage(_Entity):
+    _defaults = {'tasks': set, 'post_exec': None}
+
+    def add_tasks(self, value):
+        if isinstance(value, (list, set)):
+            self.tasks.update(value)
+        else:
+            self.tasks.add(value)
+
+
+class _Pipeline(_Entity):
+    _defaults = {'stages': list}
+
+    def add_stages(self, value):
+        if isinstance(value, list):
+            self.stages.extend(value)
+        else:
+            self.stages.append(value)
+
+
+class _AppManager():
+
+    def __init__(self, **kwargs):
+        self.resource_desc = None
+        self.workflow = None
+        self.shared_data = None
+
+    def run(self):
+        pass
+
+    def resource_terminate(self):
+        pass
+
+
+def mock_entk():
+    """
+    Installs the mock radical.entk. radical.utils is mocked only when it is
+    not installed.
+    """
+
+    entk = types.ModuleType('radical.entk')
+    entk.Task = _Task
+    entk.Stage = _Stage
+    entk.Pipeline = _Pipeline
+    entk.AppManager = _AppManager
+    try:
+        import radical.utils
+    except ImportError:
+        radical = types.ModuleType('radical')
+        radical.__path__ = []
+        utils = types.ModuleType('radical.utils')
+        utils.Logger = lambda *args, **kwargs: types.SimpleNamespace(
+            info=print, debug=print, warning=print, error=print)
+        utils.generate_id = lambda name, **kwargs: name
+        utils.ID_PRIVATE = None
+        radical.utils = utils
+        sys.modules['radical'] = radical
+        sys.modules['radical.utils'] = utils
+    radical.entk = entk
+    sys.modules['radical.entk'] = entk
+
+
+def measure(function, repeat):
+    """
+    Returns the best time of repeat calls of a function, in seconds, and its
+    peak Python memory in MBs.
+    """
+
+    best = None
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    gc.collect()
+    tracemalloc.start()
+    function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return best, peak / 1024 / 1024
+
+
+def make_tree(root, count, ftype='tif'):
+    """
+    Creates count empty images in folders of FILES_PER_DIR files.
+    """
+
+    for idx in range(count):
+        folder = os.path.join(root, 'd%04d' % (idx // FILES_PER_DIR))
+        if idx % FILES_PER_DIR == 0:
+            os.makedirs(folder)
+        open(os.path.join(folder, 'img%07d.%s' % (idx, ftype)), 'w').close()
+
+
+def discovery_cases(workdir, sizes):
+    """
+    Yields the discovery cases: every walk over a tree of every size.
+    """
+
+    from iceberg.discovery import image_discovery
+
+    for size in sizes:
+        root = os.path.join(workdir, 'tree%d' % size)
+        make_tree(root, size)
+        for walk in ['glob', 'scandir']:
+            yield ('discovery.%s.%d' % (walk, size),
+                   lambda root=root, walk=walk: image_discovery(
+                       root, filename=os.path.join(workdir, 'images'),
+                       filesize=True, walk=walk, recursive=True))
+
+
+def catalog_cases(workdir, sizes):
+    """
+    Yields the catalog cases: loading and merging catalogs of every size.
+    """
+
+    from iceberg.discovery import load_catalog, write_catalog, merge_catalogs
+
+    for size in sizes:
+        catalog = os.path.join(workdir, 'catalog%d.csv' % size)
+        write_catalog(catalog, {'Filename': ['/data/d%04d/img%07d.tif' %
+                                             (idx // FILES_PER_DIR, idx)
+                                             for idx in range(size)],
+                                'Size': [idx % 2000 for idx in range(size)]})
+        yield ('catalog.load.%d' % size,
+               lambda catalog=catalog: load_catalog(catalog))
+        yield ('catalog.merge.%d' % size,
+               lambda catalog=catalog: merge_catalogs([catalog, catalog]))
+
+
+def make_executors():
+    """
+    Returns an executor of every use case.
+    """
+
+    from iceberg.executor import Seals, Rivers, Penguins
+
+    os.environ.setdefault('RMQ_ENDPOINT', 'localhost')
+    os.environ.setdefault('RMQ_PORT', '5672')
+    resources = {'resource': 'xsede.bridges2', 'queue': 'GPU',
+                 'walltime': 60, 'cpus': 4, 'gpus': 2}
+    seals = Seals(name='bench', resources=resources, project='bench',
+                  input_path='/data', output_path='/out', bands='0',
+                  stride=1, patch_size=224, geotiff=0, model_arch='UnetCntWRN',
+                  hyperparam_set='A', model_name='model', models_folder='./')
+    rivers = Rivers(name='bench', resources=resources, project='bench',
+                    input_path='/data', output_path='/out', tile_size=224,
+                    step=112, weights_path='weights.h5')
+    penguins = Penguins(name='bench', resources=resources, project='bench',
+                        input_path='/data', output_path='/out',
+                        model='model', model_path='./', epoch=300)
+
+    return [('seals', seals), ('rivers', rivers), ('penguins', penguins)]
+
+
+def pipeline_cases(sizes):
+    """
+    Yields the pipeline cases: the pipelines of every use case for every
+    number of images.
+    """
+
+    executors = make_executors()
+    for size in sizes:
+        images = [('/data/d%04d/img%07d.tif' % (idx // FILES_PER_DIR, idx),
+                   idx % 2000) for idx in range(size)]
+        for name, executor in executors:
+            def build(executor=executor, images=images):
+                pre_execs = executor._resolve_pre_execs()
+                return [executor._generate_pipeline(name='P%d' % idx,
+                                                    pre_execs=pre_execs,
+                                                    image=image,
+                                                    image_size=image_size)
+                        for idx, (image, image_size) in enumerate(images)]
+            yield 'pipelines.%s.%d' % (name, size), build
+
+
+def compare(results, baselines, tolerance):
+    """
+    Returns the cases that got slower or bigger than tolerance times their
+    baseline.
+    """
+
+    regressions = list()
+    for case, result in results.items():
+        baseline = baselines.get(case)
+        if not baseline:
+            continue
+        for key in ['seconds', 'peak_mb']:
+            if result[key] > baseline[key] * tolerance and \
+                    result[key] - baseline[key] > 0.01:
+                regressions.append('%s: %s %.3f, baseline %.3f' %
+                                   (case, key, result[key], baseline[key]))
+
+    return regressions
+
+
+def main():
+    """
+    Runs the benchmarks.
+    """
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--discovery', type=int, nargs='*',
+                        default=[1000, 10000],
+                        help='Image counts of the discovery trees')
+    parser.add_argument('--catalog', type=int, nargs='*',
+                        default=[10000, 100000],
+                        help='Image counts of the catalogs')
+    parser.add_argument('--pipelines', type=int, nargs='*',
+                        default=[100, 1000, 10000],
+                        help='Image counts of the workflows')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--workdir', type=str, default=None,
+                        help='Where synthetic trees are created. Default: a \
+                        temporary folder in /dev/shm when it exists')
+    parser.add_argument('--real_entk', action='store_true',
+                        help='Measure with the installed radical.entk')
+    parser.add_argument('--baselines', type=str, default=BASELINES)
+    parser.add_argument('--save', action='store_true',
+                        help='Save the results as baselines')
+    parser.add_argument('--check', action='store_true',
+                        help='Fail when a case regressed')
+    parser.add_argument('--tolerance', type=float, default=1.5)
+    args = parser.parse_args()
+
+    if not args.real_entk:
+        mock_entk()
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                    '..', '..', 'src'))
+
+    tmp_root = args.workdir
+    if tmp_root is None and os.path.isdir('/dev/shm'):
+        tmp_root = '/dev/shm'
+    workdir = tempfile.mkdtemp(prefix='iceberg-bench-', dir=tmp_root)
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    results = dict()
+    try:
+        cases = [discovery_cases(workdir, args.discovery),
+                 catalog_cases(workdir, args.catalog),
+                 pipeline_cases(args.pipelines)]
+        for case_group in cases:
+            for case, function in case_group:
+                seconds, peak_mb = measure(function, args.repeat)
+                results[case] = {'seconds': seconds, 'peak_mb': peak_mb}
+                print('%-32s %10.3f s %10.1f MB' % (case, seconds, peak_mb))
+                sys.stdout.flush()
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    status = 0
+    if args.check:
+        with open(args.baselines) as baselines_json:
+            baselines = json.load(baselines_json)
+        regressions = compare(results, baselines, args.tolerance)
+        for regression in regressions:
+            print('REGRESSION %s' % regression)
+        status = 1 if regressions else 0
+
+    if args.save:
+        baselines = dict()
+        if os.path.exists(args.baselines):
+            with open(args.baselines) as baselines_json:
+                baselines = json.load(baselines_json)
+        baselines.update(results)
+        with open(args.baselines, 'w') as baselines_json:
+            json.dump(baselines, baselines_json, indent=2, sort_keys=True)
+
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
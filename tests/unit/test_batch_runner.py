@@ -0,0 +1,55 @@
+"""
+Project: ICEBERG middleware Project
+Author: Ioannis Paraskevakos
+License: MIT
+Copyright: 2018-2019
+"""
+# pylint: disable=protected-access, unused-argument, unused-import
+
+import sys
+
+from iceberg.executor.batch_runner import run_batch
+
+
+STUB_MODULE = '''
+import argparse
+import sys
+
+CALLS = list()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--input', type=str)
+    args = parser.parse_args()
+    CALLS.append(args.input)
+    if args.input == 'fail':
+        sys.exit(2)
+
+
+if __name__ == '__main__':
+    main()
+'''
+
+
+# ------------------------------------------------------------------------------
+#
+def test_run_batch(tmpdir, monkeypatch):
+    """
+    Test that every job of a batch runs in this process and failures are
+    counted without stopping the batch
+    """
+
+    tmpdir.join('batch_stub.py').write(STUB_MODULE)
+    monkeypatch.syspath_prepend(str(tmpdir))
+    monkeypatch.setenv('IMAGE', 'b.tif')
+    argv = sys.argv
+
+    jobs = [['--input=a.tif'], ['--input=fail'], ['--input=$IMAGE']]
+    assert run_batch('batch_stub', jobs) == 1
+    assert sys.modules['batch_stub'].CALLS == ['a.tif', 'fail', 'b.tif']
+    assert sys.argv is argv
+
+    assert run_batch('batch_stub', [['--unknown']]) == 1
+    assert run_batch('batch_stub', [['--input=c.tif']], function=None) == 0
+    assert run_batch('batch_stub', [['--input=c.tif']], function='none') == 1
@@ -0,0 +1,63 @@
+"""
+Author: Ioannis Paraskevakos
+License: MIT
+Copyright: 2018-2019
+"""
+# pylint: disable=protected-access, unused-argument, unused-import
+
+import pandas as pd
+
+from iceberg.discovery import merge_catalogs, read_catalog, load_catalog
+
+
+# ------------------------------------------------------------------------------
+#
+def test_merge_catalogs(tmpdir):
+    """
+    Test that catalogs are merged and deduplicated
+    """
+
+    tmpdir.join('images0.csv').write('Filename,Size\n/a/1.tif,1\n/a/2.tif,2\n')
+    tmpdir.join('images1.csv').write('Filename,Size\n/a//2.tif,2\n/b/3.tif,3\n')
+    tmpdir.join('images2.csv').write('Filename,Size\n')
+    catalogs = [str(tmpdir.join('images%d.csv' % idx)) for idx in range(3)]
+    merged = str(tmpdir.join('images.csv'))
+
+    images = merge_catalogs(catalogs, merged)
+    assert images == [('/a/1.tif', 1), ('/a/2.tif', 2), ('/b/3.tif', 3)]
+    assert read_catalog(merged) == images
+    assert list(pd.read_csv(merged).columns) == ['Filename', 'Size']
+
+    assert merge_catalogs([]) == []
+
+
+# ------------------------------------------------------------------------------
+#
+def test_read_catalog(tmpdir):
+    """
+    Test reading catalogs with and without sizes
+    """
+
+    tmpdir.join('list.csv').write('Filename\n/a/1.tif\n')
+    assert read_catalog(str(tmpdir.join('list.csv'))) == [('/a/1.tif', None)]
+
+
+# ------------------------------------------------------------------------------
+#
+def test_merge_catalogs_formats(tmpdir):
+    """
+    Test that metadata columns survive merging into a npz catalog
+    """
+
+    tmpdir.join('images0.csv').write('Filename,Size,Width,Nodata\n'
+                                     '/a/1.tif,1,10,\n')
+    tmpdir.join('images1.csv').write('Filename,Size\n/b/2.tif,2\n')
+    catalogs = [str(tmpdir.join('images%d.csv' % idx)) for idx in range(2)]
+    merged = str(tmpdir.join('images.npz'))
+
+    images = merge_catalogs(catalogs, merged)
+    assert images == [('/a/1.tif', 1), ('/b/2.tif', 2)]
+    assert read_catalog(merged) == images
+    columns = load_catalog(merged)
+    assert columns['Width'] == [10, None]
+    assert columns['Nodata'] == [None, None]
@@ -0,0 +1,103 @@
+"""
+Author: Ioannis Paraskevakos
+License: MIT
+Copyright: 2018-2019
+"""
+# pylint: disable=protected-access, unused-argument, unused-import
+
+import mock
+
+from iceberg.executor.daemon import (Daemon, Spool, QUEUED, RUNNING, DONE,
+                                     FAILED)
+
+
+def _executor(shared_data):
+    """
+    Returns an executor that runs one pipeline for its images
+    """
+
+    executor = mock.Mock(_data_input_path='/data', _img_ftype='tif',
+                         _throughput=None, _target=None, _streaming=False,
+                         _profile=None, _batches=None, _catalog='images.csv')
+    executor._shared_data.return_value = shared_data
+    executor._discover_images.return_value = [('/data/a.tif', 1)]
+    executor._pending_images.side_effect = lambda images: images
+    executor._image_workflow.side_effect = \
+        lambda images: ['P%d' % len(images)]
+
+    return executor
+
+
+# ------------------------------------------------------------------------------
+#
+def test_spool(tmpdir):
+    """
+    Test that requests are served in the order they were submitted
+    """
+
+    spool = Spool(str(tmpdir.join('spool')))
+    first = spool.submit({'analysis': 'a'})
+    second = spool.submit({'analysis': 'b'})
+    assert spool.state(first) == (QUEUED, {'analysis': 'a'})
+
+    assert spool.take() == (first, {'analysis': 'a'})
+    assert spool.state(first)[0] == RUNNING
+    spool.finish(first, DONE, seconds=3)
+    assert spool.state(first) == (DONE, {'analysis': 'a',
+                                         'status': {'seconds': 3}})
+    assert spool.take() == (second, {'analysis': 'b'})
+    assert spool.take() is None
+    assert spool.state('missing') == (None, None)
+
+
+# ------------------------------------------------------------------------------
+#
+def test_daemon(tmpdir):
+    """
+    Test that a daemon runs the requests of its spool on one allocation
+    until it is asked to stop
+    """
+
+    spool = Spool(str(tmpdir.join('spool')))
+    requests = [spool.submit({'model': model})
+                for model in ['/m/a.h5', '/m/b.h5', None]]
+    spool.stop()
+    app_manager = mock.Mock()
+    workflows = list()
+    app_manager.run.side_effect = \
+        lambda: workflows.append(app_manager.workflow)
+
+    def create_executors(request):
+        if not request['model']:
+            raise ValueError('No model')
+        return [_executor([request['model']])]
+
+    daemon = Daemon(spool, app_manager, create_executors, mock.Mock(),
+                    poll=0)
+    assert daemon.serve() == 3
+    assert [spool.state(request)[0] for request in requests] == \
+        [DONE, DONE, FAILED]
+    assert spool.state(requests[2])[1]['status']['error'] == 'No model'
+    assert spool.take() is None
+    assert workflows[0] == set(['P1'])
+    staging = list(workflows[1])[0]
+    assert staging.name == 'Shared'
+    task = list(staging.stages[0].tasks)[0]
+    assert task.upload_input_data == ['/m/b.h5']
+    assert task.arguments == ['-c', 'mv b.h5 $RP_PILOT_SANDBOX/']
+    assert workflows[2] == set(['P1'])
+    app_manager.resource_terminate.assert_called_once_with()
+
+
+# ------------------------------------------------------------------------------
+#
+def test_daemon_idle(tmpdir):
+    """
+    Test that an idle daemon stops and releases its allocation
+    """
+
+    app_manager = mock.Mock()
+    daemon = Daemon(Spool(str(tmpdir)), app_manager, mock.Mock(),
+                    mock.Mock(), poll=0, idle_timeout=0)
+    assert daemon.serve() == 0
+    app_manager.resource_terminate.assert_called_once_with()
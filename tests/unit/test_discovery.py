@@ -10,7 +10,7 @@ import inspect
 import mock
 import pytest
 
-from iceberg.discovery import Discovery
+from iceberg.discovery import Discovery, read_catalog
 
 
 # ------------------------------------------------------------------------------
@@ -150,3 +150,83 @@ def test_generate_pipeline_error(mocked_init):
     with pytest.raises(RuntimeError):
         component.generate_discover_pipe()
     
+
+# ------------------------------------------------------------------------------
+#
+@mock.patch.object(Discovery, '__init__', return_value=None)
+def test_generate_pipeline_shards(mocked_init):
+    """
+    Test that every path is discovered by one task per shard
+    """
+
+    component = Discovery()
+    component._modules = None
+    component._paths = ['/path/a', '/path/b']
+    component._pre_execs = None
+
+    test_pipeline = component.generate_discover_pipe(shards=2, walk='scandir',
+                                                     threads=4,
+                                                     manifests='/manifests')
+    tasks = sorted(test_pipeline.stages[0].tasks, key=lambda task: task.name)
+    assert len(tasks) == 4
+    assert component.catalogs == ['images0.csv', 'images1.csv',
+                                  'images2.csv', 'images3.csv']
+    assert tasks[3].arguments == ['image_disc.py', '/path/b',
+                                  '--image_ftype=tif',
+                                  '--filename=images3',
+                                  '--filetype=csv', '--filesize',
+                                  '--walk=scandir', '--threads=4',
+                                  '--manifest=/manifests/path_b.1of2.csv',
+                                  '--shard=1', '--shards=2']
+    assert tasks[3].download_output_data == ['images3.csv']
+
+
+# ------------------------------------------------------------------------------
+#
+@pytest.mark.parametrize('processes', [1, 2])
+def test_discover_local(tmpdir, monkeypatch, processes):
+    """
+    Test discovering images in the calling process
+    """
+
+    images = tmpdir.mkdir('images')
+    for idx in range(10):
+        images.join('test%d.tif' % idx).write(b'0', mode='wb')
+    monkeypatch.chdir(tmpdir)
+
+    component = Discovery(paths=[str(images)])
+    catalogs = component.discover_local(shards=2, processes=processes)
+    assert catalogs == ['images0.csv', 'images1.csv']
+    assert component.catalogs == catalogs
+    found = list()
+    for catalog in catalogs:
+        found += [image for image, _ in read_catalog(catalog)]
+    assert sorted(found) == sorted(str(images.join('test%d.tif' % idx))
+                                   for idx in range(10))
+
+    with pytest.raises(RuntimeError):
+        Discovery().discover_local()
+
+
+# ------------------------------------------------------------------------------
+#
+def test_commit_manifests(tmpdir):
+    """
+    Test that the pending manifest of every path and shard replaces its
+    manifest
+    """
+
+    component = Discovery(paths=['/path/a'])
+    pipeline = component.generate_commit_pipe('/manifests', shards=2)
+    task = list(pipeline.stages[0].tasks)[0]
+    assert task.arguments == [
+        '-c', 'python image_disc.py /path/a '
+        '--manifest=/manifests/path_a.0of2.csv --commit && '
+        'python image_disc.py /path/a '
+        '--manifest=/manifests/path_a.1of2.csv --commit']
+
+    manifests = tmpdir.mkdir('manifests')
+    manifests.join('path_a.csv.pending').write('Filename\n')
+    component.commit_local(str(manifests))
+    assert manifests.join('path_a.csv').read() == 'Filename\n'
+    assert not manifests.join('path_a.csv.pending').exists()
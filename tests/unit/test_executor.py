@@ -6,11 +6,21 @@ Copyright: 2018-2019
 # pylint: disable=protected-access, unused-argument, unused-import
 
 import os
-import inspect
+import copy
+import json
 import mock
 import pytest
 
 from iceberg.executor.executor import Executor
+from iceberg.executor.penguins import Penguins
+from iceberg.executor.seals import Seals
+from iceberg.executor.rivers import Rivers
+from iceberg.executor.multi import MultiExecutor
+from iceberg.executor.scheduler import pipeline_name
+from iceberg.executor.journal import Journal, DONE, FAILED, SUBMITTED
+from iceberg.executor.planner import ThroughputModel
+from iceberg.executor.model_cache import sha256sum
+from iceberg.discovery import write_catalog
 import radical.utils
 import radical.entk
 
@@ -60,3 +70,870 @@ def test_init():
                                    'project': 'test_prj',
                                    'queue': 'test_queue'}
     assert component._logger == 'test_logger'
+
+
+# ------------------------------------------------------------------------------
+#
+def test_init_app_manager(tmpdir, monkeypatch):
+    """
+    Test that an executor runs on the AppManager it is given, e.g. the one of
+    a daemon, without creating its own
+    """
+
+    monkeypatch.chdir(tmpdir)
+    app_manager = mock.Mock()
+    with mock.patch.object(Executor, '_create_app_manager') as create:
+        component = Executor('test', 'my_resource', 30, 5,
+                             app_manager=app_manager)
+    create.assert_not_called()
+    assert component._app_manager is app_manager
+
+
+# ------------------------------------------------------------------------------
+#
+EXECUTOR_DEFAULTS = {'_res_dict': {'resource': 'xsede.bridges2',
+                                   'walltime': 30, 'cpus': 4, 'gpus': 1},
+                     '_req_modules': None,
+                     '_pre_execs': None,
+                     '_data_input_path': None,
+                     '_discovery_args': dict(),
+                     '_streaming': False,
+                     '_local_discovery': False,
+                     '_schedule': 'catalog',
+                     '_slots': 1,
+                     '_max_pipelines': None,
+                     '_batch_size': None,
+                     '_batch_mb': None,
+                     '_inference_service': False,
+                     '_journal': None,
+                     '_resume': False,
+                     '_throughput': None,
+                     '_part': None,
+                     '_profile': None,
+                     '_profile_images': dict(),
+                     '_profile_tasks': list(),
+                     '_sessions': list(),
+                     '_model_cache': False,
+                     '_checksums': dict(),
+                     '_prefetch': 0,
+                     '_prefetch_mb': None,
+                     '_results_index': None,
+                     '_target': None,
+                     '_overlap': False,
+                     '_rasters': None,
+                     '_uids': list(),
+                     '_batches': None,
+                     '_failed': False,
+                     '_name': 'test_name',
+                     '_catalog': None,
+                     '_factories': dict()}
+
+
+def make_executor(cls=Executor, **attributes):
+    """
+    Creates an executor without calling its constructor. Attributes default
+    to the values of EXECUTOR_DEFAULTS.
+    """
+
+    with mock.patch.object(cls, '__init__', return_value=None):
+        component = cls()
+    component._app_manager = mock.Mock()
+    component._logger = mock.Mock()
+    for key, value in EXECUTOR_DEFAULTS.items():
+        setattr(component, key, attributes.pop(key, copy.deepcopy(value)))
+    for key, value in attributes.items():
+        setattr(component, key, value)
+
+    return component
+
+
+# ------------------------------------------------------------------------------
+#
+def test_run_workflow():
+    """
+    Test that one pipeline is created for every discovered image
+    """
+
+    component = make_executor(_req_modules=['test_module'],
+                              _pre_execs=['test_pre_exec'])
+    component._discover_images = mock.Mock(return_value=[('a.tif', 1),
+                                                         ('b.tif', 2)])
+    component._generate_pipeline = mock.Mock(side_effect=['p0', 'p1'])
+
+    component._run_workflow()
+    component._generate_pipeline.assert_any_call(
+        name=pipeline_name(['a.tif']),
+        pre_execs=['module load test_module', 'test_pre_exec'],
+        image='a.tif', image_size=1)
+    component._generate_pipeline.assert_any_call(
+        name=pipeline_name(['b.tif']),
+        pre_execs=['module load test_module', 'test_pre_exec'],
+        image='b.tif', image_size=2)
+    assert component._app_manager.workflow == {'p0', 'p1'}
+    component._app_manager.run.assert_called_once_with()
+
+
+# ------------------------------------------------------------------------------
+#
+def _two_stage_pipeline(name, pre_execs, image, image_size):
+    """
+    Creates a two stage image pipeline like the one of Seals
+    """
+
+    pipeline = radical.entk.Pipeline()
+    pipeline.name = name
+    for idx in range(2):
+        stage = radical.entk.Stage()
+        stage.name = '%s.S%d' % (name, idx)
+        task = radical.entk.Task()
+        task.name = '%s.T%d' % (stage.name, idx)
+        task.executable = image
+        stage.add_tasks(task)
+        pipeline.add_stages(stage)
+
+    return pipeline
+
+
+# ------------------------------------------------------------------------------
+#
+def test_stream_chunk(tmpdir):
+    """
+    Test that a discovery chunk appends the stages of its images
+    """
+
+    component = make_executor()
+    component._generate_pipeline = _two_stage_pipeline
+    catalog = tmpdir.join('images0.csv')
+    catalog.write('Filename,Size\na.tif,1\nb.tif,2\nc.tif,3\n')
+
+    pipeline = radical.entk.Pipeline()
+    pipeline.name = 'Disc0'
+    stage = radical.entk.Stage()
+    stage.name = 'Disc0.S0'
+    task = radical.entk.Task()
+    task.executable = 'python'
+    stage.add_tasks(task)
+    pipeline.add_stages(stage)
+
+    callback = component._stream_chunk(pipeline, str(catalog), ['test'])
+    callback()
+    assert len(pipeline.stages) == 3
+    assert [stage.name for stage in pipeline.stages] == ['Disc0.S0',
+                                                         'Disc0.S1',
+                                                         'Disc0.S2']
+    assert sorted(task.name for task in pipeline.stages[1].tasks) == \
+        sorted('Disc0.%s.S0.T0' % pipeline_name([image])
+               for image in ['a.tif', 'b.tif', 'c.tif'])
+    assert sorted(task.executable for task in pipeline.stages[2].tasks) == \
+        ['a.tif', 'b.tif', 'c.tif']
+
+    catalog.write('Filename,Size\n')
+    callback()
+    assert len(pipeline.stages) == 3
+
+
+# ------------------------------------------------------------------------------
+#
+def test_discover_images_local(tmpdir, monkeypatch):
+    """
+    Test that local discovery submits nothing
+    """
+
+    images = tmpdir.mkdir('images')
+    images.join('test.tif').write(b'0', mode='wb')
+    monkeypatch.chdir(tmpdir)
+
+    component = make_executor(_res_dict={'resource': 'local.localhost'},
+                              _data_input_path=str(images))
+
+    assert component._discovers_locally()
+    assert component._discover_images() == [
+        (str(images.join('test.tif')), 1)]
+    assert os.path.isfile(str(tmpdir.join('images.csv')))
+    component._app_manager.run.assert_not_called()
+
+    component._res_dict = {'resource': 'xsede.bridges2'}
+    assert not component._discovers_locally()
+    component._local_discovery = True
+    assert component._discovers_locally()
+
+
+# ------------------------------------------------------------------------------
+#
+def test_run_workflow_lpt():
+    """
+    Test that lpt packs images in lanes, and that max_pipelines caps the
+    pipelines in flight: the next lane runs when one completes
+    """
+
+    component = make_executor(_schedule='lpt', _slots=2, _max_pipelines=1)
+    component._discover_images = mock.Mock(return_value=[('a.tif', 1),
+                                                         ('b.tif', 5),
+                                                         ('c.tif', 4)])
+    component._generate_pipeline = mock.Mock(side_effect=_two_stage_pipeline)
+    workflows = list()
+    component._app_manager.run.side_effect = \
+        lambda: workflows.append(component._app_manager.workflow)
+
+    component._run_workflow()
+    assert len(workflows) == 1
+    lane = list(workflows[0])[0]
+    assert lane.name == 'L0'
+    assert [stage.name for stage in lane.stages] == \
+        ['%s.S%d' % (pipeline_name(['b.tif']), idx) for idx in range(2)]
+    # The second lane is built only when the first one completes
+    assert component._generate_pipeline.call_count == 1
+
+    lane.stages[-1].post_exec()
+    assert [stage.name for stage in lane.stages] == \
+        ['%s.S%d' % (pipeline_name([image]), idx)
+         for image in ['b.tif', 'c.tif', 'a.tif'] for idx in range(2)]
+    lane.stages[-1].post_exec()
+    assert len(lane.stages) == 6
+
+
+# ------------------------------------------------------------------------------
+#
+def test_run_workflow_batches():
+    """
+    Test that batching creates one pipeline per batch of images
+    """
+
+    component = make_executor(_batch_size=2)
+    component._discover_images = mock.Mock(return_value=[('a.tif', 1),
+                                                         ('b.tif', 5),
+                                                         ('c.tif', 4)])
+    component._generate_batch_pipeline = mock.Mock(side_effect=['b0', 'b1'])
+
+    component._run_workflow()
+    component._generate_batch_pipeline.assert_any_call(
+        name=pipeline_name(['a.tif', 'b.tif'], 'B'), pre_execs=[],
+        images=[('a.tif', 1), ('b.tif', 5)])
+    component._generate_batch_pipeline.assert_any_call(
+        name=pipeline_name(['c.tif'], 'B'), pre_execs=[],
+        images=[('c.tif', 4)])
+    assert component._app_manager.workflow == {'b0', 'b1'}
+
+
+# ------------------------------------------------------------------------------
+#
+def test_run_service_workflow():
+    """
+    Test that every GPU gets an inference worker and images are assigned to
+    the workers round robin
+    """
+
+    component = make_executor(_inference_service=True, _schedule='largest')
+    component._res_dict.update({'cpus': 6, 'gpus': 2})
+    component._slot_resources = mock.Mock(return_value=(1, 1))
+    component._discover_images = mock.Mock(return_value=[('a.tif', 1),
+                                                         ('b.tif', 5),
+                                                         ('c.tif', 4)])
+    component._generate_worker_pipeline = mock.Mock(side_effect=['w0', 'w1'])
+    component._generate_service_pipeline = mock.Mock(side_effect=['p1', 'p0',
+                                                                  'p2'])
+
+    component._run_workflow()
+    component._generate_worker_pipeline.assert_any_call(name='W0',
+                                                        pre_execs=[], items=2)
+    component._generate_worker_pipeline.assert_any_call(name='W1',
+                                                        pre_execs=[], items=1)
+    component._generate_service_pipeline.assert_any_call(
+        name=pipeline_name(['b.tif']), pre_execs=[], image='b.tif',
+        image_size=5, worker='W0.S0.T0')
+    component._generate_service_pipeline.assert_any_call(
+        name=pipeline_name(['a.tif']), pre_execs=[], image='a.tif',
+        image_size=1, worker='W0.S0.T0')
+    component._generate_service_pipeline.assert_any_call(
+        name=pipeline_name(['c.tif']), pre_execs=[], image='c.tif',
+        image_size=4, worker='W1.S0.T0')
+    assert component._app_manager.workflow == {'w0', 'w1', 'p0', 'p1', 'p2'}
+    component._app_manager.run.assert_called_once_with()
+
+    # Without cores for two lanes per worker, the images of a worker are
+    # analyzed one after the other
+    component._res_dict['cpus'] = 4
+    component._generate_worker_pipeline = mock.Mock(side_effect=['w0', 'w1'])
+    component._generate_service_pipeline = mock.Mock(side_effect=['p1', 'p0',
+                                                                  'p2'])
+    component._chain_pipelines = mock.Mock(return_value='l0')
+    component._run_workflow()
+    component._chain_pipelines.assert_called_once_with('W0L0', ['p1', 'p0'])
+    assert component._app_manager.workflow == {'w0', 'w1', 'l0', 'p2'}
+
+
+# ------------------------------------------------------------------------------
+#
+def test_run_workflow_penguins():
+    """
+    Test that Penguins analyzes gpu_concurrency images on every GPU, and
+    that its lanes are the ones of the executor
+    """
+
+    with mock.patch.object(Executor, '_create_app_manager'), \
+            mock.patch.object(radical.utils, 'Logger'):
+        component = Penguins('test', {'resource': 'my_resource',
+                                      'queue': None, 'walltime': 30,
+                                      'cpus': 4, 'gpus': 2},
+                             gpu_concurrency=2)
+        assert component._slots == 4
+        component = Penguins('test', {'resource': 'my_resource',
+                                      'queue': None, 'walltime': 30,
+                                      'cpus': 4, 'gpus': 2},
+                             gpu_concurrency=2, slots=3)
+        assert component._slots == 3
+
+    component = make_executor(cls=Penguins, _gpu_concurrency=2,
+                              _model_name='model', _epoch=300,
+                              _model_path='models', _output_path='out',
+                              _schedule='lpt', _slots=4)
+    component._discover_images = mock.Mock(return_value=[
+        ('a.png', 8), ('b.png', 1), ('c.png', 2), ('d.png', 3), ('e.png', 4),
+        ('f.png', 5)])
+
+    component._run_workflow()
+    lanes = sorted(component._app_manager.workflow, key=lambda p: p.name)
+    assert [lane.name for lane in lanes] == ['L0', 'L1', 'L2', 'L3']
+    for lane in lanes:
+        tasks = [task for stage in lane.stages for task in stage.tasks]
+        assert all(task.gpu_reqs['gpu_processes'] == 0.5 for task in tasks)
+        assert all(task.arguments[:2] == ['--gpu_ids', '0']
+                   for task in tasks)
+        assert all(not task.tags for task in tasks)
+    assert [stage.name for stage in lanes[0].stages] == \
+        ['%s.S0' % pipeline_name(['a.png'])]
+
+
+# ------------------------------------------------------------------------------
+#
+def test_seals_fused_pipeline():
+    """
+    Test that a fused Seals pipeline tiles and predicts in a single task
+    """
+
+    component = make_executor(cls=Seals, _fused=True, _bands='0', _stride=1,
+                              _patch_size=224, _geotiff=0,
+                              _model_arch='UnetCntWRN', _hyperparam='A',
+                              _model_name='model')
+    pipeline = component._generate_pipeline('P0', ['pre'], '/data/a.tif', 5)
+    assert len(pipeline.stages) == 1
+    task = list(pipeline.stages[0].tasks)[0]
+    assert task.name == 'P0.S0.T0'
+    assert task.executable == 'python'
+    assert task.arguments[:2] == ['tile_stream.py',
+                                  '--tiles=/dev/shm/P0.S0.T0']
+    assert '--predict=--output_dir=./a' in task.arguments
+    assert not any(arg.startswith('--predict=--input_dir')
+                   for arg in task.arguments)
+    tiler = task.arguments[task.arguments.index('--') + 1:]
+    assert tiler[:2] == ['iceberg_seals.tiling', '--input_image=a.tif']
+    assert not any(arg.startswith('--output_folder') for arg in tiler)
+    assert task.link_input_data == ['/data/a.tif', '$SHARED/model']
+    assert task.gpu_reqs['gpu_processes'] == 1
+    assert task.lfs_per_process == 0
+
+
+# ------------------------------------------------------------------------------
+#
+def test_seals_model_cache(tmpdir):
+    """
+    Test that Seals tasks read their model from a verified node local copy
+    """
+
+    tmpdir.join('model').write('weights')
+    component = make_executor(cls=Seals, _model_cache=True, _fused=False,
+                              _bands='0', _stride=1, _patch_size=224,
+                              _geotiff=0, _model_arch='UnetCntWRN',
+                              _hyperparam='A', _model_name='model',
+                              _model_path='%s/' % tmpdir)
+    pipeline = component._generate_pipeline('P0', ['pre'], '/data/a.tif', 5)
+    task = list(pipeline.stages[1].tasks)[0]
+    assert task.pre_exec[0] == 'pre'
+    command = task.pre_exec[1].split()
+    assert command[:2] == ['python', 'model_cache.py']
+    assert command[2] == '--source=$RP_PILOT_SANDBOX/model'
+    assert command[3].startswith('--target=$NODE_LFS_PATH/iceberg_models/')
+    assert command[4] == '--sha256=%s' % sha256sum(str(tmpdir.join('model')))
+    target = command[3].split('=', 1)[1]
+    assert '--models_folder=%s/' % os.path.dirname(target) in task.arguments
+    assert not task.link_input_data
+    assert [os.path.basename(path) for path in task.upload_input_data] == \
+        ['model_cache.py']
+
+
+# ------------------------------------------------------------------------------
+#
+def test_seals_prefetch():
+    """
+    Test that the tiling tasks of a lane read their scenes from node local
+    storage and prefetch the next scenes of the lane, and that every task of
+    the lane is colocated with it
+    """
+
+    component = make_executor(cls=Seals, _schedule='lpt', _slots=1,
+                              _prefetch=2, _prefetch_mb=4, _fused=False,
+                              _bands='0', _stride=1, _patch_size=224,
+                              _geotiff=0, _model_arch='UnetCntWRN',
+                              _hyperparam='A', _model_name='model')
+
+    component._run_images([('/d/a.tif', 4), ('/d/b.tif', 3), ('/d/c.tif', 2),
+                           ('/d/e.tif', 1)])
+    lane = list(component._app_manager.workflow)[0]
+    tilings = [list(stage.tasks)[0] for stage in lane.stages[::2]]
+    folder = '$NODE_LFS_PATH/iceberg_prefetch/L0'
+    assert [task.pre_exec[-1] for task in tilings] == [
+        'python prefetch.py --folder=%s --budget=4 %s' % (folder, images)
+        for images in ['/d/a.tif /d/b.tif', '/d/b.tif /d/c.tif /d/e.tif',
+                       '/d/c.tif /d/e.tif', '/d/e.tif']]
+    assert tilings[0].post_exec == [
+        'python prefetch.py --folder=%s --release /d/a.tif' % folder]
+    assert tilings[-1].post_exec == [
+        'python prefetch.py --folder=%s --sweep /d/e.tif' % folder]
+    assert [task.lfs_per_process for task in tilings] == [11, 9, 5, 2]
+    assert all(task.tags == {'colocate': 'L0'} for task in tilings)
+    assert all(not task.link_input_data for task in tilings)
+    assert tilings[0].arguments[0] == '--input_image=a.tif'
+    assert all(task.tags == {'colocate': 'L0'}
+               for stage in lane.stages for task in stage.tasks)
+
+    component = make_executor(cls=Seals, _prefetch=2, _fused=False,
+                              _bands='0', _stride=1, _patch_size=224,
+                              _geotiff=0, _model_arch='UnetCntWRN',
+                              _hyperparam='A', _model_name='model')
+    pipeline = component._generate_pipeline('P0', ['pre'], '/d/a.tif', 5)
+    task = list(pipeline.stages[0].tasks)[0]
+    assert task.pre_exec[-1] == 'python prefetch.py --folder=' \
+        '$NODE_LFS_PATH/iceberg_prefetch/P0 /d/a.tif'
+    assert task.lfs_per_process == 10
+
+
+# ------------------------------------------------------------------------------
+#
+def test_seals_tiles_lfs(tmpdir):
+    """
+    Test that the tiling task asks for the estimated size of the tiles of an
+    image, and for its size when the catalog has no raster header
+    """
+
+    catalog = str(tmpdir.join('images.csv'))
+    write_catalog(catalog, {'Filename': ['/d/a.tif', '/d/b.tif'],
+                            'Size': [40, 60],
+                            'Width': [10000, None],
+                            'Height': [8000, None],
+                            'Bands': [4, None],
+                            'Dtype': ['uint16', None]})
+    component = make_executor(cls=Seals, _catalog=catalog, _fused=False,
+                              _bands='0', _stride=1, _patch_size=224,
+                              _geotiff=0, _model_arch='UnetCntWRN',
+                              _hyperparam='A', _model_name='model')
+
+    pipeline = component._generate_pipeline('P0', ['pre'], '/d/a.tif', 40)
+    assert list(pipeline.stages[0].tasks)[0].lfs_per_process == 159
+    pipeline = component._generate_pipeline('P1', ['pre'], '/d/b.tif', 60)
+    assert list(pipeline.stages[0].tasks)[0].lfs_per_process == 60
+    assert component._tiling_task('B0.S0.T0', ['pre'], '/d/a.tif',
+                                  40).lfs_per_process == 159
+
+    component._prefetch = 1
+    component._factories = dict()
+    pipeline = component._generate_pipeline('P0', ['pre'], '/d/a.tif', 40)
+    assert list(pipeline.stages[0].tasks)[0].lfs_per_process == 199
+    pipeline = component._generate_pipeline('P1', ['pre'], '/d/b.tif', 60)
+    assert list(pipeline.stages[0].tasks)[0].lfs_per_process == 120
+
+    component._fused = True
+    component._factories = dict()
+    assert component._tiles_mb('/d/a.tif') is None
+
+
+# ------------------------------------------------------------------------------
+#
+def test_seals_overlap():
+    """
+    Test that the tiling of the next image of a lane runs next to the
+    prediction of the current one, and that every image is journaled as
+    completed with the stage of its prediction
+    """
+
+    component = make_executor(cls=Seals, _schedule='lpt', _slots=1,
+                              _overlap=True, _fused=False, _bands='0',
+                              _stride=1, _patch_size=224, _geotiff=0,
+                              _model_arch='UnetCntWRN', _hyperparam='A',
+                              _model_name='model')
+    component._journal = mock.MagicMock()
+
+    component._run_images([('/d/a.tif', 3), ('/d/b.tif', 2), ('/d/c.tif', 1)])
+    lane = list(component._app_manager.workflow)[0]
+    assert [stage.name for stage in lane.stages] == [
+        'L0.S0', 'L0.S1', 'L0.S2', 'L0.S3']
+    assert [sorted(task.name.split('.')[1] for task in stage.tasks)
+            for stage in lane.stages] == [['S0'], ['S0', 'S1'], ['S0', 'S1'],
+                                          ['S1']]
+    assert lane.stages[0].post_exec is None
+
+    for stage in lane.stages[1:]:
+        for task in stage.tasks:
+            task.state = radical.entk.states.DONE
+        component._journal.record.reset_mock()
+        stage.post_exec()
+        assert component._journal.record.call_count == 1
+    component._journal.record.assert_called_with(
+        ['/d/c.tif'], pipeline_name(['/d/c.tif']), DONE)
+
+
+# ------------------------------------------------------------------------------
+#
+def test_seals_results_index():
+    """
+    Test that the task that writes the predictions of an image adds them to
+    the results index
+    """
+
+    component = make_executor(cls=Seals, _results_index='/shared/seals.csv',
+                              _fused=False, _bands='0', _stride=1,
+                              _patch_size=224, _geotiff=0,
+                              _model_arch='UnetCntWRN', _hyperparam='A',
+                              _model_name='model')
+    pipeline = component._generate_pipeline('P0', ['pre'], '/d/a.tif', 5)
+    tiling, predicting = [list(stage.tasks)[0] for stage in pipeline.stages]
+    assert not tiling.post_exec
+    assert predicting.post_exec == [
+        "python reducer.py --index=/shared/seals.csv --kind=seals "
+        "--image=/d/a.tif --task=P0.S1.T1 '--results=./a/*'"]
+    assert 'reducer.py' in [os.path.basename(path)
+                            for path in predicting.upload_input_data]
+
+    pipeline = component._generate_batch_pipeline(
+        'B0', ['pre'], [('/d/a.tif', 5), ('/d/b.tif', 3)])
+    batch = list(pipeline.stages[1].tasks)[0]
+    assert [command.split()[4] for command in batch.post_exec] == \
+        ['--image=/d/a.tif', '--image=/d/b.tif']
+    assert batch.post_exec[1].endswith("--task=B0.S1.T0 '--results=./b/*'")
+    # The jobs are written to a temporary folder that the run removes
+    jobs_file = os.path.join(component._batches, 'B0.S1.T0.json')
+    assert jobs_file in batch.upload_input_data
+    component._run_workflow = mock.Mock()
+    component.run()
+    assert not os.path.exists(component._batches)
+
+    # With the inference service, the worker writes the Seals predictions in
+    # its own sandbox, while the Rivers mosaics are written by the pipeline
+    pipeline = component._generate_service_pipeline('P0', ['pre'],
+                                                    '/d/a.tif', 5, 'W0.S0.T0')
+    assert not any(task.post_exec for stage in pipeline.stages
+                   for task in stage.tasks)
+    rivers = make_executor(cls=Rivers, _results_index='/shared/rivers.csv',
+                           _fused=False, _tile_size=224, _step=112,
+                           _weights_path='weights.h5')
+    pipeline = rivers._generate_service_pipeline('P0', ['pre'], '/d/a.tif',
+                                                 5, 'W0.S0.T0')
+    mosaic = list(pipeline.stages[-1].tasks)[0]
+    assert '--index=/shared/rivers.csv' in mosaic.post_exec[-1]
+
+
+# ------------------------------------------------------------------------------
+#
+def test_rivers_fused_pipeline():
+    """
+    Test that a fused Rivers pipeline stitches the mosaic in its prediction
+    task
+    """
+
+    component = make_executor(cls=Rivers, _fused=True, _tile_size=224,
+                              _step=112, _weights_path='weights.h5')
+    pipeline = component._generate_pipeline('P0', ['pre'], '/data/a.tif', 5)
+    assert [stage.name for stage in pipeline.stages] == ['P0.S0', 'P0.S1']
+    task = list(pipeline.stages[1].tasks)[0]
+    assert task.name == 'P0.S1.T1'
+    assert task.arguments[:3] == ['tile_stream.py',
+                                  '--tiles=/dev/shm/P0.S1.T1',
+                                  '--module=mosaic_accumulator']
+    assert '--predict=--tiles=$NODE_LFS_PATH/P0.S0.T0/' in task.arguments
+    assert '--predict=--output=./a_mosaic.tif' in task.arguments
+    producer = task.arguments[task.arguments.index('--') + 1:]
+    assert producer == ['iceberg_rivers.predicting',
+                        '--input=$NODE_LFS_PATH/P0.S0.T0/',
+                        '--weights_path=weights.h5']
+    assert sorted(os.path.basename(kernel)
+                  for kernel in task.upload_input_data) == \
+        ['image_disc.py', 'inference_worker.py', 'mosaic_accumulator.py',
+         'tile_stream.py']
+    assert all(os.path.exists(kernel) for kernel in task.upload_input_data)
+    assert task.tags == {'colocate': 'P0.S0.T0'}
+
+
+# ------------------------------------------------------------------------------
+#
+def test_multi_executor():
+    """
+    Test that several use cases discover their images once and run their
+    pipelines together in one allocation
+    """
+
+    seals = make_executor(cls=Seals, _fused=False, _bands='0', _stride=1,
+                          _patch_size=224, _geotiff=0,
+                          _model_arch='UnetCntWRN', _hyperparam='A',
+                          _model_name='model.h5', _model_path='/models/',
+                          _max_pipelines=1)
+    rivers = make_executor(cls=Rivers, _fused=False, _tile_size=224,
+                           _step=112, _weights_path='weights.h5')
+    seals._discover_images = mock.Mock(return_value=[('/d/a.tif', 2),
+                                                     ('/d/b.tif', 1)])
+    app_manager = seals._app_manager
+    workflows = list()
+    app_manager.run.side_effect = \
+        lambda: workflows.append(app_manager.workflow)
+
+    MultiExecutor([seals, rivers]).run()
+    seals._discover_images.assert_called_once_with()
+    assert rivers._app_manager is app_manager
+    assert app_manager.shared_data == ['/models/model.h5']
+    assert [sorted(pipeline.name for pipeline in workflow)
+            for workflow in workflows] == \
+        [sorted(['SealsP%s' % pipeline_name(['/d/a.tif'])[1:]]
+                + ['RiversP%s' % pipeline_name([image])[1:]
+                   for image in ['/d/a.tif', '/d/b.tif']])]
+    tiling = list(list(workflows[0])[0].stages[0].tasks)[0]
+    assert tiling.name.startswith(list(workflows[0])[0].name)
+    app_manager.resource_terminate.assert_called_once_with()
+    # Seals runs one pipeline at a time, the next one is built when the
+    # first one completes
+    seals_pipeline = [pipeline for pipeline in workflows[0]
+                      if pipeline.name.startswith('Seals')][0]
+    seals_pipeline.stages[-1].post_exec()
+    assert seals_pipeline.stages[-1].name == \
+        'SealsP%s.S1' % pipeline_name(['/d/b.tif'])[1:]
+
+    with pytest.raises(ValueError):
+        MultiExecutor([seals, make_executor(cls=Penguins)])
+    with pytest.raises(ValueError):
+        MultiExecutor([seals, make_executor(cls=Rivers, _streaming=True)])
+    with pytest.raises(ValueError):
+        MultiExecutor([seals, make_executor(cls=Rivers, _target=60)])
+
+
+# ------------------------------------------------------------------------------
+#
+def test_run_workflow_resume(tmpdir):
+    """
+    Test that a resumed run submits only the images that did not complete,
+    and that the last stage of an image records it as completed
+    """
+
+    journal = Journal(str(tmpdir.join('journal.sqlite')))
+    journal.record(['a.tif'], pipeline_name(['a.tif']), DONE)
+    component = make_executor(_journal=journal, _resume=True)
+    component._discover_images = mock.Mock(return_value=[('a.tif', 1),
+                                                         ('b.tif', 5)])
+    component._generate_pipeline = _two_stage_pipeline
+
+    component._run_workflow()
+    pipeline, = component._app_manager.workflow
+    assert pipeline.name == pipeline_name(['b.tif'])
+    assert journal.states() == {'a.tif': DONE, 'b.tif': SUBMITTED}
+    for task in pipeline.stages[-1].tasks:
+        task.state = radical.entk.states.DONE
+    pipeline.stages[-1].post_exec()
+    assert journal.completed() == {'a.tif', 'b.tif'}
+
+
+# ------------------------------------------------------------------------------
+#
+def test_run_workflow_resume_failed(tmpdir):
+    """
+    Test that an image whose last stage has a failed task is recorded as
+    failed, and that a resumed run submits it again
+    """
+
+    journal = Journal(str(tmpdir.join('journal.sqlite')))
+    component = make_executor(_journal=journal, _resume=True)
+    component._discover_images = mock.Mock(return_value=[('a.tif', 1)])
+    component._generate_pipeline = _two_stage_pipeline
+
+    component._run_workflow()
+    pipeline, = component._app_manager.workflow
+    for task in pipeline.stages[-1].tasks:
+        task.state = radical.entk.states.FAILED
+    pipeline.stages[-1].post_exec()
+    assert journal.states() == {'a.tif': FAILED}
+    assert journal.completed() == set()
+
+    component._app_manager = mock.MagicMock()
+    component._run_workflow()
+    pipeline, = component._app_manager.workflow
+    assert pipeline.name == pipeline_name(['a.tif'])
+
+
+# ------------------------------------------------------------------------------
+#
+def test_discover_images_resume(tmpdir, monkeypatch):
+    """
+    Test that a resumed run reuses the catalog of the previous run
+    """
+
+    monkeypatch.chdir(tmpdir)
+    tmpdir.join('images.csv').write('Filename,Size\na.tif,1\nb.tif,2\n')
+    component = make_executor(_resume=True)
+    component._discovery = mock.Mock()
+
+    assert component._discover_images() == [('a.tif', 1), ('b.tif', 2)]
+    assert component._catalog == 'images.csv'
+    component._discovery.assert_not_called()
+
+
+# ------------------------------------------------------------------------------
+#
+def test_commit_manifests():
+    """
+    Test that the manifests of a changed_only discovery are updated only when
+    every task succeeded
+    """
+
+    component = make_executor(_discovery_args={'manifests': '/manifests',
+                                               'changed_only': True})
+    component._discovery = mock.Mock()
+    component._discovers_locally = mock.Mock(return_value=False)
+    component._generate_pipeline = _two_stage_pipeline
+    component._run_images([('a.tif', 1)])
+    assert component._failed
+    component._commit_manifests()
+    component._discovery.return_value.generate_commit_pipe.assert_not_called()
+
+    component._failed = False
+    component._execute = mock.Mock()
+    component._commit_manifests()
+    component._discovery.return_value.generate_commit_pipe \
+        .assert_called_once_with('/manifests', 1)
+    component._execute.assert_called_once_with(set(
+        [component._discovery.return_value.generate_commit_pipe.return_value]))
+
+
+# ------------------------------------------------------------------------------
+#
+@mock.patch('iceberg.executor.executor.run_seconds', return_value=600)
+def test_run_parts(mocked_seconds, tmpdir):
+    """
+    Test that a planned run submits every part in its own pilot and updates
+    the throughput model from the task profiles
+    """
+
+    throughput = str(tmpdir.join('throughput.json'))
+    # One minute per MB
+    ThroughputModel([[1, 1, 60, 1]]).save(throughput, 'executor')
+    component = make_executor(_throughput=throughput, _slots=2)
+    component._res_dict['walltime'] = 20
+    component._discover_images = mock.Mock(return_value=[('a.tif', 10),
+                                                         ('b.tif', 20),
+                                                         ('c.tif', 5)])
+    component._create_app_manager = mock.Mock()
+    component._run_images = mock.Mock()
+
+    component._run_workflow()
+    assert component._run_images.call_args_list == \
+        [mock.call([('a.tif', 10), ('b.tif', 20)]), mock.call([('c.tif', 5)])]
+    names = [call[0][0] for call in
+             component._create_app_manager.call_args_list]
+    walltimes = [call[0][1]['walltime'] for call in
+                 component._create_app_manager.call_args_list]
+    assert names == ['test_name.part0', 'test_name.part1']
+    assert walltimes == [20, 7]
+    assert len(ThroughputModel.load(throughput, 'executor').runs) == 3
+    assert ThroughputModel.load(throughput, 'executor').runs[1][2] == 600
+    # Discovery ran locally, so only the pilots of the parts are released
+    assert component._create_app_manager.return_value.resource_terminate \
+        .call_count == 2
+
+    ThroughputModel([[1, 1, 60, 1]]).save(throughput, 'executor')
+    mocked_seconds.return_value = None
+    component._run_workflow()
+    assert len(ThroughputModel.load(throughput, 'executor').runs) == 1
+    mocked_seconds.return_value = 600
+
+    ThroughputModel([[1, 1, 60, 1]]).save(throughput, 'executor')
+    component._part = 1
+    component._create_app_manager.reset_mock()
+    component._run_images.reset_mock()
+    component._run_workflow()
+    component._run_images.assert_called_once_with([('c.tif', 5)])
+
+
+# ------------------------------------------------------------------------------
+#
+def test_size_allocation(tmpdir):
+    """
+    Test that the allocation is sized for the target completion time within
+    the requested resources
+    """
+
+    throughput = str(tmpdir.join('throughput.json'))
+    # One minute per MB
+    ThroughputModel([[1, 1, 60, 1]]).save(throughput, 'rivers')
+    component = make_executor(cls=Rivers, _fused=False, _tile_size=224,
+                              _step=112, _weights_path='weights.h5',
+                              _throughput=throughput, _target=30)
+    component._res_dict.update({'cpus': 16, 'gpus': 4, 'walltime': 120})
+    component._discover_images = mock.Mock(return_value=[
+        ('a.tif', 10), ('b.tif', 10), ('c.tif', 10), ('d.tif', 10)])
+    component._create_app_manager = mock.Mock()
+    component._run_images = mock.Mock()
+
+    assert component._slot_resources() == (4, 1)
+    component._run_workflow()
+    res_dict = component._create_app_manager.call_args[0][1]
+    assert (res_dict['cpus'], res_dict['gpus'], res_dict['walltime']) == \
+        (8, 2, 25)
+    assert component._slots == 2
+    assert len(component._run_images.call_args[0][0]) == 4
+    assert any('"walltime": 25' in str(call[0][-1])
+               for call in component._logger.info.call_args_list)
+
+    # A slot needs a GPU, so an allocation without GPUs fits none
+    component._res_dict.update({'cpus': 16, 'gpus': 0})
+    with pytest.raises(ValueError):
+        component._size_allocation([('a.tif', 10)])
+
+    component = make_executor(cls=Penguins, _gpu_concurrency=2,
+                              _model_name='model', _epoch=300,
+                              _model_path='models', _output_path='out')
+    assert component._slot_resources() == (1, 0.5)
+
+
+# ------------------------------------------------------------------------------
+#
+def test_run_profile(tmpdir, monkeypatch):
+    """
+    Test that a profiled run saves the RP tasks of its image pipelines and
+    its report
+    """
+
+    monkeypatch.chdir(tmpdir)
+    tmpdir.mkdir('re.session.test')
+    component = make_executor(_profile='profile')
+    component._app_manager.sid = 're.session.test'
+    component._discover_images = mock.Mock(return_value=[('a.tif', 1)])
+    component._generate_pipeline = mock.Mock(side_effect=_two_stage_pipeline)
+
+    def run():
+        for idx, pipeline in enumerate(component._app_manager.workflow):
+            for stage in pipeline.stages:
+                for task in stage.tasks:
+                    task.rts_uid = 'task.%06d' % idx
+                    idx += 1
+
+    component._app_manager.run.side_effect = run
+    component.run()
+    component._app_manager.resource_terminate.assert_called_once_with()
+
+    name = pipeline_name(['a.tif'])
+    with open('profile.tasks.json') as tasks_json:
+        tasks = json.load(tasks_json)
+    assert tasks['gpus'] == 1
+    assert tasks['pipelines'] == {name: [['a.tif', 1]]}
+    assert sorted(task['name'] for task in tasks['tasks']) == \
+        ['%s.S0.T0' % name, '%s.S1.T1' % name]
+    assert sorted(task['uid'] for task in tasks['tasks']) == \
+        ['task.000000', 'task.000001']
+    assert all(task['session'] == 're.session.test'
+               for task in tasks['tasks'])
+    assert os.path.exists('profile.json')
+    assert os.path.exists('profile.txt')
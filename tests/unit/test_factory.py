@@ -0,0 +1,90 @@
+"""
+Project: ICEBERG middleware Project
+Author: Ioannis Paraskevakos
+License: MIT
+Copyright: 2018-2019
+"""
+# pylint: disable=protected-access, unused-argument, unused-import
+
+import pytest
+
+from iceberg.executor.factory import PipelineFactory, Field
+from iceberg.executor.scheduler import pipeline_name
+
+
+TEMPLATE = [[{'name': 'T0',
+              'pre_exec': ['module load test_module'],
+              'executable': 'tiling',
+              'arguments': ['--input=%(basename)s',
+                            '--output=$NODE_LFS_PATH/%(task)s',
+                            '--rate=100%', '--note=100%%-%(stem)s'],
+              'link_input_data': ['%(image)s'],
+              'cpu_reqs': {'cpu_processes': 1, 'cpu_threads': 4,
+                           'cpu_process_type': None, 'cpu_thread_type': None},
+              'lfs_per_process': Field('image_size')}],
+            [{'name': 'T1',
+              'executable': 'predicting',
+              'arguments': ['--input=$NODE_LFS_PATH/%(T0)s',
+                            '--output=%(stem)s', '--gpu=%(gpu_id)s'],
+              'tags': {'colocate': '%(T0)s'}}]]
+
+
+# ------------------------------------------------------------------------------
+#
+def test_compile():
+    """
+    Test that only the attributes that change from image to image are
+    formatted
+    """
+
+    name, shared, templated = PipelineFactory.compile(TEMPLATE[0][0])
+    assert name == 'T0'
+    assert sorted(shared) == ['cpu_reqs', 'executable', 'pre_exec']
+    assert shared['pre_exec'] is TEMPLATE[0][0]['pre_exec']
+    assert [key for key, _ in templated] == ['arguments', 'link_input_data',
+                                             'lfs_per_process']
+
+
+# ------------------------------------------------------------------------------
+#
+def test_pipeline():
+    """
+    Test building the pipeline of an image from a template
+    """
+
+    factory = PipelineFactory(TEMPLATE)
+    pipeline = factory.pipeline('P3', '/data/image.tif', 12, gpu_id=1)
+    assert pipeline.name == 'P3'
+    assert [stage.name for stage in pipeline.stages] == ['P3.S0', 'P3.S1']
+    task0 = list(pipeline.stages[0].tasks)[0]
+    task1 = list(pipeline.stages[1].tasks)[0]
+    assert task0.name == 'P3.S0.T0'
+    assert task0.arguments == ['--input=image.tif',
+                               '--output=$NODE_LFS_PATH/P3.S0.T0',
+                               '--rate=100%', '--note=100%-image']
+    assert task0.link_input_data == ['/data/image.tif']
+    assert task0.lfs_per_process == 12
+    assert task0.pre_exec == ['module load test_module']
+    assert task1.name == 'P3.S1.T1'
+    assert task1.arguments == ['--input=$NODE_LFS_PATH/P3.S0.T0',
+                               '--output=image', '--gpu=1']
+    assert task1.tags == {'colocate': 'P3.S0.T0'}
+
+    with pytest.raises(KeyError):
+        factory.pipeline('P3', '/data/image.tif', 12)
+
+
+# ------------------------------------------------------------------------------
+#
+def test_pipelines():
+    """
+    Test that pipelines are built lazily from a catalog
+    """
+
+    factory = PipelineFactory(TEMPLATE[:1])
+    pipelines = factory.pipelines([('a.tif', 1), ('b.tif', 2)])
+    assert not isinstance(pipelines, list)
+    assert [pipeline.name for pipeline in pipelines] == \
+        [pipeline_name(['a.tif']), pipeline_name(['b.tif'])]
+    pipelines = factory.pipelines([('a.tif', 1)], names=['Q7'])
+    assert [pipeline.name for pipeline in pipelines] == ['Q7']
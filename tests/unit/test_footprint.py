@@ -0,0 +1,69 @@
+"""
+Project: ICEBERG middleware Project
+Author: Ioannis Paraskevakos
+License: MIT
+Copyright: 2018-2019
+"""
+# pylint: disable=protected-access, unused-argument, unused-import
+
+from iceberg.executor.footprint import (itemsize, tile_count, tiles_bytes,
+                                        tiles_mb, BLOCK_SIZE)
+
+
+# ------------------------------------------------------------------------------
+#
+def test_itemsize():
+    """
+    Test the sample sizes of raster data types
+    """
+
+    assert itemsize('uint8') == 1
+    assert itemsize('uint16') == 2
+    assert itemsize('float32') == 4
+    assert itemsize('float64') == 8
+    assert itemsize(None) == 1
+
+
+# ------------------------------------------------------------------------------
+#
+def test_tile_count():
+    """
+    Test that tiles cover the raster, and that overlapping tiles multiply
+    """
+
+    assert tile_count(100, 100, 224, 224) == 1
+    assert tile_count(448, 224, 224, 224) == 2
+    assert tile_count(449, 224, 224, 224) == 3
+    assert tile_count(448, 448, 224, 112) == 9
+
+
+# ------------------------------------------------------------------------------
+#
+def test_tiles_bytes():
+    """
+    Test that every tile takes whole blocks, and grows with the bands, the
+    data type and the geotransform
+    """
+
+    assert tiles_bytes(448, 448, 1, 'uint8', 224, 224) == \
+        4 * 13 * BLOCK_SIZE
+    assert tiles_bytes(448, 448, 3, 'uint16', 224, 224) == \
+        4 * 74 * BLOCK_SIZE
+    assert tiles_bytes(448, 448, 1, 'uint8', 224, 112) == \
+        9 * 13 * BLOCK_SIZE
+    assert tiles_bytes(448, 448, 1, 'uint8', 56, 56, geotiff=True) > \
+        tiles_bytes(448, 448, 1, 'uint8', 56, 56)
+
+
+# ------------------------------------------------------------------------------
+#
+def test_tiles_mb():
+    """
+    Test the MBs of the tiles of an image from its raster header
+    """
+
+    raster = {'Width': 10000, 'Height': 8000, 'Bands': 4, 'Dtype': 'uint16'}
+    assert tiles_mb(raster, 224, 224, bands=1) == 159
+    assert tiles_mb(raster, 224, 224) == 627
+    assert tiles_mb({'Width': None, 'Height': None}, 224, 224) is None
+    assert tiles_mb(None, 224, 224) is None
@@ -7,10 +7,47 @@ Copyright: 2018-2019
 # pylint: disable=protected-access, unused-argument, unused-import
 
 import os
-import random
+import struct
+import zlib
 import mock
+import pytest
 import pandas as pd
-from iceberg.discovery import image_discovery
+from iceberg.discovery import image_discovery, raster_header, load_catalog
+from iceberg.discovery.image_disc import commit_manifest
+
+
+# ------------------------------------------------------------------------------
+#
+def write_tiff(filepath, width, height, bands=1, bits=8, sample_format=1,
+               nodata=None):
+    """
+    Writes the header of a little endian GeoTIFF without pixel data
+    """
+
+    scale = struct.pack('<3d', 0.5, 0.5, 0.0)
+    tiepoint = struct.pack('<6d', 0.0, 0.0, 0.0, 100.0, 200.0, 0.0)
+    entries = [(256, 4, 1, struct.pack('<I', width)),
+               (257, 4, 1, struct.pack('<I', height)),
+               (258, 3, 1, struct.pack('<HH', bits, 0)),
+               (277, 3, 1, struct.pack('<HH', bands, 0)),
+               (339, 3, 1, struct.pack('<HH', sample_format, 0)),
+               (33550, 12, 3, scale),
+               (33922, 12, 6, tiepoint)]
+    if nodata is not None:
+        entries.append((42113, 2, len(nodata) + 1, nodata.encode() + b'\0'))
+    offset = 8 + 2 + 12 * len(entries) + 4
+    ifd = struct.pack('<H', len(entries))
+    data = b''
+    for tag, ftype, count, payload in entries:
+        if len(payload) <= 4:
+            ifd += struct.pack('<HHI', tag, ftype, count) + \
+                payload.ljust(4, b'\0')
+        else:
+            ifd += struct.pack('<HHII', tag, ftype, count, offset + len(data))
+            data += payload
+    ifd += struct.pack('<I', 0)
+    with open(filepath, 'wb') as tiff:
+        tiff.write(b'II*\0' + struct.pack('<I', 8) + ifd + data)
 
 # ------------------------------------------------------------------------------
 #
@@ -69,3 +106,209 @@ def test_image_discovery_3(mocked_glob, mocked_getsize):
     assert test.equals(expected_values)
 
     os.remove('list.csv')
+
+
+# ------------------------------------------------------------------------------
+#
+def test_image_discovery_scandir(tmpdir):
+    """
+    Test the scandir walk, with and without recursion and threads
+    """
+
+    tmpdir.join('test1.tif').write(b'0' * 1048576, mode='wb')
+    tmpdir.join('test2.tif').write(b'0' * 10, mode='wb')
+    tmpdir.join('test3.png').write(b'0', mode='wb')
+    tmpdir.join('.hidden.tif').write(b'0', mode='wb')
+    tmpdir.mkdir('sub').join('test4.tif').write(b'0' * 2097152, mode='wb')
+    path = str(tmpdir)
+    filename = str(tmpdir.join('list'))
+
+    image_discovery(path=path, filename=filename, filesize=True,
+                    walk='scandir')
+    test = pd.read_csv(filename + '.csv')
+    expected_values = pd.DataFrame(columns=['Filename', 'Size'],
+                                   data=[[path + '/test1.tif', 1],
+                                         [path + '/test2.tif', 1]])
+    assert test.equals(expected_values)
+
+    image_discovery(path=path, filename=filename, filesize=True,
+                    walk='scandir', recursive=True, threads=4)
+    test = pd.read_csv(filename + '.csv')
+    expected_values = pd.DataFrame(columns=['Filename', 'Size'],
+                                   data=[[path + '/sub/test4.tif', 2],
+                                         [path + '/test1.tif', 1],
+                                         [path + '/test2.tif', 1]])
+    assert test.equals(expected_values)
+
+    image_discovery(path=path, filename=filename, walk='scandir',
+                    recursive=True, threads=2)
+    test = pd.read_csv(filename + '.csv')
+    assert list(test.columns) == ['Filename']
+    assert len(test) == 3
+
+
+# ------------------------------------------------------------------------------
+#
+def test_image_discovery_manifest(tmpdir):
+    """
+    Test that a manifest lists only new or changed images, and that it is
+    updated only when the listed images are committed as analyzed
+    """
+
+    images = tmpdir.mkdir('images')
+    images.join('test1.tif').write(b'0' * 10, mode='wb')
+    images.join('test2.tif').write(b'0' * 10, mode='wb')
+    path = str(images)
+    filename = str(tmpdir.join('list'))
+    manifest = str(tmpdir.join('manifests', 'images.csv'))
+
+    with pytest.raises(ValueError):
+        image_discovery(path=path, filename=filename, changed_only=True)
+
+    image_discovery(path=path, filename=filename, filesize=True,
+                    manifest=manifest, changed_only=True)
+    test = pd.read_csv(filename + '.csv')
+    assert list(test['Filename']) == [path + '/test1.tif',
+                                      path + '/test2.tif']
+    assert not os.path.exists(manifest)
+
+    # A run that did not complete lists the same images again
+    image_discovery(path=path, filename=filename, filesize=True,
+                    manifest=manifest, changed_only=True)
+    assert len(pd.read_csv(filename + '.csv')) == 2
+    assert commit_manifest(manifest)
+    assert not commit_manifest(manifest)
+    manifest_df = pd.read_csv(manifest)
+    assert list(manifest_df.columns) == ['Filename', 'Size', 'Mtime', 'Hash']
+    assert list(manifest_df['Size']) == [10, 10]
+
+    image_discovery(path=path, filename=filename, filesize=True,
+                    manifest=manifest, changed_only=True, walk='scandir')
+    test = pd.read_csv(filename + '.csv')
+    assert test.empty
+
+    images.join('test2.tif').write(b'1' * 20, mode='wb')
+    images.join('test3.tif').write(b'0' * 10, mode='wb')
+    image_discovery(path=path, filename=filename, filesize=True,
+                    manifest=manifest, changed_only=True, checksum=True)
+    test = pd.read_csv(filename + '.csv')
+    assert list(test['Filename']) == [path + '/test2.tif',
+                                      path + '/test3.tif']
+    commit_manifest(manifest)
+
+    # Touching a file without changing its content is not a change when
+    # the manifest keeps hashes.
+    os.utime(path + '/test1.tif', ns=(0, 0))
+    image_discovery(path=path, filename=filename, filesize=True,
+                    manifest=manifest, changed_only=True, checksum=True)
+    test = pd.read_csv(filename + '.csv')
+    assert test.empty
+
+    images.join('test1.tif').write(b'1' * 10, mode='wb')
+    image_discovery(path=path, filename=filename, filesize=True,
+                    manifest=manifest, changed_only=True, checksum=True)
+    test = pd.read_csv(filename + '.csv')
+    assert list(test['Filename']) == [path + '/test1.tif']
+
+
+# ------------------------------------------------------------------------------
+#
+def test_image_discovery_shards(tmpdir):
+    """
+    Test that shards split a path without overlaps or gaps
+    """
+
+    for idx in range(20):
+        tmpdir.join('test%d.tif' % idx).write(b'0', mode='wb')
+        tmpdir.mkdir('sub%d' % idx).join('test.tif').write(b'0', mode='wb')
+    path = str(tmpdir)
+    filename = str(tmpdir.join('list'))
+
+    with pytest.raises(ValueError):
+        image_discovery(path=path, filename=filename, shard=3, shards=3)
+
+    for walk in ['glob', 'scandir']:
+        found = list()
+        for shard in range(3):
+            image_discovery(path=path, filename=filename, walk=walk,
+                            recursive=True, shard=shard, shards=3)
+            test = pd.read_csv(filename + '.csv')
+            assert 0 < len(test) < 40
+            found += list(test['Filename'])
+        assert len(found) == 40
+        assert len(set(found)) == 40
+
+
+# ------------------------------------------------------------------------------
+#
+def test_raster_header(tmpdir):
+    """
+    Test reading TIFF and PNG headers
+    """
+
+    tiff = str(tmpdir.join('test.tif'))
+    write_tiff(tiff, 1000, 500, bands=4, bits=16, nodata='-9999')
+    header = raster_header(tiff)
+    assert header == {'Width': 1000, 'Height': 500, 'Bands': 4,
+                      'Dtype': 'uint16',
+                      'Geotransform': (100.0, 0.5, 0.0, 200.0, 0.0, -0.5),
+                      'Nodata': -9999.0}
+
+    write_tiff(tiff, 10, 20, bits=32, sample_format=3)
+    header = raster_header(tiff)
+    assert header['Dtype'] == 'float32'
+    assert header['Bands'] == 1
+    assert header['Nodata'] is None
+
+    # A malformed nodata tag is skipped, the other values are kept
+    write_tiff(tiff, 10, 20, nodata='none')
+    header = raster_header(tiff)
+    assert header['Width'] == 10
+    assert header['Nodata'] is None
+
+    png = tmpdir.join('test.png')
+    ihdr = struct.pack('>IIBBBBB', 640, 480, 8, 6, 0, 0, 0)
+    png.write(b'\x89PNG\r\n\x1a\n' + struct.pack('>I', 13) + b'IHDR' + ihdr
+              + struct.pack('>I', zlib.crc32(b'IHDR' + ihdr)), mode='wb')
+    header = raster_header(str(png))
+    assert header == {'Width': 640, 'Height': 480, 'Bands': 4,
+                      'Dtype': 'uint8', 'Geotransform': None, 'Nodata': None}
+
+    other = tmpdir.join('test.jpg')
+    other.write(b'not a raster', mode='wb')
+    assert set(raster_header(str(other)).values()) == {None}
+
+    # Truncated and corrupt headers are like unknown files
+    with open(tiff, 'rb') as tiff_file:
+        content = tiff_file.read()
+    for corrupt in [content[:6], content[:12], b'MM\0*' + b'\xff' * 8,
+                    content[:8 + 2 + 12 * 7 + 4]]:
+        other.write(corrupt, mode='wb')
+        assert set(raster_header(str(other)).values()) == {None}
+
+
+# ------------------------------------------------------------------------------
+#
+@pytest.mark.parametrize('filetype', ['csv', 'npz'])
+def test_image_discovery_metadata(tmpdir, filetype):
+    """
+    Test that raster metadata are written in every catalog format
+    """
+
+    images = tmpdir.mkdir('images')
+    write_tiff(str(images.join('test1.tif')), 1000, 500, nodata='0')
+    write_tiff(str(images.join('test2.tif')), 20, 10, bands=3)
+    filename = str(tmpdir.join('list'))
+
+    image_discovery(path=str(images), filename=filename, filetype=filetype,
+                    filesize=True, metadata=True, walk='scandir', threads=2)
+    columns = load_catalog(filename + '.' + filetype)
+    assert columns['Filename'] == [str(images.join('test1.tif')),
+                                   str(images.join('test2.tif'))]
+    assert columns['Size'] == [1, 1]
+    assert columns['Width'] == [1000, 20]
+    assert columns['Height'] == [500, 10]
+    assert columns['Bands'] == [1, 3]
+    assert columns['Dtype'] == ['uint8', 'uint8']
+    assert columns['Geotransform'] == [(100.0, 0.5, 0.0, 200.0, 0.0, -0.5)] * 2
+    assert columns['Nodata'] == [0.0, None]
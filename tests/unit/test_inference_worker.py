@@ -0,0 +1,142 @@
+"""
+Project: ICEBERG middleware Project
+Author: Ioannis Paraskevakos
+License: MIT
+Copyright: 2018-2019
+"""
+# pylint: disable=protected-access, unused-argument, unused-import
+
+import os
+import json
+import threading
+import pytest
+
+from iceberg.executor.inference_worker import (push, wait, serve, load_model,
+                                               run_worker, worker_alive,
+                                               set_state, ResidentModel,
+                                               EntryPointModel, SERVING)
+
+
+STUB_MODEL = '''
+import sys
+
+LOADS = list()
+PREDICTIONS = list()
+
+
+def load_model():
+    LOADS.append('model')
+    return 'model'
+
+
+def predict(model, arguments):
+    if arguments == ['--input=fail']:
+        raise RuntimeError('stub failure')
+    PREDICTIONS.append((model, arguments))
+'''
+
+STUB_BROKEN_MODEL = '''
+def load_model():
+    raise IOError('no weights')
+
+
+def predict(model, arguments):
+    pass
+'''
+
+STUB_ENTRY_POINT = '''
+import sys
+
+CALLS = list()
+
+
+def main():
+    CALLS.append(sys.argv[1:])
+    if sys.argv[1:] == ['--input=fail']:
+        sys.exit(3)
+'''
+
+
+# ------------------------------------------------------------------------------
+#
+def test_serve(tmpdir, monkeypatch):
+    """
+    Test that a worker loads a stub model once and serves the jobs submitted
+    to its spool while it runs
+    """
+
+    tmpdir.join('stub_model.py').write(STUB_MODEL)
+    monkeypatch.syspath_prepend(str(tmpdir))
+    spool = str(tmpdir.join('spool'))
+    model = load_model('stub_model')
+    assert isinstance(model, ResidentModel)
+
+    push(spool, 'P0', ['--input=a'])
+    worker = threading.Thread(target=serve, args=(spool, model, 3),
+                              kwargs={'poll': 0.01})
+    worker.start()
+    push(spool, 'P1', ['--input=fail'])
+    push(spool, 'P2', ['--input=b'])
+    assert wait(spool, 'P0', timeout=10, poll=0.01) == 0
+    assert wait(spool, 'P1', timeout=10, poll=0.01) == 1
+    assert wait(spool, 'P2', timeout=10, poll=0.01) == 0
+    worker.join(10)
+    assert not worker.is_alive()
+
+    stub = model._module
+    assert stub.LOADS == ['model']
+    assert stub.PREDICTIONS == [('model', ['--input=a']),
+                                ('model', ['--input=b'])]
+    assert os.listdir(os.path.join(spool, 'incoming')) == []
+    assert os.listdir(os.path.join(spool, 'running')) == []
+    assert wait(spool, 'P3', timeout=0, poll=0.01) == 1
+
+
+# ------------------------------------------------------------------------------
+#
+def test_serve_entry_point(tmpdir, monkeypatch):
+    """
+    Test serving a module without a resident model and stopping when idle
+    """
+
+    tmpdir.join('stub_entry_point.py').write(STUB_ENTRY_POINT)
+    monkeypatch.syspath_prepend(str(tmpdir))
+    spool = str(tmpdir.join('spool'))
+    model = load_model('stub_entry_point')
+    assert isinstance(model, EntryPointModel)
+
+    push(spool, 'P0', ['--input=a'])
+    push(spool, 'P1', ['--input=fail'])
+    assert serve(spool, model, idle_timeout=0.05, poll=0.01) == 2
+    assert wait(spool, 'P0', timeout=0) == 0
+    assert wait(spool, 'P1', timeout=0) == 1
+
+
+# ------------------------------------------------------------------------------
+#
+def test_wait_worker_gone(tmpdir, monkeypatch):
+    """
+    Test that waiting for a job fails as soon as the worker could not load
+    its model, or its process is gone
+    """
+
+    tmpdir.join('stub_broken_model.py').write(STUB_BROKEN_MODEL)
+    monkeypatch.syspath_prepend(str(tmpdir))
+    spool = str(tmpdir.join('spool'))
+    assert worker_alive(spool) is None
+
+    push(spool, 'P0', ['--input=a'])
+    with pytest.raises(IOError):
+        run_worker(spool, 'stub_broken_model')
+    assert worker_alive(spool) is False
+    assert wait(spool, 'P0', timeout=10, poll=0.01) == 1
+
+    set_state(spool, SERVING)
+    assert worker_alive(spool)
+    with open(os.path.join(spool, 'worker.json')) as worker_json:
+        worker = json.load(worker_json)
+    worker['pid'] = 2 ** 22 + 1
+    with open(os.path.join(spool, 'worker.json'), 'w') as worker_json:
+        json.dump(worker, worker_json)
+    assert worker_alive(spool) is False
+    assert wait(spool, 'P0', timeout=10, poll=0.01) == 1
@@ -0,0 +1,48 @@
+"""
+Project: ICEBERG middleware Project
+Author: Ioannis Paraskevakos
+License: MIT
+Copyright: 2018-2019
+"""
+# pylint: disable=protected-access, unused-argument, unused-import
+
+from iceberg.executor.journal import Journal, DONE, SUBMITTED
+
+
+# ------------------------------------------------------------------------------
+#
+def test_journal(tmpdir):
+    """
+    Test that the journal keeps the state of every image across instances
+    and completed images stay completed
+    """
+
+    path = str(tmpdir.join('journal.sqlite'))
+    journal = Journal(path)
+    journal.record(['a.tif', 'b.tif'], 'B0', SUBMITTED)
+    journal.record(['a.tif'], 'B0', DONE)
+    assert journal.states() == {'a.tif': DONE, 'b.tif': SUBMITTED}
+
+    journal = Journal(path)
+    journal.record(['a.tif', 'c.tif'], 'B1', SUBMITTED)
+    assert journal.states() == {'a.tif': DONE, 'b.tif': SUBMITTED,
+                                'c.tif': SUBMITTED}
+    assert journal.completed() == {'a.tif'}
+
+
+# ------------------------------------------------------------------------------
+#
+def test_journal_use_cases(tmpdir):
+    """
+    Test that the use cases of a journal keep their own states
+    """
+
+    path = str(tmpdir.join('journal.sqlite'))
+    seals = Journal(path, 'seals')
+    seals.record(['a.tif', 'b.tif'], 'P0', DONE)
+    rivers = Journal(path, 'rivers')
+    rivers.record(['a.tif'], 'P1', SUBMITTED)
+
+    assert rivers.completed() == set()
+    assert rivers.states() == {'a.tif': SUBMITTED}
+    assert Journal(path, 'seals').completed() == {'a.tif', 'b.tif'}
@@ -0,0 +1,73 @@
+"""
+Project: ICEBERG middleware Project
+Author: Ioannis Paraskevakos
+License: MIT
+Copyright: 2018-2019
+"""
+# pylint: disable=protected-access, unused-argument, unused-import
+
+import os
+import threading
+import pytest
+
+from iceberg.executor.model_cache import fetch, sha256sum
+
+
+# ------------------------------------------------------------------------------
+#
+def test_fetch_file(tmpdir):
+    """
+    Test that a model is copied once and reused
+    """
+
+    source = tmpdir.join('model.h5')
+    source.write('weights')
+    target = str(tmpdir.join('node', 'cache', 'model.h5'))
+
+    assert fetch(str(source), target, sha256sum(str(source)))
+    with open(target) as copy:
+        assert copy.read() == 'weights'
+    with open('%s.sha256' % target) as marker:
+        assert marker.read() == sha256sum(str(source))
+    assert not fetch(str(source), target)
+
+    # A corrupted copy is replaced when it is verified
+    with open(target, 'w') as copy:
+        copy.write('corrupted')
+    assert not fetch(str(source), target)
+    assert fetch(str(source), target, verify=True)
+    with open(target) as copy:
+        assert copy.read() == 'weights'
+
+    # A copy of another model is replaced
+    source.write('new weights')
+    assert fetch(str(source), target, sha256sum(str(source)))
+
+    with pytest.raises(RuntimeError):
+        fetch(str(source), str(tmpdir.join('other.h5')), 'bad checksum')
+    assert not os.path.exists(str(tmpdir.join('other.h5')))
+
+
+# ------------------------------------------------------------------------------
+#
+def test_fetch_folder(tmpdir):
+    """
+    Test that a model folder is copied once by concurrent tasks
+    """
+
+    source = tmpdir.mkdir('penguins')
+    source.join('300_net_G.pth').write('generator')
+    source.mkdir('opts').join('opt.txt').write('options')
+    target = str(tmpdir.join('node', 'penguins'))
+
+    copied = list()
+    threads = [threading.Thread(target=lambda: copied.append(
+        fetch(str(source), target))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(copied) == [False, False, False, True]
+    assert sha256sum(target) == sha256sum(str(source))
+    with open(os.path.join(target, 'opts', 'opt.txt')) as copy:
+        assert copy.read() == 'options'
@@ -0,0 +1,129 @@
+"""
+Project: ICEBERG middleware Project
+Author: Ioannis Paraskevakos
+License: MIT
+Copyright: 2018-2019
+"""
+# pylint: disable=protected-access, unused-argument, unused-import
+
+import os
+
+import numpy as np
+import pytest
+
+from iceberg.executor.mosaic_accumulator import (MosaicAccumulator, ramp,
+                                                 tile_offset, load_model,
+                                                 predict, close)
+
+
+class _Writer():
+    """
+    Keeps the rows a mosaic writes
+    """
+
+    def __init__(self, height, width):
+        self.mosaic = np.full((height, width), np.nan)
+        self.writes = list()
+        self.closed = False
+
+    def __call__(self, rows, yoff):
+        self.mosaic[yoff:yoff + rows.shape[0]] = rows
+        self.writes.append((yoff, rows.shape[0]))
+
+    def close(self):
+        self.closed = True
+
+
+def _grid(height, width, tile_size, step):
+    """
+    Returns the offsets of the tiles of an image
+    """
+
+    return [(row, col) for row in range(0, height - tile_size + 1, step)
+            for col in range(0, width - tile_size + 1, step)]
+
+
+# ------------------------------------------------------------------------------
+#
+def test_tile_offset():
+    """
+    Test reading the position of a tile from its name
+    """
+
+    assert tile_offset('image_3_5.tif', 112) == (336, 560)
+    assert tile_offset('/tiles/image_3_5.npy', 112, pixels=True) == (3, 5)
+    assert tile_offset('image.tif', 112) is None
+
+
+# ------------------------------------------------------------------------------
+#
+def test_ramp():
+    """
+    Test the overlap weights of a tile
+    """
+
+    assert list(ramp(4, 0)) == [1, 1, 1, 1]
+    assert list(ramp(6, 2)) == pytest.approx([1 / 3, 2 / 3, 1, 1, 2 / 3,
+                                              1 / 3])
+
+
+# ------------------------------------------------------------------------------
+#
+def test_accumulator():
+    """
+    Test that overlapping tiles of an image stitch back to the image, one
+    window of rows at a time
+    """
+
+    image = np.random.RandomState(0).rand(10, 12).astype(np.float32)
+    writer = _Writer(10, 12)
+    offsets = _grid(10, 12, 4, 2)
+    accumulator = MosaicAccumulator(10, 12, 4, 2, writer, offsets)
+
+    for row, col in offsets:
+        accumulator.add(row, col, image[row:row + 4, col:col + 4])
+        if (row, col) == (0, 8):
+            assert writer.writes == [(0, 2)]
+            assert accumulator._sums.shape[0] == 2
+    assert accumulator.close() == 0
+    assert writer.closed
+    assert writer.mosaic == pytest.approx(image, abs=1e-5)
+    assert [yoff for yoff, _ in writer.writes] == [0, 2, 4, 6]
+
+    with pytest.raises(ValueError):
+        accumulator.add(0, 0, image[:4, :4])
+
+
+# ------------------------------------------------------------------------------
+#
+def test_predict(tmpdir):
+    """
+    Test stitching batches of predicted tiles in a .npy mosaic
+    """
+
+    image = np.arange(6 * 8, dtype=np.float32).reshape(6, 8)
+    tiles = tmpdir.mkdir('tiles')
+    offsets = _grid(6, 8, 4, 2)
+    for row, col in offsets:
+        tiles.join('img_%d_%d.tif' % (row // 2, col // 2)).write('')
+    batches = [tmpdir.mkdir('batch0'), tmpdir.mkdir('batch1')]
+    for idx, (row, col) in enumerate(offsets):
+        name = 'img_%d_%d.npy' % (row // 2, col // 2)
+        np.save(str(batches[idx % 2].join(name)),
+                image[row:row + 4, col:col + 4])
+    output = str(tmpdir.join('mosaic.npy'))
+    arguments = ['--tiles=%s' % tiles, '--image=img.tif',
+                 '--output=%s' % output, '--tile_size=4', '--step=2',
+                 '--height=6', '--width=8']
+
+    model = load_model()
+    for batch in batches:
+        predict(model, arguments + ['--batch=%s' % batch])
+        assert not os.listdir(str(batch))
+    close(model)
+    assert np.load(output) == pytest.approx(image)
+
+    model = load_model()
+    predict(model, arguments + ['--batch=%s' % tmpdir.mkdir('batch2')])
+    with pytest.raises(RuntimeError):
+        close(model)
@@ -0,0 +1,87 @@
+"""
+Project: ICEBERG middleware Project
+Author: Ioannis Paraskevakos
+License: MIT
+Copyright: 2018-2019
+"""
+# pylint: disable=protected-access, unused-argument, unused-import
+
+import pytest
+
+from iceberg.executor.planner import (ThroughputModel, plan_parts,
+                                      part_walltime, makespan, size_slots)
+
+
+# ------------------------------------------------------------------------------
+#
+def test_throughput_model(tmpdir):
+    """
+    Test fitting the throughput model on past runs
+    """
+
+    model = ThroughputModel()
+    assert not model.fitted()
+    assert model.estimate(100) == 0
+
+    # 10 seconds per image and 2 seconds per MB on one slot
+    model.add_run(10, 100, 300, 1)
+    model.add_run(20, 50, 75, 4)
+    assert model.seconds_per_image == pytest.approx(10)
+    assert model.seconds_per_mb == pytest.approx(2)
+    assert model.estimate(5) == pytest.approx(20)
+
+    path = str(tmpdir.join('throughput.json'))
+    model.save(path, 'seals')
+    ThroughputModel([[1, 0, 30, 1]]).save(path, 'rivers')
+    assert ThroughputModel.load(path, 'seals').estimate(5) == \
+        pytest.approx(20)
+    assert ThroughputModel.load(path, 'rivers').estimate(5) == \
+        pytest.approx(30)
+    assert not ThroughputModel.load(path, 'penguins').fitted()
+
+    # A single run is explained by the MBs alone
+    model = ThroughputModel([[10, 100, 100, 2]])
+    assert model.seconds_per_image == 0
+    assert model.seconds_per_mb == pytest.approx(2)
+
+
+# ------------------------------------------------------------------------------
+#
+def test_plan_parts():
+    """
+    Test splitting images in parts that fit in the walltime
+    """
+
+    # One minute per MB
+    model = ThroughputModel([[1, 1, 60, 1]])
+    images = [('a', 10), ('b', 20), ('c', 5), ('d', 40), ('e', 1)]
+    # 2 slots, 20 minutes, 20% margin: 32 slot minutes per part
+    parts = plan_parts(images, model, 2, 20)
+    assert parts == [[('a', 10), ('b', 20)], [('c', 5)], [('d', 40)],
+                     [('e', 1)]]
+    assert makespan(parts[0], model, 2) == pytest.approx(20 * 60)
+    assert part_walltime(parts[0], model, 2, 20) == 20
+    assert part_walltime(parts[1], model, 2, 20) == 7
+    assert part_walltime(parts[2], model, 2, 20) == 20
+
+    assert plan_parts(images, ThroughputModel(), 2, 20) == [images]
+    assert part_walltime(images, ThroughputModel(), 2, 20) == 20
+    assert plan_parts([], model, 2, 20) == []
+
+
+# ------------------------------------------------------------------------------
+#
+def test_size_slots():
+    """
+    Test choosing the fewest slots that meet a target completion time
+    """
+
+    # One minute per MB
+    model = ThroughputModel([[1, 1, 60, 1]])
+    images = [('a.tif', 10), ('b.tif', 10), ('c.tif', 10), ('d.tif', 10)]
+
+    assert size_slots(images, model, 30, 8) == (2, 25)
+    assert size_slots(images, model, 60, 8) == (1, 50)
+    assert size_slots(images, model, 5, 8) == (4, 13)
+    assert size_slots(images, model, 30, 1) == (1, 50)
+    assert size_slots(images, ThroughputModel(), 30, 8) == (4, None)
@@ -0,0 +1,111 @@
+"""
+Project: ICEBERG middleware Project
+Author: Ioannis Paraskevakos
+License: MIT
+Copyright: 2018-2019
+"""
+# pylint: disable=protected-access, unused-argument, unused-import
+
+import os
+import subprocess
+import pytest
+
+from iceberg.executor.prefetch import (local_path, prefetch, release, stage,
+                                       usage, sweep)
+
+
+def _scene(folder, name, megabytes):
+    """
+    Writes a scene of some MBs
+    """
+
+    scene = folder.join(name)
+    scene.write('x' * int(megabytes * 1024 * 1024))
+
+    return str(scene)
+
+
+# ------------------------------------------------------------------------------
+#
+def test_local_path():
+    """
+    Test that scenes with the same basename get different copies
+    """
+
+    assert local_path('/lfs', '/a/img.tif').endswith('_img.tif')
+    assert local_path('/lfs', '/a/img.tif') != \
+        local_path('/lfs', '/b/img.tif')
+
+
+# ------------------------------------------------------------------------------
+#
+def test_prefetch_budget(tmpdir):
+    """
+    Test that scenes are prefetched in order until the budget is full, that
+    released scenes free the budget, and that they are not prefetched again
+    """
+
+    data = tmpdir.mkdir('data')
+    scenes = [_scene(data, 'a.tif', 1), _scene(data, 'b.tif', 1),
+              _scene(data, 'c.tif', 1)]
+    folder = str(tmpdir.join('lfs', 'L0'))
+
+    copies = prefetch(scenes, folder, budget=2.5)
+    assert copies == [local_path(folder, scene) for scene in scenes[:2]]
+    assert usage(folder) == 2
+    assert prefetch(scenes[:2], folder, budget=2.5) == copies
+
+    release(scenes[0], folder)
+    assert not os.path.exists(copies[0])
+    assert prefetch(scenes[1:], folder, budget=2.5)[-1] == \
+        local_path(folder, scenes[2])
+    assert sorted(os.listdir(folder)) == sorted(
+        [os.path.basename(copies[0]) + suffix
+         for suffix in ['.lock', '.released']]
+        + [os.path.basename(local_path(folder, scene)) + suffix
+           for scene in scenes[1:] for suffix in ['', '.lock']])
+
+    assert prefetch(scenes, folder) == [local_path(folder, scene)
+                                        for scene in scenes[1:]]
+    assert not os.path.exists(copies[0])
+
+
+# ------------------------------------------------------------------------------
+#
+def test_stage(tmpdir, monkeypatch):
+    """
+    Test that the scene of a task is linked in its working directory
+    """
+
+    scene = _scene(tmpdir.mkdir('data'), 'a.tif', 0.001)
+    folder = str(tmpdir.join('lfs', 'L0'))
+    monkeypatch.chdir(tmpdir.mkdir('sandbox'))
+
+    stage([scene], folder)
+    stage([scene], folder)
+    assert os.readlink('a.tif') == local_path(folder, scene)
+    with open('a.tif') as local:
+        assert local.read() == 'x' * 1048
+
+
+# ------------------------------------------------------------------------------
+#
+def test_sweep(tmpdir):
+    """
+    Test that the sweep of a lane stops its prefetchers and removes its
+    folder
+    """
+
+    folder = tmpdir.join('lfs', 'L0')
+    folder.ensure(dir=True)
+    # A prefetcher outlives the task that started it, like this sleep
+    prefetcher = int(subprocess.check_output(
+        ['sh', '-c', 'sleep 60 > /dev/null 2>&1 & echo $!']))
+    folder.join('prefetcher.%d.pid' % prefetcher).write('')
+    folder.join('a.tif').write('x')
+
+    sweep(str(folder))
+    with pytest.raises(OSError):
+        os.kill(prefetcher, 0)
+    assert not folder.exists()
+    sweep(str(folder))
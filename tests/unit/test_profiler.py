@@ -0,0 +1,98 @@
+"""
+Project: ICEBERG middleware Project
+Author: Ioannis Paraskevakos
+License: MIT
+Copyright: 2018-2019
+"""
+# pylint: disable=protected-access, unused-argument, unused-import
+
+import json
+
+import pytest
+
+from iceberg.executor.profiler import (task_pipeline, write_tasks,
+                                       profile_run, write_report)
+
+PROFILE = """#time,event,comp,thread,uid,state,msg
+100.0,schedule_ok,agent_scheduling.0000,MainThread,task.000000,,
+100.0,staging_in_start,agent_staging_input.0000,MainThread,task.000000,,
+102.0,staging_in_stop,agent_staging_input.0000,MainThread,task.000000,,
+102.0,task_pre_start,agent_executing.0000,MainThread,task.000000,,
+103.0,task_pre_stop,agent_executing.0000,MainThread,task.000000,,
+103.0,rank_start,agent_executing.0000,MainThread,task.000000,,
+113.0,rank_stop,agent_executing.0000,MainThread,task.000000,,
+113.0,schedule_ok,agent_scheduling.0000,MainThread,task.000001,,
+113.0,task_pre_start,agent_executing.0000,MainThread,task.000001,,
+114.0,task_pre_stop,agent_executing.0000,MainThread,task.000001,,
+114.0,rank_start,agent_executing.0000,MainThread,task.000001,,
+124.0,rank_stop,agent_executing.0000,MainThread,task.000001,,
+110.0,schedule_ok,agent_scheduling.0000,MainThread,task.000002,,
+110.0,cu_exec_start,agent_executing.0000,MainThread,task.000002,,
+130.0,cu_exec_stop,agent_executing.0000,MainThread,task.000002,,
+90.0,rank_start,agent_executing.0000,MainThread,task.000009,,
+"""
+
+
+# ------------------------------------------------------------------------------
+#
+def test_task_pipeline():
+    """
+    Test splitting task names in their pipeline and stage
+    """
+
+    assert task_pipeline('P0123.S1.T1') == ('P0123', 'S1')
+    assert task_pipeline('Disc.0.P0123.S0.T0') == ('Disc.0.P0123', 'S0')
+    assert task_pipeline('task') == (None, None)
+    assert task_pipeline(None) == (None, None)
+
+
+# ------------------------------------------------------------------------------
+#
+def test_profile_run(tmpdir):
+    """
+    Test the report of a run from saved profiles
+    """
+
+    session = tmpdir.mkdir('re.session.test')
+    session.mkdir('pilot.0000').join('agent.0000.prof').write(PROFILE)
+    tasks = [{'session': 're.session.test', 'uid': 'task.000000',
+              'name': 'P1.S0.T0', 'gpus': 0},
+             {'session': 're.session.test', 'uid': 'task.000001',
+              'name': 'P1.S1.T1', 'gpus': 1},
+             {'session': 're.session.test', 'uid': 'task.000002',
+              'name': 'P2.S0.T0', 'gpus': 0},
+             {'session': 're.session.test', 'uid': 'task.000003',
+              'name': 'P3.S0.T0', 'gpus': 0}]
+    tasks_file = str(tmpdir.join('profile.tasks.json'))
+    write_tasks(tasks_file, 1, tasks, {'P1': [('a.tif', 10)],
+                                       'P2': [('b.tif', 30)],
+                                       'P3': [('c.tif', 5)]})
+
+    report = profile_run(tasks_file, [str(session)])
+    summary = report['summary']
+    assert summary['seconds'] == 30
+    assert summary['images'] == 2
+    assert summary['megabytes'] == 40
+    assert summary['tasks_without_profile'] == 1
+    assert summary['images_per_hour'] == pytest.approx(240)
+    assert summary['mb_per_second'] == pytest.approx(40 / 30)
+    assert summary['pre_exec_fraction'] == pytest.approx(2 / 44)
+    assert summary['gpu_idle_fraction'] == pytest.approx(2 / 3)
+    assert report['stages'] == {'S0': {'tasks': 2, 'staging': 2,
+                                       'pre_exec': 1, 'exec': 30},
+                                'S1': {'tasks': 1, 'staging': 0,
+                                       'pre_exec': 1, 'exec': 10}}
+    assert [(timeline['pipeline'], timeline['images'], timeline['start'],
+             timeline['stop']) for timeline in report['images']] == \
+        [('P1', ['a.tif'], 0, 24), ('P2', ['b.tif'], 10, 30)]
+    assert report['images'][0]['stages']['S1'] == {'staging': 0,
+                                                   'pre_exec': 1, 'exec': 10}
+
+    prefix = str(tmpdir.join('profile'))
+    write_report(report, prefix)
+    with open('%s.json' % prefix) as report_json:
+        assert json.load(report_json)['summary'] == summary
+    with open('%s.txt' % prefix) as report_txt:
+        text = report_txt.read()
+    assert '240.0 images/hour' in text
+    assert 'GPU slots idle:     66.7% of 1 GPUs' in text
@@ -0,0 +1,66 @@
+"""
+Project: ICEBERG middleware Project
+Author: Ioannis Paraskevakos
+License: MIT
+Copyright: 2018-2019
+"""
+# pylint: disable=protected-access, unused-argument, unused-import
+
+import os
+
+from iceberg.executor.reducer import summarize, reduce_image, read_index
+
+
+# ------------------------------------------------------------------------------
+#
+def test_summarize(tmpdir):
+    """
+    Test that seals are counted from the CSV predictions, and that linked
+    files are no results
+    """
+
+    results = tmpdir.mkdir('a')
+    results.join('a_0.csv').write('x,y\n1,2\n3,4\n')
+    results.join('a_1.csv').write('x,y\n5,6\n\n')
+    results.join('a.shp').write('shape')
+    os.symlink(str(results.join('a.shp')), str(results.join('a.tif')))
+
+    found, megabytes, count = summarize('seals', str(results.join('*')))
+    assert [os.path.basename(path) for path in found] == \
+        ['a.shp', 'a_0.csv', 'a_1.csv']
+    assert count == 3
+    assert megabytes > 0
+    assert summarize('rivers', str(results.join('*.csv')))[2] == 2
+    assert summarize('penguins', str(tmpdir.join('b*'))) == ([], 0, 0)
+
+
+# ------------------------------------------------------------------------------
+#
+def test_reduce_image(tmpdir):
+    """
+    Test that images are appended to the index and the last row of an image
+    wins
+    """
+
+    tmpdir.mkdir('a').join('a.csv').write('x,y\n1,2\n')
+    index = str(tmpdir.join('index', 'seals.csv'))
+
+    reduce_image(index, 'seals', '/d/a.tif', 'P0.S1.T1',
+                 str(tmpdir.join('a', '*')))
+    reduce_image(index, 'seals', '/d/b.tif', 'P1.S1.T1',
+                 str(tmpdir.join('b', '*')))
+    tmpdir.join('a', 'a.csv').write('x,y\n1,2\n3,4\n')
+    reduce_image(index, 'seals', '/d/a.tif', 'P2.S1.T1',
+                 str(tmpdir.join('a', '*')))
+
+    with open(index) as index_file:
+        assert index_file.readline().strip() == \
+            'image,task,results,megabytes,count'
+        assert len(index_file.readlines()) == 3
+    rows = read_index(index)
+    assert sorted(rows) == ['/d/a.tif', '/d/b.tif']
+    assert rows['/d/a.tif']['task'] == 'P2.S1.T1'
+    assert rows['/d/a.tif']['count'] == 2
+    assert rows['/d/a.tif']['results'] == [str(tmpdir.join('a', 'a.csv'))]
+    assert rows['/d/b.tif']['results'] == []
+    assert rows['/d/b.tif']['count'] == 0
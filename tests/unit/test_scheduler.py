@@ -0,0 +1,63 @@
+"""
+Author: Ioannis Paraskevakos
+License: MIT
+Copyright: 2018-2019
+"""
+# pylint: disable=protected-access, unused-argument, unused-import
+
+import pytest
+
+from iceberg.executor.scheduler import (order_images, pack_images,
+                                        batch_images)
+
+
+# ------------------------------------------------------------------------------
+#
+def test_order_images():
+    """
+    Test the submission order policies
+    """
+
+    images = [('a', 2), ('b', 10), ('c', None), ('d', 5)]
+    assert order_images(images) == images
+    assert order_images(images, 'largest') == [('b', 10), ('d', 5), ('a', 2),
+                                               ('c', None)]
+    assert order_images(images, 'lpt') == order_images(images, 'largest')
+    assert order_images(images, 'smallest') == [('c', None), ('a', 2),
+                                                ('d', 5), ('b', 10)]
+    with pytest.raises(ValueError):
+        order_images(images, 'random')
+
+
+# ------------------------------------------------------------------------------
+#
+def test_pack_images():
+    """
+    Test LPT packing
+    """
+
+    images = [('a', 7), ('b', 5), ('c', 4), ('d', 3), ('e', 3), ('f', 2)]
+    slots = pack_images(images, 2)
+    assert len(slots) == 2
+    assert [sum(size for _, size in slot) for slot in slots] == [12, 12]
+    assert slots[0][0] == ('a', 7)
+
+    assert pack_images(images[:1], 4) == [[('a', 7)]]
+    assert pack_images([], 4) == []
+
+
+# ------------------------------------------------------------------------------
+#
+def test_batch_images():
+    """
+    Test grouping images in batches by count and by size
+    """
+
+    images = [('a', 2), ('b', 10), ('c', None), ('d', 5)]
+    assert batch_images(images) == [images]
+    assert batch_images(images, batch_size=3) == [images[:3], images[3:]]
+    assert batch_images(images, batch_mb=8) == [[('a', 2)], [('b', 10)],
+                                                [('c', None), ('d', 5)]]
+    assert batch_images(images, batch_size=1, batch_mb=100) == \
+        [[image] for image in images]
+    assert batch_images([], 2) == []
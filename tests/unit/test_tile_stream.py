@@ -0,0 +1,77 @@
+"""
+Project: ICEBERG middleware Project
+Author: Ioannis Paraskevakos
+License: MIT
+Copyright: 2018-2019
+"""
+# pylint: disable=protected-access, unused-argument, unused-import
+
+import os
+import sys
+import pytest
+
+from iceberg.executor.tile_stream import stream, list_tiles
+
+STUB_TILER = '''
+import os
+import sys
+import time
+
+count = int(sys.argv[1])
+output = sys.argv[-1].split('=', 1)[1]
+for idx in range(count):
+    folder = os.path.join(output, 'row%d' % (idx % 2))
+    if not os.path.isdir(folder):
+        os.makedirs(folder)
+    with open(os.path.join(folder, 'tile%03d.tif' % idx), 'w') as tile:
+        tile.write('tile')
+    time.sleep(0.002)
+sys.exit(int(sys.argv[2]))
+'''
+
+
+# ------------------------------------------------------------------------------
+#
+def test_stream(tmpdir):
+    """
+    Test that every tile is predicted once, in batches, and the tiles are
+    removed
+    """
+
+    tiler = tmpdir.join('tiler.py')
+    tiler.write(STUB_TILER)
+    tiles = str(tmpdir.join('tiles'))
+    predicted = list()
+
+    def model(arguments):
+        assert arguments[:-1] == ['--output_dir=out']
+        batch = arguments[-1].split('=', 1)[1]
+        predicted.append([tile for tile, _ in list_tiles(batch)])
+
+    batches = stream(tiles, [sys.executable, str(tiler), '25', '0'], model,
+                     ['--output_dir=out'], batch_size=10, max_pending=10,
+                     settle=0.05, poll=0.01)
+    assert batches == len(predicted)
+    assert all(len(batch) <= 10 for batch in predicted)
+    assert sorted(os.path.basename(tile) for batch in predicted
+                  for tile in batch) == \
+        ['tile%03d.tif' % idx for idx in range(25)]
+    assert not os.path.exists(tiles)
+
+
+# ------------------------------------------------------------------------------
+#
+def test_stream_failure(tmpdir):
+    """
+    Test that a failed tiling fails the task
+    """
+
+    tiler = tmpdir.join('tiler.py')
+    tiler.write(STUB_TILER)
+    tiles = str(tmpdir.join('tiles'))
+
+    with pytest.raises(RuntimeError):
+        stream(tiles, [sys.executable, str(tiler), '3', '2'],
+               lambda arguments: None, [], batch_size=10, settle=0.05,
+               poll=0.01)
+    assert not os.path.exists(tiles)